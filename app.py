@@ -2,6 +2,10 @@
 
 import sys
 import os
+import time
+
+# 启动计时：从进程开始执行到服务器开始监听
+_process_start = time.perf_counter()
 
 # --- 诊断代码开始 ---
 # 将当前脚本所在的目录手动添加到Python的搜索路径中
@@ -11,26 +15,34 @@ if script_dir not in sys.path:
     sys.path.insert(0, script_dir)
 # --- 诊断代码结束 ---
 
-# --- 验证代码开始 ---
-print("--- 诊断信息 ---")
-print(f"当前工作目录 (os.getcwd): {os.getcwd()}")
-print("Python 模块搜索路径 (sys.path):")
-for path in sys.path:
-    print(f"  - {path}")
-print("--- 诊断信息结束 ---\n")
-# --- 验证代码结束 ---
-
-import os
 import logging
-from flask import Flask, render_template, send_file, send_from_directory
+import threading
+from flask import Flask, Response, jsonify, render_template, request
+from werkzeug.utils import safe_join
 from flask_socketio import SocketIO, emit
 
 from game_manager import WerewolfWebGame
-from image_utils import initialize_player_avatars
-from game_models import GameError, GamePhase, Role
-from config import TTS_CONFIG
+from image_utils import initialize_player_avatars, avatar_store, load_static_image
+from game_models import GameError, Role
+from config import TTS_CONFIG, IMAGE_CONFIG, SERVER_CONFIG, TRACING_CONFIG
 # --- 新增：导入上传工具 ---
 from tts_manager import upload_siliconflow_voices_if_needed
+from circuit_breaker import get_breaker_states
+from rate_limiter import get_limiter_states
+from llm_monitoring import get_decision_stats, get_token_estimate_stats
+from token_budget import get_section_stats
+from tts_monitoring import get_format_stats
+from llm_utils import get_backend_health
+
+# --- 验证代码开始 ---
+if SERVER_CONFIG.get('print_diagnostics', False):
+    print("--- 诊断信息 ---")
+    print(f"当前工作目录 (os.getcwd): {os.getcwd()}")
+    print("Python 模块搜索路径 (sys.path):")
+    for path in sys.path:
+        print(f"  - {path}")
+    print("--- 诊断信息结束 ---\n")
+# --- 验证代码结束 ---
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 
@@ -38,43 +50,111 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'werewolf_game_secret_refactored'
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-game = None
+# 每个Socket.IO连接一局游戏，按连接的 sid 索引；断开连接时释放。
+# 注意：早先全局只有一局游戏，游戏事件通过 socketio.emit 广播给所有已连接的客户端（多开的页面会看到同一局）；
+# 现在每局游戏的事件只发给创建它的连接（见 _ClientChannel），不同页面各自独立开局
+games = {}
+
+# 启动任务（头像处理、TTS音色检查）的就绪状态，通过 /status 查询
+startup_status = {
+    'avatars': 'pending',
+    'tts': 'pending',
+    'startup_seconds': None,
+}
 
 # ... (所有路由和SocketIO事件处理函数保持不变) ...
 @app.route('/')
 def index():
-    initialize_player_avatars()
-    return render_template('index.html')
+    # 头像在服务器启动时增量处理，页面加载不做任何图片处理
+    return render_template('index.html', avatar_sprite=avatar_store.sprite_info())
+
+@app.route('/status')
+def get_status():
+    return jsonify({
+        **startup_status,
+        'games': len(games),
+        'llm_breakers': get_breaker_states(),
+        'llm_rate_limits': get_limiter_states(),
+        'llm_health': get_backend_health(),
+        'llm_decisions': get_decision_stats(),
+        'llm_tokens': {'estimate_vs_reported': get_token_estimate_stats(), 'prompt_sections': get_section_stats()},
+        'tts_formats': get_format_stats()
+    })
+
+def _accepts_webp():
+    return any(mimetype == 'image/webp' for mimetype, _ in request.accept_mimetypes)
+
+def _cached_image_response(data, mimetype, etag, max_age, immutable=False):
+    """构造带强ETag与缓存头的图片响应，命中If-None-Match时返回304。"""
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response.make_conditional(request)
 
 @app.route('/images/<path:filename>')
 def serve_from_images(filename):
-    return send_from_directory('images', filename)
+    path = safe_join(os.path.join(os.getcwd(), 'images'), filename)
+    image = load_static_image(path) if path else None
+    if not image:
+        return "Image not found", 404
+    return _cached_image_response(*image, IMAGE_CONFIG.get('cache_max_age', 86400))
 
 @app.route('/avatar/<int:player_id>')
 def get_avatar(player_id):
     try:
-        processed_folder = os.path.join(os.getcwd(), 'processed_images')
-        avatar_path = os.path.join(processed_folder, f"{player_id}.jpg")
-        if os.path.exists(avatar_path):
-            return send_file(avatar_path, mimetype='image/jpeg')
-        else:
+        avatar = avatar_store.get_avatar(player_id, accept_webp=_accepts_webp())
+        if not avatar:
             return "Avatar not found", 404
+        return _cached_image_response(*avatar, IMAGE_CONFIG.get('cache_max_age', 86400))
     except Exception as e:
         logging.error(f"获取玩家{player_id}头像失败: {e}")
         return "Error loading avatar", 500
 
+@app.route('/avatars/sprite')
+def get_avatar_sprite():
+    sprite = avatar_store.get_sprite(accept_webp=_accepts_webp())
+    if not sprite:
+        return "Sprite not found", 404
+    # URL带版本号，内容变化时URL随之变化，可以长期缓存
+    return _cached_image_response(*sprite, 31536000, immutable=True)
+
+class _ClientChannel:
+    """游戏实例使用的发送通道：事件只发给创建这局游戏的客户端连接。"""
+
+    def __init__(self, sid):
+        self.sid = sid
+
+    def emit(self, event, *args, **kwargs):
+        kwargs.setdefault('to', self.sid)
+        socketio.emit(event, *args, **kwargs)
+
+def _current_game():
+    return games.get(request.sid)
+
+def _dispose_game(sid):
+    """释放该连接的游戏实例的后台资源并移除引用。"""
+    game = games.pop(sid, None)
+    if game:
+        game.shutdown()
+
 @socketio.on('connect')
 def handle_connect():
-    global game
-    game = None
-    logging.info("客户端连接，游戏实例已重置")
+    _dispose_game(request.sid)
+    logging.info(f"客户端连接 ({request.sid})，当前共 {len(games)} 局游戏")
 
 @socketio.on('start_game')
 def handle_start_game(data):
-    global game
     try:
+        _dispose_game(request.sid)
         voice_enabled = data.get('voice_enabled', TTS_CONFIG.get('enabled', False))
-        game = WerewolfWebGame(socketio, voice_enabled=voice_enabled)
+        # 浏览器上报的可解码音频格式，用于协商TTS输出格式
+        audio_formats = data.get('audio_formats')
+        game = WerewolfWebGame(_ClientChannel(request.sid), voice_enabled=voice_enabled, audio_formats=audio_formats)
+        games[request.sid] = game
         logging.info(f"创建全新的游戏实例 (语音模式: {'启用' if voice_enabled else '禁用'})")
         
         game.start_game()
@@ -96,11 +176,13 @@ def handle_start_game(data):
 
 @socketio.on('send_speech')
 def handle_send_speech(data):
+    game = _current_game()
     if game and game.game_started and data.get('text'):
         game.handle_human_speech(data['text'])
 
 @socketio.on('send_discussion_speech')
 def handle_discussion_speech(data):
+     game = _current_game()
      if game and game.discussion_active and data.get('text'):
         player = game.get_human_player()
         if player and player['is_alive']:
@@ -108,10 +190,12 @@ def handle_discussion_speech(data):
 
 @socketio.on('skip_discussion')
 def handle_skip_discussion():
+    game = _current_game()
     if game: game.end_discussion()
 
 @socketio.on('send_vote')
 def handle_vote(data):
+    game = _current_game()
     if game and game.voting_active and data.get('target'):
         try:
             game.human_vote = int(data['target'])
@@ -121,110 +205,132 @@ def handle_vote(data):
 
 @socketio.on('send_night_action')
 def handle_night_action(data):
+    game = _current_game()
     if game and game.night_active and data.get('target'):
         try:
-            game.human_night_target = int(data['target'])
-            game.process_night_action()
+            game.submit_night_action('kill', int(data['target']), from_human=True)
         except (ValueError, TypeError):
             game.emit_error("无效的夜晚目标")
 
 @socketio.on('send_seer_action')
 def handle_seer_action(data):
+    game = _current_game()
     if game and game.game_started and data.get('target'):
-        seer = game.get_seer()
-        if seer and seer['is_human']:
-            try:
-                target_id = int(data['target'])
-                
-                is_pre_game = game.game_state['phase'] == GamePhase.PRE_GAME_SEER.value
-                
-                day = 0 if is_pre_game else game.game_state['day']
-                game.process_seer_check(seer, target_id, day=day)
-                
-                if is_pre_game:
-                    game.start_day_phase()
-                else:
-                    game._handle_werewolf_turn()
-
-            except (ValueError, TypeError):
-                game.emit_error("无效的查验目标")
+        try:
+            game.handle_human_seer_action(int(data['target']))
+        except (ValueError, TypeError):
+            game.emit_error("无效的查验目标")
 
 @socketio.on('restart_game')
 def handle_restart_game():
     logging.info("收到重新加载游戏请求")
-    socketio.emit('reload_page')
+    emit('reload_page')
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    logging.info("客户端断开连接")
+    _dispose_game(request.sid)
+    logging.info(f"客户端断开连接 ({request.sid})，当前共 {len(games)} 局游戏")
 
 
-if __name__ == '__main__':
-    print("=" * 60)
-    print("狼人杀游戏服务器启动中...")
-    print("=" * 60)
-    
-    # 初始化头像
-    print("正在初始化玩家头像...")
-    initialize_player_avatars()
-    print("头像初始化完成")
-    
-    # 检查和设置TTS
+def _prepare_avatars():
+    """增量处理头像并刷新内存缓存。"""
+    try:
+        initialize_player_avatars()
+        avatar_store.refresh()
+        startup_status['avatars'] = 'ready'
+        print("头像初始化完成")
+    except Exception as e:
+        startup_status['avatars'] = 'failed'
+        logging.error(f"头像初始化失败: {e}", exc_info=True)
+
+def _prepare_tts():
+    """检查和设置TTS，返回的状态写入 startup_status['tts']。"""
     tts_provider = TTS_CONFIG.get("default_provider")
     tts_enabled = TTS_CONFIG.get("enabled", False)
     
-    if tts_enabled:
-        print(f"\nTTS功能已启用，使用供应商: {tts_provider}")
+    if not tts_enabled:
+        print("TTS功能已禁用，游戏将以纯文字模式运行")
+        return 'disabled'
+
+    print(f"\nTTS功能已启用，使用供应商: {tts_provider}")
+    
+    if tts_provider == "siliconflow":
+        print("正在配置SiliconFlow TTS...")
         
-        if tts_provider == "siliconflow":
-            print("正在配置SiliconFlow TTS...")
-            
-            # 检查配置
-            siliconflow_config = TTS_CONFIG['providers'].get('siliconflow', {})
-            api_key = siliconflow_config.get('api_key', '')
+        # 检查配置
+        siliconflow_config = TTS_CONFIG['providers'].get('siliconflow', {})
+        api_key = siliconflow_config.get('api_key', '')
+        
+        if not api_key or 'your-siliconflow-api-key-here' in api_key:
+            print("错误: SiliconFlow API Key未配置！")
+            print("请在config.py中设置正确的API Key")
+            print("将以纯文字模式启动（无语音）")
+            return 'unconfigured'
+
+        print("API Key已配置")
+        print("开始音色上传和验证...")
+        
+        try:
+            # 调用增强的上传函数
+            upload_success = upload_siliconflow_voices_if_needed()
             
-            if not api_key or 'your-siliconflow-api-key-here' in api_key:
-                print("错误: SiliconFlow API Key未配置！")
-                print("请在config.py中设置正确的API Key")
-                print("将以纯文字模式启动（无语音）")
-            else:
-                print("API Key已配置")
-                print("开始音色上传和验证...")
+            if upload_success:
+                print("SiliconFlow TTS配置完成！")
+                print("游戏中AI角色将有语音播放")
+                return 'ready'
+            print("警告: TTS配置未完全成功，部分功能可能受限")
+            print("建议检查API配额和网络连接")
+            print("游戏仍可正常运行（无语音或部分语音）")
+            return 'degraded'
                 
-                try:
-                    # 调用增强的上传函数
-                    upload_success = upload_siliconflow_voices_if_needed()
-                    
-                    if upload_success:
-                        print("SiliconFlow TTS配置完成！")
-                        print("游戏中AI角色将有语音播放")
-                    else:
-                        print("警告: TTS配置未完全成功，部分功能可能受限")
-                        print("建议检查API配额和网络连接")
-                        print("游戏仍可正常运行（无语音或部分语音）")
-                        
-                except Exception as e:
-                    print(f"错误: TTS配置过程中出现错误: {e}")
-                    print("将以纯文字模式启动")
-                    
-        elif tts_provider == "local_gsv":
-            print("使用本地GSV TTS服务")
-            print("请确保GSV服务在 http://127.0.0.1:9880 运行")
-        else:
-            print(f"警告: 未知的TTS供应商: {tts_provider}")
+        except Exception as e:
+            print(f"错误: TTS配置过程中出现错误: {e}")
             print("将以纯文字模式启动")
+            return 'failed'
+                
+    elif tts_provider == "local_gsv":
+        print("使用本地GSV TTS服务")
+        print("请确保GSV服务在 http://127.0.0.1:9880 运行")
+        return 'ready'
+
+    print(f"警告: 未知的TTS供应商: {tts_provider}")
+    print("将以纯文字模式启动")
+    return 'failed'
+
+def _run_startup_tasks():
+    _prepare_avatars()
+    startup_status['tts'] = _prepare_tts()
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("狼人杀游戏服务器启动中...")
+    print("=" * 60)
+    
+    if '--trace' in sys.argv[1:]:
+        TRACING_CONFIG['enabled'] = True
+        print(f"性能追踪已开启，每局的trace文件写入 {TRACING_CONFIG.get('output_dir', 'traces')}/")
+
+    fast_start = SERVER_CONFIG.get('fast_start', True)
+    if fast_start:
+        # 快速启动：头像与音色检查放到后台，服务器立即开始监听，进度通过 /status 查询
+        print("快速启动模式：头像与TTS音色检查在后台进行，可访问 /status 查看进度")
+        threading.Thread(target=_run_startup_tasks, name="startup-tasks", daemon=True).start()
     else:
-        print("TTS功能已禁用，游戏将以纯文字模式运行")
+        print("正在初始化玩家头像...")
+        _run_startup_tasks()
     
     # 启动服务器
+    startup_status['startup_seconds'] = round(time.perf_counter() - _process_start, 3)
     print("\n" + "=" * 60)
-    print("启动游戏服务器...")
+    print(f"启动游戏服务器... (启动耗时 {startup_status['startup_seconds']:.3f} 秒)")
     print("访问地址: http://localhost:5000")
     print("开始您的狼人杀之旅！")
     print("=" * 60)
     
     try:
-        socketio.run(app, debug=True, host='0.0.0.0', port=5000)
+        # 调试重载器会再启动一个子进程并重复全部启动工作，快速启动模式下关闭
+        socketio.run(app, debug=True, use_reloader=not fast_start, host='0.0.0.0', port=5000)
     except KeyboardInterrupt:
         print("\n游戏服务器已停止")
     except Exception as e:
@@ -0,0 +1,222 @@
+# audio_timeline.py
+
+import asyncio
+import struct
+import threading
+import time
+from config import TTS_CONFIG
+
+# --- 音频时长解析 ---
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+def _wav_duration(data: bytes) -> float | None:
+    """从RIFF/WAVE头读取时长。流式WAV的data长度常为0或0xFFFFFFFF，此时按剩余字节计算。"""
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None
+    byte_rate = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack_from('<I', data, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b'fmt ' and body + 12 <= len(data):
+            byte_rate = struct.unpack_from('<I', data, body + 8)[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            remaining = len(data) - body
+            if chunk_size == 0 or chunk_size > remaining:
+                chunk_size = remaining
+            return chunk_size / byte_rate
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+def _mp3_duration(data: bytes) -> float | None:
+    """逐帧累加MPEG音频帧的采样数计算时长。"""
+    offset = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = ((data[6] & 0x7f) << 21) | ((data[7] & 0x7f) << 14) | ((data[8] & 0x7f) << 7) | (data[9] & 0x7f)
+        offset = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    duration = 0.0
+    frames = 0
+    while offset + 4 <= len(data):
+        header = struct.unpack_from('>I', data, offset)[0]
+        if (header >> 21) & 0x7ff != 0x7ff:
+            offset += 1
+            continue
+        version_bits = (header >> 19) & 0x3
+        layer_bits = (header >> 17) & 0x3
+        bitrate_index = (header >> 12) & 0xf
+        sample_rate_index = (header >> 10) & 0x3
+        padding = (header >> 9) & 0x1
+        if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            offset += 1
+            continue
+
+        version = {0: 2.5, 2: 2, 3: 1}[version_bits]
+        layer = 4 - layer_bits
+        bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+        if layer == 1:
+            samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if (layer == 2 or version == 1) else 576
+            frame_length = samples // 8 * bitrate // sample_rate + padding
+
+        duration += samples / sample_rate
+        frames += 1
+        offset += frame_length
+    return duration if frames else None
+
+_AAC_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+def _ogg_duration(data: bytes) -> float | None:
+    """用最后一页的granule position除以采样率计算Ogg(Opus/Vorbis)时长。"""
+    sample_rate = None
+    pre_skip = 0
+    last_granule = -1
+    offset = 0
+    while offset + 27 <= len(data) and data[offset:offset + 4] == b'OggS':
+        granule = struct.unpack_from('<q', data, offset + 6)[0]
+        segments = data[offset + 26]
+        header_end = offset + 27 + segments
+        body_size = sum(data[offset + 27:header_end])
+        if sample_rate is None:
+            packet = data[header_end:header_end + body_size]
+            if packet[:8] == b'OpusHead' and len(packet) >= 12:
+                sample_rate = 48000
+                pre_skip = struct.unpack_from('<H', packet, 10)[0]
+            elif packet[:7] == b'\x01vorbis' and len(packet) >= 16:
+                sample_rate = struct.unpack_from('<I', packet, 12)[0]
+        if granule >= 0:
+            last_granule = granule
+        offset = header_end + body_size
+    if not sample_rate or last_granule < 0:
+        return None
+    return max(0, last_granule - pre_skip) / sample_rate
+
+def _adts_duration(data: bytes) -> float | None:
+    """逐帧累加ADTS封装的AAC帧计算时长。"""
+    duration = 0.0
+    frames = 0
+    offset = 0
+    while offset + 7 <= len(data):
+        if data[offset] != 0xFF or (data[offset + 1] & 0xF6) != 0xF0:
+            offset += 1
+            continue
+        sample_rate_index = (data[offset + 2] >> 2) & 0xF
+        frame_length = ((data[offset + 3] & 0x3) << 11) | (data[offset + 4] << 3) | (data[offset + 5] >> 5)
+        if sample_rate_index >= len(_AAC_SAMPLE_RATES) or frame_length < 7:
+            offset += 1
+            continue
+        blocks = (data[offset + 6] & 0x3) + 1
+        duration += 1024 * blocks / _AAC_SAMPLE_RATES[sample_rate_index]
+        frames += 1
+        offset += frame_length
+    return duration if frames else None
+
+def get_audio_duration(data: bytes) -> float | None:
+    """解析WAV、Ogg、AAC(ADTS)或MP3音频数据的播放时长（秒），无法识别时返回None。"""
+    if not data:
+        return None
+    if data[:4] == b'RIFF':
+        return _wav_duration(data)
+    if data[:4] == b'OggS':
+        return _ogg_duration(data)
+    if len(data) > 1 and data[0] == 0xFF and (data[1] & 0xF6) == 0xF0:
+        return _adts_duration(data)
+    return _mp3_duration(data)
+
+# --- 服务端音频时间线 ---
+class AudioSlot:
+    """时间线上一位发言者的播放时段。"""
+
+    def __init__(self, timeline: 'AudioTimeline', player_id: int, previous: 'AudioSlot' = None):
+        self.timeline = timeline
+        self.player_id = player_id
+        self.previous = previous
+        self.started = False
+        self.end_at = 0.0
+        self.finished = threading.Event()
+
+    async def wait_turn(self):
+        """等待前一位发言者的音频全部播完后再开始本时段。"""
+        previous = self.previous
+        if previous is not None:
+            deadline = time.monotonic() + self.timeline.max_wait
+            while not previous.finished.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            delay = previous.end_at + self.timeline.gap - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(min(delay, self.timeline.max_wait))
+        # 前序时段已不再需要，断开引用避免整局的时段链常驻内存
+        self.previous = None
+        self.started = True
+        self.end_at = time.monotonic()
+
+    def add_chunk(self, duration: float):
+        """记录一个已发送音频块的时长，顺延本时段的结束时刻。"""
+        self.end_at = max(self.end_at, time.monotonic()) + duration
+
+    def finish(self):
+        """标记本时段不再有新的音频块。"""
+        self.previous = None
+        self.finished.set()
+
+class AudioTimeline:
+    """
+    单局游戏的服务端音频时间线。
+    发言者按发言顺序预约时段，前一位的音频按真实时长播完后，后一位才开始下发音频。
+    """
+
+    def __init__(self):
+        config = TTS_CONFIG.get('audio_timeline', {})
+        self.gap = config.get('gap', 0.3)
+        self.max_wait = config.get('max_wait', 60.0)
+        self.fallback_chars_per_second = config.get('fallback_chars_per_second', 4.5)
+        self._lock = threading.Lock()
+        self._last_slot = None
+
+    def reserve(self, player_id: int) -> AudioSlot:
+        """按调用顺序为发言者预约下一个时段（需在发言产生时同步调用以保证顺序）。"""
+        with self._lock:
+            slot = AudioSlot(self, player_id, previous=self._last_slot)
+            self._last_slot = slot
+            return slot
+
+    def estimate_duration(self, data: bytes, text: str = "") -> float:
+        """读取音频真实时长，解析失败时按文本长度估算。"""
+        duration = get_audio_duration(data)
+        if duration is None:
+            duration = len(text) / self.fallback_chars_per_second if text else 0.0
+        return duration
+
+    def wait_until_idle(self, timeout: float = None) -> bool:
+        """阻塞等待当前最后一个时段的音频播完，返回是否在超时前完成。"""
+        with self._lock:
+            slot = self._last_slot
+        if slot is None:
+            return True
+        if timeout is None:
+            timeout = self.max_wait
+        deadline = time.monotonic() + timeout
+        if not slot.finished.wait(timeout):
+            return False
+        remaining = min(slot.end_at - time.monotonic(), deadline - time.monotonic())
+        if remaining > 0:
+            time.sleep(remaining)
+        return time.monotonic() >= slot.end_at
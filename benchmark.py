@@ -0,0 +1,338 @@
+# benchmark.py
+"""
+微基准测试：生成 8/12/20 人、1~30 天的合成对局，测量prompt构建、历史渲染、状态持久化、
+客户端状态构建与TTS文本切分的吞吐量和内存分配。结果保存为JSON，便于在不同版本之间比较。
+--vote-phase 测量 8~24 人桌一次完整AI投票阶段的耗时（只把供应商的HTTP请求替换为固定延迟，
+熔断器与限流器仍在调用路径上），检验大桌的并行度；--llm-rpm 按给定配额启用限流器。
+
+用法:
+    python benchmark.py                          # 运行全部基准，结果写入 benchmarks/
+    python benchmark.py --quick                  # 缩短每项的测量时间
+    python benchmark.py --players 8 --days 1 30  # 只跑指定规模
+    python benchmark.py --vote-phase             # 投票阶段耗时随人数的变化
+    python benchmark.py --vote-phase --llm-rpm 60 --rounds 1   # 同上，限流器按每分钟60次请求放行
+    python benchmark.py --compare benchmarks/旧.json benchmarks/新.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from config import TTS_CONFIG, LLM_PROVIDERS, LLM_RATE_LIMIT_CONFIG
+from game_models import Role, GamePhase
+import llm_monitoring
+import llm_utils
+import rate_limiter
+from game_manager import WerewolfWebGame
+from llm_utils import (construct_llm_prompt, construct_voting_prompt, construct_werewolf_kill_prompt,
+                       _build_game_history_text, _extractive_day_summary)
+from player_memory import init_memories, record_votes
+from seating import seat_nickname, human_seat, decision_workers
+from tts_manager import split_text_for_tts, _DEFAULT_CHUNK_POLICY
+
+RESULTS_DIR = "benchmarks"
+DEFAULT_PLAYERS = (8, 12, 20)
+DEFAULT_DAYS = (1, 10, 30)
+VOTE_PHASE_PLAYERS = (8, 12, 16, 20, 24)
+
+# 合成发言模板：覆盖身份声明、查验声明、指认和站边，让玩家记忆的解析路径都被走到
+_SPEECH_TEMPLATES = [
+    "我是村民，昨天{a}号的发言前后矛盾，我比较怀疑{a}号，{b}号的逻辑我暂时相信。",
+    "我是预言家，昨晚查验了{a}号，{a}号是金水。今天建议大家投{b}号，他的发言有问题。",
+    "我觉得{a}号像狼，一直在带节奏；{b}号说的不在场证明站不住脚，我支持{c}号的看法。",
+    "过。信息太少了，先听听大家的，我再决定投谁。",
+    "{a}号在说谎，他昨天说要投{b}号，结果票却给了{c}号。我站边{b}号，今天出{a}号。",
+    "我查了{a}号是查杀，他就是狼人。请大家相信我，{b}号和{c}号都是好人。",
+]
+
+class _NullSocketIO:
+    """只统计事件数的Socket.IO替身，基准测试不需要真实连接。"""
+
+    def __init__(self):
+        self.emitted = 0
+
+    def emit(self, *args, **kwargs):
+        self.emitted += 1
+
+def _speech_text(rng: random.Random, alive_ids: list, speaker_id: int) -> str:
+    others = [pid for pid in alive_ids if pid != speaker_id] or alive_ids
+    a, b, c = (rng.choice(others) for _ in range(3))
+    return rng.choice(_SPEECH_TEMPLATES).format(a=a, b=b, c=c)
+
+def build_synthetic_game(players_count: int, days: int, seed: int = 0) -> WerewolfWebGame:
+    """
+    通过游戏管理器自身的记录函数推进一局合成对局：每天每人按序发言一次并有若干自由讨论，
+    第二天起每天投票淘汰一人，每晚预言家查验、狼人淘汰一人；存活人数过少时不再淘汰。
+    """
+    rng = random.Random(seed)
+    game = WerewolfWebGame(_NullSocketIO(), voice_enabled=False)
+    werewolves_count = max(2, players_count // 4)
+    roles = [Role.WEREWOLF.value] * werewolves_count + [Role.SEER.value] + \
+            [Role.VILLAGER.value] * (players_count - werewolves_count - 1)
+    rng.shuffle(roles)
+    human_id = human_seat(players_count)
+    game.game_state = {
+        "game_id": f"bench_{players_count}p_{days}d", "total_players": players_count, "day": 1,
+        "phase": GamePhase.DAY.value, "game_log": [],
+        "players": [{"id": pid, "nickname": seat_nickname(pid, pid == human_id), "role": role, "is_alive": True,
+                     "is_human": pid == human_id} for pid, role in zip(range(1, players_count + 1), roles)],
+    }
+    for player in game.game_state['players']:
+        if player['role'] == Role.SEER.value:
+            player['seer_knowledge'] = []
+    init_memories(game.game_state)
+    min_alive = max(4, werewolves_count + 2)
+
+    def eliminate(candidates, reason):
+        if len(game.get_alive_players()) > min_alive and candidates:
+            game.eliminate_player(rng.choice(candidates), reason)
+
+    for day in range(1, days + 1):
+        game.game_state['day'] = day
+        alive_ids = [p['id'] for p in game.get_alive_players()]
+        for speaker_id in alive_ids:
+            game.add_speech_to_log(speaker_id, _speech_text(rng, alive_ids, speaker_id))
+        for _ in range(len(alive_ids) // 2):
+            speaker_id = rng.choice(alive_ids)
+            game.add_speech_to_log(speaker_id, _speech_text(rng, alive_ids, speaker_id))
+        if day == days:
+            break
+
+        if day > 1:
+            ballots = {voter: rng.choice([pid for pid in alive_ids if pid != voter]) for voter in alive_ids}
+            record_votes(game.game_state, day, ballots)
+            eliminate([pid for pid in alive_ids if pid != human_id], 'vote')
+
+        seer = game.get_seer()
+        if seer and seer['is_alive']:
+            checked = {check['checked_id'] for check in seer['seer_knowledge']}
+            targets = [p['id'] for p in game.get_alive_players() if p['id'] != seer['id'] and p['id'] not in checked]
+            if targets:
+                game.process_seer_check(seer, rng.choice(targets))
+        eliminate([p['id'] for p in game.get_alive_players() if p['role'] != Role.WEREWOLF.value and p['id'] != human_id], 'night')
+
+        day_log = next(log for log in game.game_state['game_log'] if log['day'] == day)
+        game.game_state.setdefault('day_summaries', {})[str(day)] = _extractive_day_summary(game.game_state, day_log, 300)
+    return game
+
+def _measure(fn, min_time: float, alloc_iterations: int) -> dict:
+    """反复调用 fn 至少 min_time 秒，返回单次耗时分布、吞吐量与 tracemalloc 下的内存分配。"""
+    fn()  # 预热（导入、缓存、正则编译）
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline or len(samples) < 5:
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_iterations):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            result = fn()
+            after, peak = tracemalloc.get_traced_memory()
+            del result
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "iterations": len(samples),
+        "ops_per_s": round(len(samples) / sum(samples), 1),
+        "mean_us": round(statistics.fmean(samples) * 1e6, 2),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6, 2),
+        "alloc_peak_kb": round(statistics.median(peaks) / 1024, 2),
+        "alloc_retained_bytes": int(statistics.median(retained)),
+    }
+
+def _cases(game: WerewolfWebGame, save_dir: str) -> dict:
+    """一局对局上要测量的函数，键为报告中的名称。"""
+    game_state = game.game_state
+    alive = game.get_alive_players()
+    speaker = next(p for p in alive if not p['is_human'])
+    werewolf = next((p for p in alive if p['role'] == Role.WEREWOLF.value), None)
+    speeches = [s['text'] for log in game_state['game_log'] for s in log['speeches']]
+    long_speech = "".join(speeches[:6])
+    policies = {name: {**_DEFAULT_CHUNK_POLICY, **provider.get('chunk_policy', {})}
+                for name, provider in TTS_CONFIG['providers'].items()}
+    game.game_file_path = os.path.join(save_dir, f"{game_state['game_id']}.json")
+
+    cases = {
+        "construct_llm_prompt": lambda: construct_llm_prompt(game_state, speaker['id']),
+        "construct_voting_prompt": lambda: construct_voting_prompt(game_state, speaker['id']),
+        "_build_game_history_text": lambda: _build_game_history_text(game_state),
+        "_save_game_state": game._save_game_state,
+        "emit_game_state": game.emit_game_state,
+    }
+    if werewolf:
+        cases["construct_werewolf_kill_prompt"] = lambda: construct_werewolf_kill_prompt(game_state, werewolf['id'])
+    for name, policy in policies.items():
+        cases[f"split_text[{name}]"] = lambda policy=policy: split_text_for_tts(long_speech, policy)
+    return cases
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def _new_results(settings: dict) -> dict:
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "cases": [],
+    }
+
+def run(players: list, days: list, min_time: float, alloc_iterations: int, seed: int) -> dict:
+    results = _new_results({"min_time": min_time, "alloc_iterations": alloc_iterations, "seed": seed})
+    with tempfile.TemporaryDirectory(prefix="werewolf-bench-") as save_dir:
+        for players_count in players:
+            for day_count in days:
+                game = build_synthetic_game(players_count, day_count, seed)
+                speech_count = sum(len(log['speeches']) for log in game.game_state['game_log'])
+                print(f"--- {players_count}人 {day_count}天（{speech_count}条发言，存活{len(game.get_alive_players())}人）---")
+                for name, fn in _cases(game, save_dir).items():
+                    stats = _measure(fn, min_time, alloc_iterations)
+                    results["cases"].append({"function": name, "players": players_count, "days": day_count, **stats})
+                    print(f"  {name:<32} {stats['ops_per_s']:>10.1f} ops/s  p50 {stats['p50_us']:>10.1f}us  "
+                          f"峰值分配 {stats['alloc_peak_kb']:>8.1f}KB")
+    return results
+
+def run_vote_phase(players: list, latency: float, rounds: int, seed: int, rpm: float = 0) -> list:
+    """
+    测量 _collect_ai_votes 的墙钟耗时。只有供应商的HTTP请求被替换为固定等待 latency 秒后返回合法的投票，
+    prompt构建、熔断器、限流器与回复解析都走真实代码，因此耗时 ≈ latency × 批次数 + 调度开销 + 限流等待；
+    并行度足够且未限流时各人数下应保持持平。rpm > 0 时为默认供应商启用每分钟 rpm 次请求的限流器。
+    """
+    def fake_provider(provider_name, config, prompt, call_type, generation_params, response_schema=None, cancel_token=None):
+        time.sleep(latency)
+        arguments = response_schema['properties']['arguments']['properties']
+        return {"tool_name": response_schema['properties']['tool_name']['enum'][0],
+                "arguments": {"player_id": arguments['player_id']['enum'][0], "reason": ""},
+                "prompt_tokens": 0, "completion_tokens": 0}
+
+    cases = []
+    backend = LLM_PROVIDERS.get("default", "ollama")
+    saved_rate_limit = {key: LLM_RATE_LIMIT_CONFIG[key] for key in ('enabled', 'backends')}
+    original_provider, original_log_file = llm_utils._call_provider, llm_monitoring.LOG_FILE
+    # 调用日志写入临时目录，不追加到仓库中的 llm_calls.jsonl
+    log_dir = tempfile.TemporaryDirectory(prefix="werewolf-bench-votes-")
+    llm_utils._call_provider = fake_provider
+    llm_monitoring.LOG_FILE = os.path.join(log_dir.name, "llm_calls.jsonl")
+    if rpm > 0:
+        LLM_RATE_LIMIT_CONFIG['enabled'] = True
+        LLM_RATE_LIMIT_CONFIG['backends'] = {backend: {"requests_per_minute": rpm}}
+    else:
+        LLM_RATE_LIMIT_CONFIG['enabled'] = False
+    try:
+        for players_count in players:
+            game = build_synthetic_game(players_count, 2, seed)
+            computers = [p for p in game.get_alive_players() if not p['is_human']]
+            game._collect_ai_votes(computers)  # 预热
+            samples = []
+            for _ in range(rounds):
+                # 每轮从满额度开始，测量的是一次投票阶段本身的限流等待
+                rate_limiter._limiters.pop(backend, None)
+                start = time.perf_counter()
+                game._collect_ai_votes(computers)
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            case = {
+                "function": "vote_phase", "players": players_count, "days": 2,
+                "voters": len(computers), "workers": decision_workers(len(computers), players_count),
+                "llm_latency_s": latency, "llm_rpm": rpm, "rounds": rounds,
+                "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+                "max_us": round(samples[-1] * 1e6, 2),
+                "alloc_peak_kb": 0.0,
+            }
+            cases.append(case)
+            print(f"  vote_phase {players_count:>3}人 {case['voters']:>3}票 {case['workers']:>3}并行  "
+                  f"p50 {case['p50_us'] / 1000:>8.1f}ms  max {case['max_us'] / 1000:>8.1f}ms")
+    finally:
+        llm_utils._call_provider, llm_monitoring.LOG_FILE = original_provider, original_log_file
+        LLM_RATE_LIMIT_CONFIG.update(saved_rate_limit)
+        rate_limiter._limiters.pop(backend, None)
+        log_dir.cleanup()
+    if cases:
+        base = cases[0]["p50_us"]
+        print(f"  {cases[-1]['players']}人相对{cases[0]['players']}人: {cases[-1]['p50_us'] / base:.2f}x")
+    return cases
+
+def _case_key(case: dict) -> tuple:
+    return case["function"], case["players"], case["days"]
+
+def compare(old_path: str, new_path: str):
+    """按函数与规模对比两次结果的p50耗时与峰值分配。"""
+    with open(old_path, encoding='utf-8') as f:
+        old = {_case_key(c): c for c in json.load(f)["cases"]}
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)["cases"]
+    print(f"{'函数':<32} {'规模':>10} {'p50(旧→新)':>24} {'变化':>8} {'峰值分配KB(旧→新)':>22}")
+    for case in new:
+        before = old.get(_case_key(case))
+        if not before:
+            continue
+        change = (case["p50_us"] - before["p50_us"]) / before["p50_us"] * 100 if before["p50_us"] else 0.0
+        print(f"{case['function']:<32} {case['players']:>4}人{case['days']:>3}天 "
+              f"{before['p50_us']:>10.1f}→{case['p50_us']:<10.1f}us {change:>+7.1f}% "
+              f"{before['alloc_peak_kb']:>10.1f}→{case['alloc_peak_kb']:<10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="狼人杀服务端热点函数的微基准测试")
+    parser.add_argument("--players", type=int, nargs="+", default=list(DEFAULT_PLAYERS), help="对局人数")
+    parser.add_argument("--days", type=int, nargs="+", default=list(DEFAULT_DAYS), help="对局天数")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每项至少测量的秒数")
+    parser.add_argument("--alloc-iterations", type=int, default=20, help="统计内存分配时的调用次数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="每项只测量0.1秒")
+    parser.add_argument("--output", help="结果JSON路径，默认写入 benchmarks/ 目录")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两个结果文件")
+    parser.add_argument("--vote-phase", action="store_true", help="只测量投票阶段耗时随人数的变化")
+    parser.add_argument("--vote-players", type=int, nargs="+", default=list(VOTE_PHASE_PLAYERS), help="投票阶段基准的对局人数")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="投票阶段基准中每次LLM调用的模拟延迟（秒）")
+    parser.add_argument("--rounds", type=int, default=5, help="投票阶段基准每个人数重复的次数")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="投票阶段基准中启用限流器的每分钟请求数，0表示不限流")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # prompt超预算裁剪等信息日志会淹没输出
+    logging.basicConfig(level=logging.WARNING)
+    min_time = 0.1 if args.quick else args.min_time
+    if args.vote_phase:
+        results = _new_results({"llm_latency": args.llm_latency, "llm_rpm": args.llm_rpm, "rounds": args.rounds, "seed": args.seed})
+        results["cases"] = run_vote_phase(args.vote_players, args.llm_latency, args.rounds, args.seed, args.llm_rpm)
+    else:
+        results = run(args.players, args.days, min_time, args.alloc_iterations, args.seed)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        suffix = results["git_revision"] or "local"
+        output = os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{suffix}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# cancellation.py
+
+import threading
+import time
+
+class CancelledError(Exception):
+    """操作已被取消或已超过截止时间。"""
+
+class CancellationToken:
+    """
+    协作式取消令牌。
+    阶段结束、游戏结束或对局被替换时调用 cancel()，持有令牌的LLM调用会中断网络请求并跳过后续重试；
+    可选的截止时间会同时限制请求超时。子令牌随父令牌一起取消。
+    """
+
+    def __init__(self, deadline: float = None, parent: 'CancellationToken' = None):
+        """:param deadline: time.monotonic() 下的截止时刻，None 表示不限"""
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._detach = lambda: None
+        if parent is not None:
+            if parent.deadline is not None:
+                self.deadline = parent.deadline if deadline is None else min(deadline, parent.deadline)
+            # 子令牌先于父令牌结束时从父令牌注销，避免长期存在的父令牌累积回调
+            self._detach = parent.on_cancel(lambda: self.cancel(parent.reason))
+
+    def child(self, deadline: float = None) -> 'CancellationToken':
+        return CancellationToken(deadline=deadline, parent=self)
+
+    def cancel(self, reason: str = "已取消"):
+        """取消令牌并依次执行登记的回调（如中断网络连接），重复调用无效果。"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        self._detach()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("已超过截止时间")
+            return True
+        return False
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise CancelledError(self.reason)
+
+    def remaining(self) -> float | None:
+        """距截止时间的秒数，无截止时间时返回None。"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, default: float = None) -> float | None:
+        """请求超时取 default 与剩余时间中较小者。"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return remaining if default is None else min(default, remaining)
+
+    def sleep(self, seconds: float) -> bool:
+        """可被取消打断的等待，返回等待期间是否已被取消。"""
+        timeout = self.timeout(seconds)
+        self._event.wait(timeout)
+        return self.cancelled
+
+    def on_cancel(self, callback):
+        """登记取消时执行的回调；已取消时立即执行。返回注销函数。"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
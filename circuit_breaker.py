@@ -0,0 +1,135 @@
+# circuit_breaker.py
+
+import logging
+import threading
+import time
+from config import LLM_CIRCUIT_BREAKER_CONFIG
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被直接拒绝。"""
+
+class CircuitBreaker:
+    """
+    单个LLM供应商的熔断器（关闭/打开/半开）。
+    连续失败达到阈值后打开，所有调用立即失败；后台线程定期探测，探测成功后恢复关闭。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, probe=None, config: dict = None):
+        config = config if config is not None else LLM_CIRCUIT_BREAKER_CONFIG
+        self.name = name
+        self.probe = probe
+        self.enabled = config.get('enabled', True)
+        self.failure_threshold = config.get('failure_threshold', 3)
+        self.recovery_timeout = config.get('recovery_timeout', 30.0)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def allow_request(self) -> bool:
+        """是否允许发起真实调用；打开或半开（正在探测）时拒绝。"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            recovered = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+        if recovered:
+            logging.info(f"LLM供应商 {self.name} 已恢复，熔断器关闭")
+
+    def record_failure(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.CLOSED and self.consecutive_failures < self.failure_threshold:
+                return
+            was_closed = self.state == self.CLOSED
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            start_probe = self._probe_thread is None
+            if start_probe:
+                self._probe_thread = threading.Thread(target=self._probe_loop, name=f"breaker-probe-{self.name}", daemon=True)
+        if was_closed:
+            logging.warning(f"LLM供应商 {self.name} 连续失败 {self.consecutive_failures} 次，熔断器打开，{self.recovery_timeout}秒后开始探测")
+        if start_probe:
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """
+        打开期间在后台按恢复间隔探测供应商，成功则关闭熔断器。
+        退出时在改变状态的同一把锁内清除 _probe_thread，之后的失败总能重新启动探测。
+        """
+        while True:
+            time.sleep(self.recovery_timeout)
+            with self._lock:
+                if self.state == self.CLOSED:
+                    self._probe_thread = None
+                    return
+                if self.probe is None:
+                    # 没有探测函数时直接放行，由下一次真实调用决定是否恢复
+                    self.state = self.CLOSED
+                    self.consecutive_failures = self.failure_threshold - 1
+                    self._probe_thread = None
+                    logging.info(f"LLM供应商 {self.name} 熔断器进入试探状态")
+                    return
+                self.state = self.HALF_OPEN
+            try:
+                self.probe()
+            except Exception as e:
+                logging.info(f"LLM供应商 {self.name} 探测失败，继续保持熔断: {e}")
+                with self._lock:
+                    self.state = self.OPEN
+                    self.opened_at = time.monotonic()
+                continue
+            with self._lock:
+                self.state = self.CLOSED
+                self.consecutive_failures = 0
+                self.opened_at = None
+                self._probe_thread = None
+            logging.info(f"LLM供应商 {self.name} 已恢复，熔断器关闭")
+            return
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_for_s": round(time.monotonic() - self.opened_at, 1) if self.opened_at else None,
+                "rejected": self.rejected,
+            }
+
+# 进程内按供应商共享，跨调用和跨对局生效
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str, probe=None) -> CircuitBreaker:
+    """获取（必要时创建）指定供应商的熔断器。"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, probe)
+            _breakers[name] = breaker
+        elif breaker.probe is None and probe is not None:
+            breaker.probe = probe
+        return breaker
+
+def get_breaker_states() -> dict:
+    """所有熔断器的当前状态。"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -5,11 +5,19 @@ siliconflow_api_key = ""
 # ==============================================================================
 # 1. 游戏核心配置
 # ==============================================================================
+SERVER_CONFIG = {
+    'fast_start': True,          # 快速启动：头像处理与TTS音色检查在后台进行，并关闭调试重载器
+    'print_diagnostics': False,  # 启动时打印工作目录与sys.path诊断信息
+}
+
 IMAGE_CONFIG = {
     'avatar_size': (100, 100),
     'supported_formats': ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'],
     'output_format': 'JPEG',
-    'quality': 85
+    'quality': 85,
+    'process_workers': None,  # 头像处理进程数，None表示按CPU核数（仅在多张图片需要处理时启用进程池）
+    'cache_max_age': 86400,   # 头像与图片的浏览器缓存时间（秒），过期后凭ETag得到304
+    'static_cache_entries': 16,  # 内存中缓存的静态图片（如彩蛋图片）数量上限
 }
 
 GAME_CONFIG = {
@@ -24,8 +32,31 @@ GAME_CONFIG = {
     'villagers_count': 5,   
     # --- 核心修改区结束 ---
 
+    'human_player_id': 7,               # 人类玩家的座位号
+    'human_nickname': "请输入文本",      # 人类玩家的昵称，NICKNAMES 中该座位的昵称只用于AI玩家
+    'max_decision_workers': 8,          # 普通桌投票/夜间决策的最大并行数（8人桌的AI可同时决策）
+
+    # 大桌模式：人数达到阈值时启用。身份数量之和与人数不符时自动按人数生成，
+    # 决策并行度随人数增长，prompt中的玩家名单改用紧凑的编号区间
+    'large_table': {
+        'threshold': 12,
+        'max_decision_workers': 32,     # 大桌投票/夜间决策的最大并行数
+        'compact_roster': True,         # 名单与发言记录只写编号，不重复昵称
+        'pack_kill': True,              # 所有AI狼人并行提名淘汰目标，取票数最多者
+    },
+
     'computer_speech_delay': (2, 4),    # LLM后端发起延迟随机区间，最大值不建议超过5s
     'discussion_probability': 0.25,     # 自由发言期间发言概率
+
+    # 自由讨论调度：限制并发与每轮讨论的调用预算，讨论结束后不再发起新调用
+    'discussion_scheduler': {
+        'max_concurrent_calls': 2,      # 同时进行的讨论LLM调用上限
+        'max_calls': 12,                # 每轮讨论最多发起的调用次数
+        'max_tokens': 40000,            # 每轮讨论的token预算（prompt估算 + 回复预留）
+        'completion_token_reserve': 120,
+        'cooldown': (5, 15),            # 每位AI两次发言机会之间的随机间隔（秒）
+        'min_remaining': 5.0,           # 剩余时间少于此值时不再发起调用
+    },
 }
 
 # ==============================================================================
@@ -39,7 +70,7 @@ NICKNAMES = {
     4: "超级头槌",
     5: "水月",
     6: "牢猫",
-    7: "请输入文本", # 注意，玩家总是7号
+    7: "流萤",
     8: "黑塔",
 }
 
@@ -50,9 +81,22 @@ PERSONAS = {
     4: "你是一位和平主义者，极力避免冲突。你的发言总是试图调和矛盾，安抚大家情绪，呼吁团结，语气温和、委婉。",
     5: "你是一位推理小说爱好者。你的发言喜欢使用比喻和推理小说中的术语（如'线索'、'不在场证明'、'嫌疑人'），并试图构建一个完整的'案件'故事。",
     6: "你是一位充满激情的冒险家。你的发言大胆、自信，喜欢凭直觉下判断，并号召大家跟随你的感觉走，富有煽动性。",
+    7: "你是一位温柔而坚定的守护者。你的发言真诚，重视每个人的感受，但在关键问题上立场坚定，会为自己信任的人据理力争。",
     8: "你是一位好奇心旺盛的剑客，发言总是充满激情，喜欢挑战性", 
 }
 
+# 大桌模式下未单独配置人设的座位依次使用以下人设
+EXTRA_PERSONAS = [
+    "你是一位经验丰富的老玩家。你的发言喜欢复盘前几天的票型和发言顺序，用数据说话，语气老练。",
+    "你是一位心直口快的新手。你的发言朴实，常常直接说出自己的第一感觉，偶尔会承认自己看不懂局势。",
+    "你是一位精于算计的商人。你的发言喜欢权衡利弊，常用'划算''风险''收益'来衡量每个选择。",
+    "你是一位多疑的侦探。你的发言总是在追问细节，喜欢抓住别人话里的小矛盾不放。",
+    "你是一位幽默的段子手。你的发言轻松诙谐，常用玩笑缓和气氛，但关键时刻态度明确。",
+    "你是一位固执的老学究。你的发言引经据典，坚持自己的判断，不轻易改变立场。",
+    "你是一位敏感的诗人。你的发言细腻，喜欢从别人的语气和情绪中找线索，措辞带有文学色彩。",
+    "你是一位冷静的指挥官。你的发言简明扼要，喜欢给出明确的行动方案，号召大家统一投票。",
+]
+
 # ==============================================================================
 # 3. LLM 供应商与模型配置
 # ==============================================================================
@@ -63,15 +107,67 @@ LLM_PROVIDERS = {
     "ollama": {
         "api_url": "http://localhost:11434/api/generate",
         "model": "qwen2.5:14b-instruct-q8_0",
-        "api_key": None
+        "api_key": None,
+        "keep_alive": "30m"                # 模型在Ollama中常驻的时长，避免对局中途被卸载后重新加载
     },
     "openai_compatible": {
         "api_url": "https://api.siliconflow.cn/v1/chat/completions",
         "model": "deepseek-ai/DeepSeek-V3",
-        "api_key": siliconflow_api_key
+        "api_key": siliconflow_api_key,
+        # 决策调用的结构化输出方式: 'json_schema'、'tools'（工具调用）或 'json_object'（不约束目标）
+        "structured_output": "json_schema"
     }
 }
 
+# 多后端路由：按权重选择后端，主请求超过该后端观测到的p90延迟仍未返回时，向另一个后端发送对冲请求
+LLM_ROUTER_CONFIG = {
+    "enabled": False,              # 启用后忽略 LLM_PROVIDERS['default']
+    "backends": [
+        # provider 对应上面的供应商配置，其余字段（model、api_url、api_key）覆盖该供应商的默认值
+        {"provider": "openai_compatible", "weight": 1.0},
+        {"provider": "openai_compatible", "model": "Qwen/Qwen2.5-72B-Instruct", "weight": 0.5},
+    ],
+    "hedge": True,                 # 是否发送对冲请求
+    "hedge_percentile": 0.9,       # 对冲阈值取该后端延迟的分位数
+    "hedge_min_samples": 10,       # 延迟样本不足时使用默认阈值
+    "hedge_default_delay": 8.0,    # 默认对冲阈值（秒）
+    "latency_sample_size": 200,    # 每个后端保留的最近延迟样本数
+    "max_workers": 16,             # 路由器线程池大小
+}
+
+# 熔断器：供应商连续失败后直接走兜底逻辑，并在后台探测恢复（按供应商共享，跨对局生效）
+LLM_CIRCUIT_BREAKER_CONFIG = {
+    "enabled": True,
+    "failure_threshold": 3,        # 连续失败多少次后打开熔断器
+    "recovery_timeout": 30.0,      # 打开后每隔多少秒探测一次
+    "probe_timeout": 5,            # 探测请求的超时时间（秒）
+}
+
+# 限流：按供应商共享的令牌桶（每分钟请求数与token数），跨对局生效。多桌共用一个API Key时，
+# 关键路径的调用优先获得额度；供应商返回429时按 Retry-After 暂停该供应商的所有请求后重试，不计入熔断
+LLM_RATE_LIMIT_CONFIG = {
+    "enabled": False,              # 默认关闭：按供应商文档中账号的实际配额填写 backends 后再启用
+    "backends": {
+        # 键为后端名：未启用路由时为供应商名，启用路由时为路由后端的 name（未设置时为 "供应商:模型"）。
+        # 每个后端单独计额，使用不同API Key的后端互不占用额度；未列出的后端不限流（如本地Ollama）
+        "openai_compatible": {"requests_per_minute": 60, "tokens_per_minute": 120000},
+    },
+    "burst_seconds": 10,           # 桶容量相当于多少秒的额度，允许的突发量
+    # 优先级：rank 越小越优先；max_wait 为排队等待额度的最长时间（秒），超时放弃本次调用
+    "priorities": {
+        "ordered_speech": {"rank": 0, "max_wait": 30},
+        "decision": {"rank": 1, "max_wait": 30},
+        "discussion": {"rank": 2, "max_wait": 8},
+        "background": {"rank": 3, "max_wait": 20},
+    },
+    # 未显式指定优先级时按调用类型归类；自由讨论的发言由调度器显式指定为 discussion
+    "call_type_priority": {"speech": "ordered_speech", "vote": "decision", "kill": "decision", "summary": "background"},
+    "completion_token_reserve": 200,   # 未设置 max_tokens 时为回复预留的token数
+    "max_429_retries": 2,          # 收到429后在限流器内重试的次数
+    "default_retry_after": 5.0,    # 429 没有 Retry-After 头时暂停的秒数
+    "max_retry_after": 60.0,       # Retry-After 的上限
+}
+
 # ==============================================================================
 # 4. LLM 生成参数配置
 # ==============================================================================
@@ -115,6 +211,13 @@ LLM_GENERATION_PARAMS = {
             "max_tokens": 100,
             "presence_penalty": 0.0,
             "frequency_penalty": 0.0
+        },
+        "summary": {
+            "temperature": 0.3,        # 摘要要求忠实原文
+            "top_p": 0.8,
+            "max_tokens": 400,
+            "presence_penalty": 0.0,
+            "frequency_penalty": 0.0
         }
     },
     
@@ -134,6 +237,47 @@ LLM_GENERATION_PARAMS = {
     }
 }
 
+# 上下文压缩：已结束的天数在天黑后于后台生成摘要，之后的prompt只保留当天的逐条发言
+LLM_CONTEXT_CONFIG = {
+    "summarize_completed_days": True,
+    "use_llm_summary": True,        # False 时只用抽取式摘要（不额外调用LLM）
+    "summary_max_chars": 300,       # 每天摘要的目标字数
+    # 各类prompt的token预算（本地估算），超出时按 section_priority 裁剪
+    "prompt_token_ceiling": {
+        "speech": 6000,
+        "vote": 5000,
+        "kill": 5000,
+        "default": 6000
+    },
+    # 可裁剪的prompt片段及优先级，数值越小越先裁剪；未列出的片段（规则、身份、目标等）始终保留
+    # history 先按天从最早开始压缩，压缩不够再整体去掉
+    "section_priority": {
+        "history": 1,
+        "persona": 2,
+        "guidelines": 3,
+        "memory": 4
+    }
+}
+
+# 本地token估算：按模型名中包含的家族关键字选择系数（不区分大小写），未匹配时使用 default
+TOKEN_ESTIMATOR_CONFIG = {
+    "families": {
+        "deepseek": {"cjk_tokens_per_char": 0.6, "other_chars_per_token": 3.8},
+        "qwen": {"cjk_tokens_per_char": 0.7, "other_chars_per_token": 3.8},
+        "llama": {"cjk_tokens_per_char": 1.3, "other_chars_per_token": 4.0},
+        "default": {"cjk_tokens_per_char": 1.0, "other_chars_per_token": 4.0}
+    }
+}
+
+# 玩家记忆：每位AI玩家维护怀疑度、听到的声明、投票记录和私有情报，事件发生时增量更新
+PLAYER_MEMORY_CONFIG = {
+    "enabled": True,
+    "decisions_use_memory_only": True,  # 投票、夜杀只使用记忆，不附带完整历史记录
+    "max_claims": 12,                   # 保留最近多少条身份/查验声明
+    "vote_days": 2,                     # 渲染最近几天的投票记录
+    "top_suspects": 5                   # 渲染怀疑度最高的几名玩家
+}
+
 # ==============================================================================
 # 5. LLM 调试与监控配置
 # ==============================================================================
@@ -155,13 +299,27 @@ TTS_CONFIG = {
     "default_provider": "siliconflow", # 在这里设置使用的TTS供应商: 'local_gsv' 或 'siliconflow'
     "enabled": True, # TTS功能总开关
     "concurrency": 2, # 单句TTS流式并发请求数（标点符号切分）
-    "audio_play_delay": 6.0,  # TTS音频播放延迟时间（秒），防止角色发言音频重叠（1号玩家不延迟）
+    "gsv_lookahead": 2, # 本地GSV预取的后续文本块数量（0表示逐块串行请求）
+    "audio_play_delay": 6.0,  # TTS音频播放延迟时间（秒），防止角色发言音频重叠（1号玩家不延迟，仅在关闭audio_timeline时生效）
+
+    # --- 音频时间线：按真实音频时长排队播放，前一位说完后一位再开始 ---
+    "audio_timeline": {
+        "enabled": True,
+        "gap": 0.3,                        # 相邻发言者之间的间隔（秒）
+        "max_wait": 60.0,                  # 等待前一位发言者的最长时间（秒），防止TTS失败导致阻塞
+        "hold_game_progression": False,    # AI按序发言后是否等其语音播完再轮到下一位
+        "fallback_chars_per_second": 4.5,  # 无法解析音频时长时按文本长度估算
+    },
 
     # --- 供应商详细配置 ---
     "providers": {
         "local_gsv": {
             "api_url": "http://127.0.0.1:9880/tts",
             "type": "local",
+            # 输出格式按优先级排列，与浏览器支持的格式协商后取第一个可用项；最后一项作为兜底
+            "audio_formats": ["ogg", "aac", "wav"],
+            # 文本切分策略：首块短以降低首段音频延迟，后续子句合并到目标长度
+            "chunk_policy": {"min_length": 4, "first_chunk_max": 12, "target_length": 40, "max_length": 80},
             # 使用你提供的最新音频配置
             "reference_audios": {
                 1: "audios/没关系，了解一下嘛，我们最近推出了新的优惠活动。.wav",
@@ -188,6 +346,11 @@ TTS_CONFIG = {
             "api_key": siliconflow_api_key, # !!! 在这里填入你的SiliconFlow API Key !!!
             "model": "FunAudioLLM/CosyVoice2-0.5B",
             "type": "cloud",
+            "upload_concurrency": 4, # 音色上传并发数
+            # 输出格式按优先级排列，与浏览器支持的格式协商后取第一个可用项；最后一项作为兜底
+            "audio_formats": ["mp3", "opus", "wav"],
+            # 文本切分策略：云端按块计费延迟较高，后续块合并得更长以减少请求数
+            "chunk_policy": {"min_length": 4, "first_chunk_max": 16, "target_length": 60, "max_length": 120},
             # 根据你的新昵称生成的voice_names
             "voice_names": {
                 1: "hutao-voice",
@@ -200,4 +363,25 @@ TTS_CONFIG = {
             }
         }
     }
-}
\ No newline at end of file
+}
+
+# 开局预热：start_game 时在后台建立连接池、预加载模型并探测各后端延迟，
+# 让第一次真实发言与之后的发言一样快
+WARMUP_CONFIG = {
+    "enabled": True,
+    "llm": True,                       # 预热LLM：Ollama预加载模型，其余供应商发送一次极短的探测请求
+    "probe_timeout": 30,               # 预热请求的超时时间（秒），首次加载模型可能较慢
+    "llm_rewarm_after": 600,           # 进程内预热成功后，这么多秒内开始的新对局不再重复预热同一后端
+    "tts": True,                       # 预热TTS：发送极短的合成请求（不播放）
+    "tts_local_voices": 1,             # 本地GSV按座位顺序依次预热的音色数（服务逐个处理请求，预热过多会拖慢首次发言）
+    "tts_text": "好的。",
+}
+
+# 按局的性能追踪：记录各阶段、LLM调用、重试、TTS分块与存档的耗时，
+# 每局结束时导出为 Chrome trace 文件，可在 chrome://tracing 或 https://ui.perfetto.dev 中打开。
+# 默认关闭，需要时改为 True 或以 python app.py --trace 启动
+TRACING_CONFIG = {
+    "enabled": False,
+    "output_dir": "traces",
+    "max_events": 200000,              # 单局最多记录的事件数，超出后丢弃
+}
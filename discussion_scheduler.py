@@ -0,0 +1,141 @@
+# discussion_scheduler.py
+
+import logging
+import random
+import threading
+import time
+from config import GAME_CONFIG
+from llm_utils import construct_llm_prompt, generate_llm_response
+from token_budget import estimate_tokens
+from cancellation import CancellationToken
+import tracing
+
+class DiscussionScheduler:
+    """
+    一个自由讨论窗口内的AI发言调度器。
+    单线程按优先级挑选发言者，限制同时进行的LLM调用数，并为本窗口设置调用次数与token预算；
+    讨论结束时停止调度并取消本窗口的令牌，仍在进行的调用被中断；已经返回但来不及发出的发言计为浪费。
+    """
+
+    def __init__(self, game, end_time: float, cancel_token=None):
+        """
+        :param end_time: 讨论结束时刻（time.monotonic()）
+        :param cancel_token: 讨论阶段的令牌，本窗口的调用持有它的子令牌
+        """
+        self.game = game
+        self.end_time = end_time
+        self.cancel_token = cancel_token.child() if cancel_token else CancellationToken()
+        config = GAME_CONFIG.get('discussion_scheduler', {})
+        self.max_calls = config.get('max_calls', 12)
+        self.max_tokens = config.get('max_tokens', 40000)
+        self.completion_reserve = config.get('completion_token_reserve', 120)
+        self.cooldown = config.get('cooldown', (5, 15))
+        self.min_remaining = config.get('min_remaining', 5.0)
+        self.tick = config.get('tick', 0.5)
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._slots = threading.Semaphore(config.get('max_concurrent_calls', 2))
+        self._in_flight = set()
+        self._spoken = {}
+        now = time.monotonic()
+        # 与原先每人独立定时器一致：每位AI在 cooldown 区间内随机等待后才有机会发言
+        self._eligible_at = {p['id']: now + random.uniform(*self.cooldown)
+                             for p in game.get_alive_players() if not p['is_human']}
+        self.stats = {"calls": 0, "emitted": 0, "wasted": 0, "cancelled": 0, "rate_limited": 0, "tokens": 0, "budget_exhausted": False}
+
+    def start(self):
+        threading.Thread(target=self._run, name="discussion-scheduler", daemon=True).start()
+
+    def stop(self) -> dict:
+        """结束本窗口：不再发起新调用，并中断进行中的调用。返回统计快照。"""
+        with self._lock:
+            self._stopped.set()
+            stats = dict(self.stats, in_flight=len(self._in_flight))
+        self.cancel_token.cancel("自由讨论已结束")
+        logging.info(f"自由讨论调度结束: 发起 {stats['calls']} 次调用，发言 {stats['emitted']} 次，"
+                     f"进行中 {stats['in_flight']} 次（已中断），估算消耗 {stats['tokens']} tokens")
+        return stats
+
+    def _priority(self, player_id: int, today_text: str) -> float:
+        """数值越小越优先：本轮讨论中发言少的、今天被提及多的玩家先说。"""
+        mentions = today_text.count(f"{player_id}号")
+        return self._spoken.get(player_id, 0) * 2 - min(mentions, 3) + random.random()
+
+    def _next_speaker(self):
+        now = time.monotonic()
+        game_state = self.game.game_state
+        day_log = next((log for log in game_state.get('game_log', []) if log['day'] == game_state['day']), None)
+        today_text = " ".join(s['text'] for s in day_log['speeches']) if day_log else ""
+        with self._lock:
+            candidates = [p for p in self.game.get_alive_players()
+                          if not p['is_human'] and p['id'] not in self._in_flight and self._eligible_at.get(p['id'], now) <= now]
+            if not candidates:
+                return None
+            return min(candidates, key=lambda p: self._priority(p['id'], today_text))
+
+    def _defer(self, player_id: int):
+        with self._lock:
+            self._eligible_at[player_id] = time.monotonic() + random.uniform(*self.cooldown)
+
+    def _run(self):
+        probability = GAME_CONFIG['discussion_probability']
+        while not self._stopped.is_set():
+            if self.end_time - time.monotonic() < self.min_remaining:
+                break
+            if not self._slots.acquire(timeout=self.tick):
+                continue
+            player = self._next_speaker()
+            if player is None or random.random() >= probability:
+                if player is not None:
+                    self._defer(player['id'])
+                self._slots.release()
+                self._stopped.wait(self.tick)
+                continue
+
+            prompt = construct_llm_prompt(self.game.game_state, player['id'])
+            cost = estimate_tokens(prompt) + self.completion_reserve
+            with self._lock:
+                if self._stopped.is_set():
+                    self._slots.release()
+                    break
+                if self.stats['calls'] >= self.max_calls or self.stats['tokens'] + cost > self.max_tokens:
+                    self.stats['budget_exhausted'] = True
+                    self._slots.release()
+                    logging.info(f"自由讨论的调用预算已用完（{self.stats['calls']} 次调用，{self.stats['tokens']} tokens）")
+                    break
+                self.stats['calls'] += 1
+                self.stats['tokens'] += cost
+                self._in_flight.add(player['id'])
+            threading.Thread(target=self._speak, args=(player, prompt), daemon=True).start()
+            self._stopped.wait(self.tick)
+
+    def _speak(self, player: dict, prompt: str):
+        tracer = self.game.tracer
+        speech_id = tracer.new_id("speech")
+        try:
+            with tracing.use(tracer, speech_id=speech_id, player_id=player['id']):
+                # 自由讨论是可有可无的补充发言，限流时让位于按序发言和投票等关键路径的调用
+                response_data = generate_llm_response(prompt, call_type='speech', player_id=player['id'], player_role=player['role'],
+                                                      cancel_token=self.cancel_token, priority='discussion')
+        finally:
+            with self._lock:
+                self._in_flight.discard(player['id'])
+            self._defer(player['id'])
+            self._slots.release()
+
+        with self._lock:
+            if response_data.get('cancelled'):
+                self.stats['cancelled'] += 1
+                return
+            if response_data.get('rate_limited'):
+                self.stats['rate_limited'] += 1
+                return
+            if self._stopped.is_set() or not self.game.discussion_active:
+                self.stats['wasted'] += 1
+                logging.info(f"讨论已结束，丢弃玩家{player['id']}的自由发言（本轮已浪费 {self.stats['wasted']} 次调用）")
+                return
+            self._spoken[player['id']] = self._spoken.get(player['id'], 0) + 1
+            self.stats['emitted'] += 1
+        speech = response_data.get('response', '').strip() or f"{player['nickname']}({player['id']}号)补充一点..."
+        self.game.emit_speech(player['id'], speech, speech_id=speech_id)
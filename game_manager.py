@@ -6,16 +6,23 @@ import random
 import logging
 import threading
 import time
-import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from config import GAME_CONFIG, NICKNAMES
+from config import GAME_CONFIG, TTS_CONFIG, LLM_CONTEXT_CONFIG, WARMUP_CONFIG
 from game_models import Role, GamePhase, GameError
-from llm_utils import construct_llm_prompt, get_llm_vote, generate_llm_response, get_llm_seer_check, get_llm_werewolf_kill
+from llm_utils import construct_llm_prompt, get_llm_vote, generate_llm_response, get_llm_seer_check, get_llm_werewolf_kill, summarize_day, warm_up_llm
 from tts_manager import TTSManager
+from discussion_scheduler import DiscussionScheduler
+from cancellation import CancellationToken
+import tracing
+from game_snapshot import GameSnapshot
+from seating import seat_nickname, seat_color, human_seat, role_counts, decision_workers, is_large_table
+from player_memory import init_memories, record_speech, record_votes, record_elimination, record_seer_check
 
 class WerewolfWebGame:
     # --- 修改：构造函数接收 voice_enabled 参数 ---
-    def __init__(self, socketio, voice_enabled: bool = False):
+    def __init__(self, socketio, voice_enabled: bool = False, audio_formats: list = None):
         self.socketio = socketio
         self.voice_enabled = voice_enabled  # 存储当前游戏的语音模式
         self.game_state = {}
@@ -23,16 +30,37 @@ class WerewolfWebGame:
         self.current_speaker_index = 0
         self.discussion_active = False
         self.discussion_end_time = None
+        self.discussion_scheduler = None
         self.voting_active = False
         self.night_active = False
         self.human_vote = None
         self.human_night_target = None
         self.game_started = False
+        # 夜间行动：待定行动集合、已提交的结果，以及哪些行动由人类玩家提交
+        self._night_lock = threading.Lock()
+        self._pre_game_seer_pending = False
+        self._night_pending = set()
+        self._night_actions = {}
+        self._night_human_kinds = set()
+        # 后台生成的每日摘要先放在这里，由游戏流程在切换阶段时并入 game_state，避免与存档并发修改
+        self._summary_lock = threading.Lock()
+        self._ready_summaries = {}
+        # 多个线程（发言、计时器、讨论调度）都会修改和存档 game_state：修改、存档与拍快照都在这把锁内进行，
+        # 存档不会互相截断，快照也不会看到修改到一半的状态
+        self._state_lock = threading.RLock()
+        # 已结束各天的冻结记录，由本局的所有快照共享（见 game_snapshot.py）
+        self._frozen_days = {}
         self.next_speaker_callback = None
+        # 协作式取消：对局令牌在游戏结束或被替换时取消，阶段令牌在进入下一阶段时取消，
+        # 持有令牌的LLM调用随之中断并跳过重试
+        self._game_token = CancellationToken()
+        self._phase_token = self._game_token.child()
+        # 按局的性能追踪，start_game 时按游戏ID创建
+        self.tracer = tracing.NULL_TRACER
         
         # 只有在语音模式启用时才初始化TTS管理器
         if self.voice_enabled:
-            self.tts_manager = TTSManager(self.socketio)
+            self.tts_manager = TTSManager(self.socketio, client_formats=audio_formats)
         else:
             self.tts_manager = None
     
@@ -40,22 +68,29 @@ class WerewolfWebGame:
     def _save_game_state(self):
         if not self.game_file_path: return
         try:
-            with open(self.game_file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.game_state, f, ensure_ascii=False, indent=2)
+            with self._state_lock, self.tracer.span("save_game_state", cat="io"):
+                with open(self.game_file_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.game_state, f, ensure_ascii=False, indent=2)
         except Exception as e:
             logging.error(f"保存游戏状态失败: {e}")
             
     def start_game(self):
         if self.game_started: raise GameError("游戏已经开始")
+        self._start_warm_up()
         games_folder = "games"
-        if not os.path.exists(games_folder): os.makedirs(games_folder)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.game_file_path = os.path.join(games_folder, f"game_{timestamp}.json")
-        self.game_state = {"game_id": timestamp, "total_players": GAME_CONFIG['players_count'], "day": 1, "phase": GamePhase.WAITING.value, "players": [], "game_log": []}
+        os.makedirs(games_folder, exist_ok=True)
+        # 同一秒内可能有多局同时开始，时间戳后附加随机后缀避免存档互相覆盖
+        game_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.game_file_path = os.path.join(games_folder, f"game_{game_id}.json")
+        self.tracer = tracing.new_tracer(game_id)
+        if self.tts_manager:
+            self.tts_manager.tracer = self.tracer
+        self.game_state = {"game_id": game_id, "total_players": GAME_CONFIG['players_count'], "day": 1, "phase": GamePhase.WAITING.value, "players": [], "game_log": []}
         player_ids = list(range(1, GAME_CONFIG['players_count'] + 1))
         random.shuffle(player_ids)
+        human_id = human_seat()
         for player_id in player_ids:
-            self.game_state['players'].append({"id": player_id, "nickname": NICKNAMES.get(player_id, f"玩家{player_id}"), "role": None, "is_alive": True, "is_human": (player_id == 7)})
+            self.game_state['players'].append({"id": player_id, "nickname": seat_nickname(player_id, player_id == human_id), "role": None, "is_alive": True, "is_human": (player_id == human_id)})
         self.assign_roles()
         self.emit_log("游戏开始！身份已分配完成")
         self.game_started = True
@@ -69,16 +104,27 @@ class WerewolfWebGame:
         else:
             threading.Timer(2.0, self.start_day_phase).start()
 
+    def _start_warm_up(self):
+        """开局时在后台预热LLM与TTS，与身份分配、预言家查验等开局流程并行进行。"""
+        if not WARMUP_CONFIG.get('enabled', True):
+            return
+        if WARMUP_CONFIG.get('llm', True):
+            threading.Thread(target=warm_up_llm, kwargs={'cancel_token': self._game_token}, name="llm-warmup", daemon=True).start()
+        if self.tts_manager and WARMUP_CONFIG.get('tts', True):
+            self.tts_manager.warm_up()
+
     def assign_roles(self):
-        roles = ([Role.WEREWOLF.value] * GAME_CONFIG['werewolves_count'] +
-                 [Role.SEER.value] * GAME_CONFIG['seer_count'] +
-                 [Role.VILLAGER.value] * GAME_CONFIG['villagers_count'])
+        counts = role_counts(len(self.game_state['players']))
+        roles = ([Role.WEREWOLF.value] * counts['werewolves'] +
+                 [Role.SEER.value] * counts['seer'] +
+                 [Role.VILLAGER.value] * counts['villagers'])
         random.shuffle(roles)
 
         for player, role in zip(self.game_state['players'], roles):
             player['role'] = role
             if role == Role.SEER.value:
                 player['seer_knowledge'] = []
+        init_memories(self.game_state)
 
         human_player = self.get_human_player()
         if human_player:
@@ -86,13 +132,15 @@ class WerewolfWebGame:
         self.emit_game_state()
 
     def add_speech_to_log(self, player_id, text):
-        current_day = self.game_state['day']
-        day_log = next((log for log in self.game_state['game_log'] if log['day'] == current_day), None)
-        if not day_log:
-            day_log = {"day": current_day, "speeches": [], "eliminated_vote": None, "eliminated_night": None}
-            self.game_state['game_log'].append(day_log)
-        day_log['speeches'].append({"player_id": player_id, "text": text})
-        self._save_game_state()
+        with self._state_lock:
+            current_day = self.game_state['day']
+            day_log = next((log for log in self.game_state['game_log'] if log['day'] == current_day), None)
+            if not day_log:
+                day_log = {"day": current_day, "speeches": [], "eliminated_vote": None, "eliminated_night": None}
+                self.game_state['game_log'].append(day_log)
+            day_log['speeches'].append({"player_id": player_id, "text": text})
+            record_speech(self.game_state, current_day, player_id, text)
+            self._save_game_state()
 
     def _pre_game_seer_turn(self):
         self.game_state['phase'] = GamePhase.PRE_GAME_SEER.value
@@ -108,6 +156,8 @@ class WerewolfWebGame:
             threading.Timer(2.0, self.start_day_phase).start()
             return
         if seer['is_human']:
+            with self._night_lock:
+                self._pre_game_seer_pending = True
             self.socketio.emit('request_seer_action', {'targets': checkable_targets})
         else:
             threading.Thread(target=self._run_ai_pre_game_seer_check, args=(seer,)).start()
@@ -128,12 +178,14 @@ class WerewolfWebGame:
             result_role = Role.WEREWOLF.value
         else:
             result_role = "好人"
-        seer['seer_knowledge'].append({
-            "day": day,
-            "checked_id": target_id,
-            "role": result_role 
-        })
-        self._save_game_state()
+        with self._state_lock:
+            seer['seer_knowledge'].append({
+                "day": day,
+                "checked_id": target_id,
+                "role": result_role 
+            })
+            record_seer_check(self.game_state, seer['id'], target_id, result_role)
+            self._save_game_state()
         logging.info(f"预言家({seer['id']},{seer['nickname']})在第{day}天查验了{target_id}号，身份是{result_role}")
         if seer['is_human']:
             self.socketio.emit('seer_result', {
@@ -142,7 +194,14 @@ class WerewolfWebGame:
                 "day": day
             })
     
+    def _new_phase_token(self, phase_name):
+        """进入新阶段：取消上一阶段仍在进行的LLM调用，返回本阶段的令牌。"""
+        self._phase_token.cancel(f"阶段已切换到 {phase_name}")
+        self._phase_token = self._game_token.child()
+        return self._phase_token
+
     def start_day_phase(self):
+        self._new_phase_token("白天发言")
         self.game_state['day'] = max(1, self.game_state['day'])
         self.game_state['phase'] = GamePhase.DAY.value
         self.emit_phase_update(f"第{self.game_state['day']}天 白天 - 按序发言")
@@ -161,56 +220,205 @@ class WerewolfWebGame:
         self.ordered_speech()
 
     def start_night_phase(self):
+        """
+        夜晚开始：预言家查验与狼人淘汰互不依赖，同时发起所有AI夜间决策，
+        等全部行动（包括人类玩家的）到齐后按规则顺序结算。
+        """
+        self._new_phase_token("夜晚")
         self.night_active = True
         self.human_night_target = None
         self.emit_log(f"--- 第{self.game_state['day']}天 夜晚降临 ---")
+
         seer = self.get_seer()
+        checkable_targets = []
         if seer and seer['is_alive']:
-            self._handle_seer_turn(seer)
-        else:
-            self._handle_werewolf_turn()
-
-    def _handle_seer_turn(self, seer):
-        self.game_state['phase'] = GamePhase.NIGHT_SEER.value
-        self.emit_phase_update(f"第{self.game_state['day']}天 夜晚 - 预言家行动")
-        checked_ids = {check['checked_id'] for check in seer.get('seer_knowledge', [])}
-        checkable_targets = [p['id'] for p in self.get_alive_players() if p['id'] != seer['id'] and p['id'] not in checked_ids]
-        if not checkable_targets:
-            self.emit_log("预言家已无新的可查验目标。")
-            threading.Timer(3.0, self._handle_werewolf_turn).start()
-            return
-        if seer['is_human']:
-            self.socketio.emit('request_seer_action', {'targets': checkable_targets})
+            checked_ids = {check['checked_id'] for check in seer.get('seer_knowledge', [])}
+            checkable_targets = [p['id'] for p in self.get_alive_players() if p['id'] != seer['id'] and p['id'] not in checked_ids]
+            if not checkable_targets:
+                self.emit_log("预言家已无新的可查验目标。")
+        human_player = self.get_human_player()
+        human_is_werewolf = bool(human_player and human_player['is_alive'] and human_player['role'] == Role.WEREWOLF.value)
+        ai_werewolf = next((w for w in self.get_werewolves() if not w['is_human']), None)
+
+        # 先登记全部待定行动再启动任何决策，避免先返回的行动提前触发结算
+        with self._night_lock:
+            self._night_actions = {}
+            self._night_pending = {'kill'}
+            self._night_human_kinds = {'kill'} if human_is_werewolf else set()
+            if checkable_targets:
+                self._night_pending.add('seer')
+                if seer['is_human']:
+                    self._night_human_kinds.add('seer')
+
+        # 夜间的AI决策共享同一份只读快照，决策线程运行期间主流程对状态的修改不会影响它们
+        deciders = [p['id'] for p in self.get_werewolves() if not p['is_human']]
+        if checkable_targets and not seer['is_human']:
+            deciders.append(seer['id'])
+        snapshot = self._take_snapshot(deciders)
+        if checkable_targets:
+            self.game_state['phase'] = GamePhase.NIGHT_SEER.value
+            self.emit_phase_update(f"第{self.game_state['day']}天 夜晚 - 预言家与狼人行动")
+            if seer['is_human']:
+                self.socketio.emit('request_seer_action', {'targets': checkable_targets})
+            else:
+                self._start_ai_night_action('seer', get_llm_seer_check, seer['id'], snapshot)
         else:
-            threading.Thread(target=self._run_ai_seer_check, args=(seer,)).start()
-
-    def _run_ai_seer_check(self, seer):
-        target_id = get_llm_seer_check(self.game_state, seer['id'])
-        if target_id:
-            self.process_seer_check(seer, target_id)
-        self._handle_werewolf_turn()
+            self.game_state['phase'] = GamePhase.NIGHT_WEREWOLF.value
+            self.emit_phase_update(f"第{self.game_state['day']}天 夜晚 - 狼人行动")
 
-    def _handle_werewolf_turn(self):
-        self.game_state['phase'] = GamePhase.NIGHT_WEREWOLF.value
-        self.emit_phase_update(f"第{self.game_state['day']}天 夜晚 - 狼人行动")
-        human_player = self.get_human_player()
-        if human_player and human_player['is_alive'] and human_player['role'] == Role.WEREWOLF.value:
+        if human_is_werewolf:
             other_werewolves = [p for p in self.get_werewolves() if p['id'] != human_player['id']]
             other_werewolves_info = [f"{p['nickname']}({p['id']}号)" for p in other_werewolves]
             self.emit_log(f"你是狼人，请选择淘汰目标。你的狼同伴是: {other_werewolves_info or '无'}")
             self.socketio.emit('start_night_werewolf')
-        else:
+        elif ai_werewolf:
             self.emit_log("狼人请行动...")
-            threading.Timer(3.0, self.process_night_action).start()
-    
+            ai_werewolves = [w for w in self.get_werewolves() if not w['is_human']]
+            if len(ai_werewolves) > 1 and is_large_table(len(self.game_state['players'])) and GAME_CONFIG.get('large_table', {}).get('pack_kill', True):
+                self._start_ai_night_action('kill', self._pack_kill_decision(ai_werewolves), ai_werewolf['id'], snapshot)
+            else:
+                self._start_ai_night_action('kill', get_llm_werewolf_kill, ai_werewolf['id'], snapshot)
+        else:
+            logging.warning("夜晚开始时没有可以行动的狼人。")
+            self.submit_night_action('kill', None)
+
+    def _take_snapshot(self, memory_ids):
+        """为一个决策阶段拍下对局状态的只读快照，只带上参与决策的玩家的记忆，见 game_snapshot.py。"""
+        with self._state_lock, self.tracer.span("game_snapshot", cat="game"):
+            return GameSnapshot(self.game_state, memory_ids=memory_ids, frozen_days=self._frozen_days)
+
+    def _start_ai_night_action(self, kind, decide, player_id, snapshot):
+        """在后台线程中基于夜晚的快照为AI玩家做夜间决策，完成后提交结果；夜晚阶段被取消时不再提交。"""
+        cancel_token = self._phase_token
+        def _run():
+            try:
+                with tracing.use(self.tracer, player_id=player_id), self.tracer.span(f"night.{kind}", player_id=player_id):
+                    target_id = decide(snapshot, player_id, cancel_token=cancel_token)
+            except Exception as e:
+                logging.error(f"玩家{player_id}的夜间行动({kind})失败: {e}")
+                target_id = None
+            if cancel_token.cancelled:
+                logging.info(f"夜晚阶段已结束，丢弃玩家{player_id}的夜间行动({kind})")
+                return
+            self.submit_night_action(kind, target_id)
+
+        threading.Thread(target=_run, name=f"night-{kind}-{player_id}").start()
+
+    def _pack_kill_decision(self, werewolves):
+        """大桌模式的狼人决策：所有AI狼人并行提名，取提名最多的目标，平票时随机选一个。"""
+        def decide(game_state, player_id, cancel_token=None):
+            def nominate(werewolf):
+                with tracing.use(self.tracer, player_id=werewolf['id']):
+                    return get_llm_werewolf_kill(game_state, werewolf['id'], cancel_token=cancel_token)
+
+            with ThreadPoolExecutor(max_workers=decision_workers(len(werewolves), len(self.game_state['players'])), thread_name_prefix="night-kill") as executor:
+                nominations = [n for n in executor.map(nominate, werewolves) if n is not None]
+            if not nominations:
+                return None
+            tally = {}
+            for target_id in nominations:
+                tally[target_id] = tally.get(target_id, 0) + 1
+            top = max(tally.values())
+            logging.info(f"狼人提名: {tally}")
+            return random.choice([target_id for target_id, count in tally.items() if count == top])
+        return decide
+
+    def submit_night_action(self, kind, target_id, from_human=False):
+        """
+        提交一项夜间行动（'seer' 或 'kill'）；最后一项到齐时结算整晚。
+        查验在提交时立即结算并告知预言家，不必等待狼人的决策。
+        """
+        with self._night_lock:
+            if kind not in self._night_pending:
+                return
+            if from_human and kind not in self._night_human_kinds:
+                return
+            self._night_pending.discard(kind)
+            self._night_actions[kind] = target_id
+            if kind == 'kill' and from_human:
+                self.human_night_target = target_id
+            # 在锁内结算查验，保证查验总是先于夜间淘汰记录
+            seer = self.get_seer() if kind == 'seer' and target_id else None
+            if seer:
+                self.process_seer_check(seer, target_id)
+            all_in = not self._night_pending
+        if all_in:
+            self._resolve_night()
+        elif from_human and kind == 'seer':
+            self.emit_log("查验已提交，等待其他夜间行动完成...")
+
+    def handle_human_seer_action(self, target_id):
+        """
+        人类预言家提交查验：游戏开始前的查验直接结算并进入白天，夜晚则作为夜间行动提交。
+        其他时候（重复点击、阶段已切换后迟到的提交）忽略。
+        """
+        seer = self.get_seer()
+        if not seer or not seer['is_human']:
+            return
+        if self.night_active:
+            self.submit_night_action('seer', target_id, from_human=True)
+            return
+        # 阶段名会被 emit_phase_update 替换为展示文本，只能以待定标记判断是否处于开局查验
+        with self._night_lock:
+            pre_game, self._pre_game_seer_pending = self._pre_game_seer_pending, False
+        if pre_game:
+            self.process_seer_check(seer, target_id, day=0)
+            self.start_day_phase()
+
+    def _resolve_night(self):
+        """全部夜间行动到齐后结算狼人淘汰（查验已在提交时结算）。"""
+        if self.game_state['phase'] == GamePhase.ENDED.value:
+            return
+        target_id = self._night_actions.get('kill')
+        if not self.get_werewolves():
+            self.emit_log("所有狼人均已被淘汰，平安夜。")
+        elif target_id:
+            self.eliminate_player(target_id, 'night')
+        else:
+            self.emit_log("狼人未能达成一致，平安夜。")
+
+        if not self.check_game_over():
+            self.next_day()
+
     def next_day(self):
-        self.game_state['day'] += 1
+        self._summarize_day_in_background(self.game_state['day'])
+        with self._state_lock:
+            self.game_state['day'] += 1
         self.human_vote = None
         self.human_night_target = None
         self.night_active = False
         self._save_game_state()
         threading.Timer(2.0, self.start_day_phase).start()
 
+    def _summarize_day_in_background(self, day):
+        """天黑结束后在后台为这一天生成发言摘要，生成后在下一次阶段切换时并入 game_state['day_summaries']。"""
+        if not LLM_CONTEXT_CONFIG.get('summarize_completed_days', True):
+            return
+        if str(day) in self.game_state.get('day_summaries', {}):
+            return
+
+        def _run():
+            try:
+                with tracing.use(self.tracer, day=day), self.tracer.span("day_summary", day=day):
+                    summary = summarize_day(self.game_state, day, cancel_token=self._game_token)
+            except Exception as e:
+                logging.error(f"生成第{day}天摘要失败: {e}")
+                return
+            if summary:
+                with self._summary_lock:
+                    self._ready_summaries[str(day)] = summary
+                logging.info(f"第{day}天发言摘要已生成 ({len(summary)}字)")
+
+        threading.Thread(target=_run, name=f"day-summary-{day}", daemon=True).start()
+
+    def _apply_ready_summaries(self):
+        """把后台已生成的摘要并入 game_state，只在游戏流程中调用。"""
+        with self._summary_lock:
+            ready, self._ready_summaries = self._ready_summaries, {}
+        if ready:
+            with self._state_lock:
+                self.game_state.setdefault('day_summaries', {}).update(ready)
+
     def ordered_speech(self):
         alive_players = sorted(self.get_alive_players(), key=lambda p: p['id'])
         self.current_speaker_index = 0
@@ -227,7 +435,9 @@ class WerewolfWebGame:
             if player['is_human']:
                 self.socketio.emit('request_speech')
             else:
-                threading.Timer(random.uniform(*GAME_CONFIG['computer_speech_delay']), self.computer_speech, [player]).start()
+                delay = random.uniform(*GAME_CONFIG['computer_speech_delay'])
+                self.tracer.planned("computer_speech_delay", delay, player_id=player['id'])
+                threading.Timer(delay, self.computer_speech, [player]).start()
         self.next_speaker_callback = _next
         _next()
 
@@ -238,52 +448,40 @@ class WerewolfWebGame:
                 self.next_speaker_callback()
             return
         
-        prompt = construct_llm_prompt(self.game_state, player['id'])
-        # 传递角色信息给LLM
-        response_data = generate_llm_response(
-            prompt, 
-            call_type='speech', 
-            player_id=player['id'],
-            player_role=player['role']  # 新增：传递角色信息
-        )
+        cancel_token = self._phase_token
+        speech_id = self.tracer.new_id("speech")
+        with tracing.use(self.tracer, speech_id=speech_id, player_id=player['id']):
+            with self.tracer.span("build_prompt", cat="llm"):
+                prompt = construct_llm_prompt(self.game_state, player['id'])
+            # 传递角色信息给LLM
+            response_data = generate_llm_response(
+                prompt, 
+                call_type='speech', 
+                player_id=player['id'],
+                player_role=player['role'],  # 新增：传递角色信息
+                cancel_token=cancel_token
+            )
+        if response_data.get('cancelled'):
+            logging.info(f"发言阶段已结束，丢弃玩家{player['id']}的发言。")
+            return
         
         speech = response_data.get('response', '').strip()
         if not speech:
             speech = f"我是{player['nickname']}({player['id']}号)，过。"
             logging.warning(f"玩家{player['id']} LLM响应失败，使用备用发言。")
         
-        self.emit_speech(player['id'], speech)
+        self.emit_speech(player['id'], speech, speech_id=speech_id)
+        self._wait_for_speech_audio()
         if self.next_speaker_callback:
             self.current_speaker_index += 1
             self.next_speaker_callback()
 
-        def _schedule_computer_discussion(self, player):
-            if not self.discussion_active or self.discussion_end_time is None: 
-                return
-            time_remaining = self.discussion_end_time - time.monotonic()
-            if time_remaining < 5.0: 
-                return 
-            
-            def speak():
-                if not self.discussion_active: 
-                    return
-                if player['is_alive'] and random.random() < GAME_CONFIG['discussion_probability']:
-                    prompt = construct_llm_prompt(self.game_state, player['id'])
-                    # 传递角色信息给LLM
-                    response_data = generate_llm_response(
-                        prompt, 
-                        call_type='speech', 
-                        player_id=player['id'],
-                        player_role=player['role']  # 新增：传递角色信息
-                    )
-                    
-                    speech = response_data.get('response', '').strip() or f"{player['nickname']}({player['id']}号)补充一点..."
-                    if self.discussion_active:
-                        self.emit_speech(player['id'], speech)
-                self._schedule_computer_discussion(player)
-                
-            delay = random.uniform(5, 15)
-            threading.Timer(delay, speak).start()
+    def _wait_for_speech_audio(self):
+        """按配置阻塞等待刚才的发言语音播完，再推进游戏流程。"""
+        if not (self.voice_enabled and self.tts_manager and self.tts_manager.timeline):
+            return
+        if TTS_CONFIG.get('audio_timeline', {}).get('hold_game_progression', False):
+            self.tts_manager.timeline.wait_until_idle()
 
     def handle_human_speech(self, text):
         player = self.get_human_player()
@@ -294,18 +492,21 @@ class WerewolfWebGame:
             self.next_speaker_callback()
             
     def start_discussion(self):
+        cancel_token = self._new_phase_token("自由讨论")
         self.game_state['phase'] = GamePhase.DISCUSSION.value
         self.discussion_active = True
         self.discussion_end_time = time.monotonic() + GAME_CONFIG['discussion_time']
         self.emit_phase_update(f"第{self.game_state['day']}天 白天 - 自由讨论 ({GAME_CONFIG['discussion_time']}秒)")
         self.socketio.emit('start_discussion')
         threading.Timer(float(GAME_CONFIG['discussion_time']), self.end_discussion).start()
-        self.start_computer_discussion()
+        self.discussion_scheduler = DiscussionScheduler(self, self.discussion_end_time, cancel_token)
+        self.discussion_scheduler.start()
 
     def end_discussion(self):
         if not self.discussion_active: return
         self.discussion_active = False
         self.discussion_end_time = None
+        self._stop_discussion_scheduler()
         self.socketio.emit('discussion_ended')
         self.emit_log("自由讨论结束。")
         if self.game_state['day'] == 1:
@@ -314,7 +515,14 @@ class WerewolfWebGame:
         else:
             self.start_voting()
             
+    def _stop_discussion_scheduler(self):
+        """停止自由讨论调度：不再发起新的讨论调用，进行中调用的结果被丢弃。"""
+        scheduler, self.discussion_scheduler = self.discussion_scheduler, None
+        if scheduler:
+            scheduler.stop()
+
     def start_voting(self):
+        self._new_phase_token("投票")
         self.game_state['phase'] = GamePhase.VOTING.value
         self.voting_active = True
         self.emit_phase_update(f"第{self.game_state['day']}天 白天 - 投票")
@@ -326,83 +534,24 @@ class WerewolfWebGame:
         else:
             self.socketio.emit('start_voting')
 
-    def start_computer_discussion(self):
-        computers = [p for p in self.get_alive_players() if not p['is_human']]
-        for player in computers:
-            self._schedule_computer_discussion(player)
-
-    def _schedule_computer_discussion(self, player):
-        if not self.discussion_active or self.discussion_end_time is None: return
-        time_remaining = self.discussion_end_time - time.monotonic()
-        if time_remaining < 5.0: return 
-        def speak():
-            if not self.discussion_active: return
-            if player['is_alive'] and random.random() < GAME_CONFIG['discussion_probability']:
-                prompt = construct_llm_prompt(self.game_state, player['id'])
-                response_data = generate_llm_response(prompt, call_type='speech', player_id=player['id'])
-                speech = response_data.get('response', '').strip() or f"{player['nickname']}({player['id']}号)补充一点..."
-                if self.discussion_active:
-                    self.emit_speech(player['id'], speech)
-            self._schedule_computer_discussion(player)
-        delay = random.uniform(5, 15)
-        threading.Timer(delay, speak).start()
-
-
     def process_voting(self, is_human_participating=True):
             self.voting_active = False
             self.socketio.emit('voting_ended')
             votes, vote_log_msg = {}, []
+            ballots = {}  # 投票者 -> 目标，写入AI玩家的记忆
             
             # 处理人类玩家投票
             human_player = self.get_human_player()
             if is_human_participating and self.human_vote and human_player:
                 target_player = self.get_player_by_id(self.human_vote)
                 votes[self.human_vote] = votes.get(self.human_vote, 0) + 1
+                ballots[human_player['id']] = self.human_vote
                 vote_log_msg.append(f"{human_player['nickname']}(你) -> {target_player['nickname']}({self.human_vote}号)")
             
             # 并行处理AI玩家投票
             computers = [p for p in self.get_alive_players() if not p['is_human']]
             if computers:
-                logging.info(f"开始并行处理 {len(computers)} 个AI玩家的投票...")
-                
-                # 使用线程池并行执行投票
-                from concurrent.futures import ThreadPoolExecutor, as_completed
-                import time
-                
-                def get_vote_for_player(player):
-                    """为单个AI玩家获取投票，包含错误处理"""
-                    try:
-                        start_time = time.time()
-                        vote_target_id = get_llm_vote(self.game_state, player['id'])
-                        duration = time.time() - start_time
-                        return {
-                            'player': player,
-                            'vote_target_id': vote_target_id,
-                            'success': True,
-                            'duration': duration
-                        }
-                    except Exception as e:
-                        logging.error(f"玩家 {player['id']} 投票失败: {e}")
-                        return {
-                            'player': player,
-                            'vote_target_id': None,
-                            'success': False,
-                            'error': str(e)
-                        }
-                
-                # 并行执行所有AI投票
-                vote_results = []
-                with ThreadPoolExecutor(max_workers=min(len(computers), 4)) as executor:
-                    # 提交所有投票任务
-                    future_to_player = {
-                        executor.submit(get_vote_for_player, player): player 
-                        for player in computers
-                    }
-                    
-                    # 收集结果
-                    for future in as_completed(future_to_player):
-                        result = future.result()
-                        vote_results.append(result)
+                vote_results = self._collect_ai_votes(computers)
                 
                 # 处理投票结果
                 successful_votes = 0
@@ -413,6 +562,7 @@ class WerewolfWebGame:
                     if result['success'] and result['vote_target_id'] is not None:
                         vote_target_id = result['vote_target_id']
                         votes[vote_target_id] = votes.get(vote_target_id, 0) + 1
+                        ballots[player['id']] = vote_target_id
                         target_player = self.get_player_by_id(vote_target_id)
                         vote_log_msg.append(f"{player['nickname']}({player['id']}号) -> {target_player['nickname']}({vote_target_id}号)")
                         successful_votes += 1
@@ -425,6 +575,9 @@ class WerewolfWebGame:
                 if failed_votes > 0:
                     logging.warning(f"有 {failed_votes} 个AI玩家投票失败")
             
+            with self._state_lock:
+                record_votes(self.game_state, self.game_state['day'], ballots)
+
             # 处理投票结果（保持原有逻辑）
             self.emit_log(f"投票详情: {', '.join(vote_log_msg) if vote_log_msg else '无有效投票'}")
             
@@ -446,60 +599,60 @@ class WerewolfWebGame:
             if not self.check_game_over():
                 self.start_night_phase()
 
-    def process_voting_without_human(self):
-        self.process_voting(is_human_participating=False)
-
-    # --- 函数替换：process_night_action ---
-    def process_night_action(self):
+    def _collect_ai_votes(self, computers):
         """
-        重构后的夜晚行动处理函数，逻辑更健壮。
+        并行获取AI玩家的投票，并行度随人数增长（见 seating.decision_workers）。返回每名玩家的结果。
+        所有投票线程共享投票开始时的只读快照。
         """
-        # 检查游戏是否已经结束，以防万一
-        if self.check_game_over():
-            return
-
-        target_id = None
-        living_werewolves = self.get_werewolves()
-
-        # 1. 如果没有存活的狼人，游戏应该已经结束了，但作为保险措施，我们将其视为平安夜
-        if not living_werewolves:
-            logging.warning("process_night_action被调用，但没有找到任何存活的狼人。这可能是一个状态错误。")
-            self.emit_log("所有狼人均已被淘汰，平安夜。")
-            self.next_day()
-            return
-
-        # 2. 检查是否是人类狼人玩家在行动
-        if self.human_night_target:
-            target_id = self.human_night_target
-        else:
-            # 3. 如果不是人类玩家，则寻找一个AI狼人来行动
-            ai_werewolf = next((w for w in living_werewolves if not w['is_human']), None)
-            
-            if ai_werewolf:
-                # 找到了AI狼人，让它决定目标
-                target_id = get_llm_werewolf_kill(self.game_state, ai_werewolf['id'])
-            else:
-                # 4. 如果找不到AI狼人（意味着剩下的狼人都是人类玩家，但他们没有行动）
-                # 这是一种边缘情况，同样视为平安夜
-                logging.warning(f"轮到AI狼人行动，但只找到人类狼人。")
-                self.emit_log("狼人阵营出现分歧，无人行动。")
-                self.next_day()
-                return
-        
-        # 5. 根据最终确定的target_id来执行淘汰
-        if target_id:
-            self.eliminate_player(target_id, 'night')
-        else:
-            # 如果target_id为None（例如LLM调用失败且没有备用方案），则为平安夜
-            self.emit_log("狼人未能达成一致，平安夜。")
+        logging.info(f"开始并行处理 {len(computers)} 个AI玩家的投票...")
+        cancel_token = self._phase_token
+        snapshot = self._take_snapshot([player['id'] for player in computers])
+
+        def get_vote_for_player(player):
+            """为单个AI玩家获取投票，包含错误处理"""
+            try:
+                start_time = time.time()
+                with tracing.use(self.tracer, player_id=player['id']):
+                    vote_target_id = get_llm_vote(snapshot, player['id'], cancel_token=cancel_token)
+                duration = time.time() - start_time
+                return {
+                    'player': player,
+                    'vote_target_id': vote_target_id,
+                    'success': True,
+                    'duration': duration
+                }
+            except Exception as e:
+                logging.error(f"玩家 {player['id']} 投票失败: {e}")
+                return {
+                    'player': player,
+                    'vote_target_id': None,
+                    'success': False,
+                    'error': str(e)
+                }
         
-        # 6. 再次检查游戏是否结束，然后进入下一天
-        if not self.check_game_over():
-            self.next_day()
+        # 并行执行所有AI投票
+        vote_results = []
+        with ThreadPoolExecutor(max_workers=decision_workers(len(computers), len(self.game_state['players'])), thread_name_prefix="vote") as executor:
+            # 提交所有投票任务
+            future_to_player = {
+                executor.submit(get_vote_for_player, player): player 
+                for player in computers
+            }
+            
+            # 收集结果
+            for future in as_completed(future_to_player):
+                result = future.result()
+                vote_results.append(result)
+        return vote_results
+
+    def process_voting_without_human(self):
+        self.process_voting(is_human_participating=False)
 
     def eliminate_player(self, player_id, reason):
         player = self.get_player_by_id(player_id)
-        if player and player['is_alive']:
+        if not player: return
+        with self._state_lock:
+            if not player['is_alive']: return
             player['is_alive'] = False
             player['revealed_role'] = player['role']
             day_log = next((log for log in self.game_state['game_log'] if log['day'] == self.game_state['day']), None)
@@ -510,6 +663,7 @@ class WerewolfWebGame:
                 day_log['eliminated_vote'] = player_id
             else:
                 day_log['eliminated_night'] = player_id
+            record_elimination(self.game_state, self.game_state['day'], player_id, reason, player['role'])
             self._save_game_state()
 
     def get_player_by_id(self, player_id):
@@ -527,9 +681,10 @@ class WerewolfWebGame:
         logging.info(message)
         self.socketio.emit('log_message', message)
         
-    def emit_speech(self, player_id, text):
+    def emit_speech(self, player_id, text, speech_id=None):
         """
         处理发言：向所有客户端发送文本，并根据游戏设置选择性地触发TTS。
+        speech_id 用于在trace中关联同一次发言的LLM生成与TTS分块。
         """
         player = self.get_player_by_id(player_id)
         nickname = player['nickname'] if player else f"玩家{player_id}"
@@ -541,19 +696,40 @@ class WerewolfWebGame:
         # --- 核心修改：只有在语音模式启用、TTS管理器存在且发言者是AI时才调用TTS ---
         if self.voice_enabled and self.tts_manager and player and not player.get('is_human', False):
             
-            def run_tts_in_thread():
-                try:
-                    asyncio.run(self.tts_manager.stream_tts_for_player(player_id, text))
-                except Exception as e:
-                    logging.error(f"玩家 {player_id} 的TTS线程出错: {e}", exc_info=True)
-
-            tts_thread = threading.Thread(target=run_tts_in_thread, daemon=True)
-            tts_thread.start()
-            logging.info(f"已为玩家 {player_id} 启动TTS线程 (语音模式)")
+            # 在发言产生时同步预约音频时段，保证播放顺序与发言顺序一致
+            slot = self.tts_manager.reserve_audio_slot(player_id)
+            future = self.tts_manager.submit_speech(player_id, text, slot, speech_id=speech_id)
+
+            def on_tts_done(done_future):
+                if done_future.cancelled():
+                    return
+                error = done_future.exception()
+                if error:
+                    logging.error(f"玩家 {player_id} 的TTS任务出错: {error}", exc_info=error)
+
+            future.add_done_callback(on_tts_done)
+            logging.info(f"已为玩家 {player_id} 提交TTS任务 (语音模式)")
         else:
             logging.info(f"玩家 {player_id} 发言 (文字模式)")
 
+    def shutdown(self):
+        """释放本局持有的后台资源（进行中的LLM调用、讨论调度、TTS事件循环线程与会话）。"""
+        self._game_token.cancel("对局已关闭")
+        self.discussion_active = False
+        self._stop_discussion_scheduler()
+        if self.tts_manager:
+            self.tts_manager.shutdown()
+        self._export_trace()
+
+    def _export_trace(self):
+        """结束阶段记录并导出本局的trace文件（每局只导出一次）。"""
+        if self.tracer.enabled and not self.tracer.exported_path:
+            self.tracer.set_phase(None)
+            self.tracer.export()
+
     def emit_phase_update(self, phase_text):
+        self.tracer.set_phase(phase_text)
+        self._apply_ready_summaries()
         self.game_state['phase'] = phase_text
         self.socketio.emit('phase_update', phase_text)
         self._save_game_state()
@@ -565,22 +741,14 @@ class WerewolfWebGame:
         human_player = self.get_human_player()
         if not human_player: return
         
-        # --- 修改：扩展颜色列表以支持更多玩家 ---
-        # 准备一个足够长的颜色列表，或者使用颜色生成算法
-        colors = [
-            '#ffb3ba', '#bae1ff', '#baffc9', '#ffffba', '#ffdfba', 
-            '#e0bbff', '#ffc9de', '#c9c9ff', '#f5c6a5', '#a5f5e0',
-            '#e6a5f5', '#f5e6a5' 
-        ] # 扩展到12种颜色
-
         state_for_client = {
             'players': [{
                 'id': p['id'], 
                 'nickname': p['nickname'], 
                 'isAlive': p['is_alive'], 
                 'isHuman': p['is_human'], 
-                # 使用取模运算来安全地获取颜色，防止数组越界
-                'color': colors[(p['id'] - 1) % len(colors)] 
+                # 每个座位的颜色都不同，人数超过12时按座位号生成
+                'color': seat_color(p['id'])
             } for p in sorted(self.game_state['players'], key=lambda x: x['id'])], 
             'day': self.game_state['day'], 
             'phase': self.game_state['phase'], 
@@ -597,8 +765,10 @@ class WerewolfWebGame:
         if len(werewolves) == 0: winner = "好人阵营"
         elif len(werewolves) >= len(good_players): winner = "狼人"
         if winner:
+            self._game_token.cancel("游戏已结束")
             self.game_state['phase'] = GamePhase.ENDED.value
             self.discussion_active = self.voting_active = self.night_active = False
+            self._stop_discussion_scheduler()
             end_message = f"🎉 游戏结束！{winner}获胜！"
             self.emit_log(end_message)
             all_roles_info = "-- - 最终身份公布 ---\n"
@@ -608,5 +778,6 @@ class WerewolfWebGame:
             self.emit_log(all_roles_info)
             self.socketio.emit('game_end', {'winner': winner})
             self._save_game_state()
+            self._export_trace()
             return True
         return False
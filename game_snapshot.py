@@ -0,0 +1,111 @@
+# game_snapshot.py
+
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+from game_models import Role
+
+# 投票、夜间行动等决策阶段会把对局状态交给多个后台线程同时读取，而游戏主流程和定时器仍可能在修改
+# game_state。决策阶段开始时拍一份只读快照，所有worker共享它：既不会读到修改到一半的状态，
+# 存活名单、各身份的有效目标、渲染好的历史记录等派生数据也只需计算一次。
+# 快照只包含决策函数读取的字段；已经结束的各天记录不会再变化，冻结一次后由同一局的所有快照共享，
+# 因此拍快照的开销只与当天的记录和参与决策的玩家记忆有关，不随对局天数增长。
+# 下面的模块函数同时接受普通的 game_state 字典和快照，快照上直接使用预先计算的结果。
+
+_SCALAR_KEYS = ('game_id', 'total_players', 'day', 'phase')
+
+def _freeze(value):
+    """深拷贝为只读结构：dict -> MappingProxyType，list -> tuple。"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+class GameSnapshot(Mapping):
+    """
+    对局状态的只读快照，按字典方式读取，与 game_state 的结构相同（只含决策需要的字段）。
+    memory_ids 为参与本次决策的玩家，只冻结他们的记忆（None 表示全部）；
+    frozen_days 为同一局共享的 {天数: 冻结后的当天记录} 缓存，已结束的天只冻结一次。
+    调用方需在修改 game_state 的同一把锁内创建快照。
+    """
+
+    def __init__(self, game_state, memory_ids=None, frozen_days: dict = None):
+        current_day = game_state.get('day')
+        state = {key: game_state[key] for key in _SCALAR_KEYS if key in game_state}
+        state['players'] = _freeze(game_state['players'])
+        state['game_log'] = tuple(self._freeze_day(log, current_day, frozen_days) for log in game_state.get('game_log', []))
+        if 'day_summaries' in game_state:
+            state['day_summaries'] = MappingProxyType(dict(game_state['day_summaries']))
+        if 'memories' in game_state:
+            memories = game_state['memories']
+            keys = memories.keys() if memory_ids is None else [str(pid) for pid in memory_ids if str(pid) in memories]
+            state['memories'] = MappingProxyType({key: _freeze(memories[key]) for key in keys})
+        self._state = MappingProxyType(state)
+        self._players_by_id = {p['id']: p for p in self._state['players']}
+        self.alive_players = tuple(p for p in self._state['players'] if p.get('is_alive'))
+        self.alive_ids = tuple(p['id'] for p in self.alive_players)
+        self.kill_targets = [p['id'] for p in self.alive_players if p['role'] != Role.WEREWOLF.value]
+        self._memo = {}
+        self._memo_lock = threading.RLock()
+
+    @staticmethod
+    def _freeze_day(day_log, current_day, frozen_days):
+        """当天的记录每次重新冻结；之前各天的记录不会再变化，从共享缓存中取。"""
+        if frozen_days is None or current_day is None or day_log.get('day', current_day) >= current_day:
+            return _freeze(day_log)
+        frozen = frozen_days.get(day_log['day'])
+        if frozen is None:
+            frozen = frozen_days[day_log['day']] = _freeze(day_log)
+        return frozen
+
+    def __getitem__(self, key):
+        return self._state[key]
+
+    def __iter__(self):
+        return iter(self._state)
+
+    def __len__(self):
+        return len(self._state)
+
+    def player(self, player_id: int):
+        return self._players_by_id.get(player_id)
+
+    def memo(self, key, compute):
+        """按 key 缓存派生结果，同一快照上只计算一次（并发时后到的线程等待先到的计算完成；计算中可以嵌套读取其他缓存项）。"""
+        with self._memo_lock:
+            if key not in self._memo:
+                self._memo[key] = compute()
+            return self._memo[key]
+
+def memoized(game_state, key, compute):
+    """快照上缓存 compute() 的结果，普通字典每次重新计算。"""
+    if isinstance(game_state, GameSnapshot):
+        return game_state.memo(key, compute)
+    return compute()
+
+def get_player(game_state, player_id: int):
+    if isinstance(game_state, GameSnapshot):
+        return game_state.player(player_id)
+    return next((p for p in game_state['players'] if p['id'] == player_id), None)
+
+def alive_players(game_state):
+    if isinstance(game_state, GameSnapshot):
+        return game_state.alive_players
+    return [p for p in game_state['players'] if p.get('is_alive')]
+
+def vote_targets(game_state, player_id: int) -> list:
+    """投票的有效目标：除自己以外的存活玩家。"""
+    return [p['id'] for p in alive_players(game_state) if p['id'] != player_id]
+
+def kill_targets(game_state) -> list:
+    """狼人的有效淘汰目标：存活的好人。"""
+    if isinstance(game_state, GameSnapshot):
+        return list(game_state.kill_targets)
+    return [p['id'] for p in alive_players(game_state) if p['role'] != Role.WEREWOLF.value]
+
+def seer_targets(game_state, player_id: int) -> list:
+    """预言家的有效查验目标：除自己以外尚未查验过的存活玩家。"""
+    seer = get_player(game_state, player_id)
+    checked_ids = {check['checked_id'] for check in (seer or {}).get('seer_knowledge', [])}
+    return [p['id'] for p in alive_players(game_state) if p['id'] != player_id and p['id'] not in checked_ids]
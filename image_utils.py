@@ -1,10 +1,20 @@
 # image_utils.py
 
+# Pillow 只在确实需要处理图片时才导入，避免拖慢服务器启动
+import io
 import os
+import json
+import hashlib
 import logging
-from PIL import Image
+import mimetypes
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from config import IMAGE_CONFIG, GAME_CONFIG
 
+# 记录每个头像的源文件信息与输出参数，只有变化的图片才会重新处理
+MANIFEST_FILE = 'manifest.json'
+
 def ensure_images_folder():
     """确保images文件夹和处理后的文件夹存在"""
     images_folder = os.path.join(os.getcwd(), 'images')
@@ -21,10 +31,62 @@ def find_player_image(player_id, images_folder):
             if os.path.exists(filepath): return filepath
     return None
 
+def _load_manifest(processed_folder):
+    path = os.path.join(processed_folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, json.JSONDecodeError):
+        return {}
+
+def _save_manifest(processed_folder, manifest):
+    try:
+        with open(os.path.join(processed_folder, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+    except IOError as e:
+        logging.error(f"保存头像清单失败: {e}")
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _output_settings():
+    """影响输出结果的配置，变化时所有头像都需要重新处理。"""
+    return {
+        "avatar_size": list(IMAGE_CONFIG['avatar_size']),
+        "output_format": IMAGE_CONFIG['output_format'],
+        "quality": IMAGE_CONFIG['quality']
+    }
+
+def _is_up_to_date(entry, source_path, stat, output_path):
+    """
+    判断已处理的头像是否仍然有效。
+    源文件大小与mtime未变时直接视为有效；mtime变化时再比较内容哈希，避免无谓的重新编码。
+    """
+    if not entry or not os.path.exists(output_path):
+        return False
+    if entry.get('source') != source_path or entry.get('settings') != _output_settings():
+        return False
+    if entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+        return True
+    if entry.get('size') == stat.st_size and entry.get('sha256') == _file_sha256(source_path):
+        entry['mtime'] = stat.st_mtime
+        return True
+    return False
+
 def process_player_image(player_id, source_path, processed_folder):
     """处理玩家图片：调整大小、格式转换并保存"""
+    from PIL import Image
     try:
         with Image.open(source_path) as img:
+            target_w, target_h = IMAGE_CONFIG['avatar_size']
+            # 大图先在解码阶段缩小：JPEG用draft按1/2^n解码
+            img.draft('RGB', (target_w * 2, target_h * 2))
             if img.mode != 'RGB':
                 if img.mode == 'RGBA':
                     background = Image.new('RGB', img.size, (255, 255, 255))
@@ -32,6 +94,10 @@ def process_player_image(player_id, source_path, processed_folder):
                     img = background
                 else:
                     img = img.convert('RGB')
+            # 其它格式转换为RGB后再用reduce做整数倍下采样（调色板、1位、16位等模式不支持reduce）
+            factor = min(img.width // (target_w * 2), img.height // (target_h * 2))
+            if factor > 1:
+                img = img.reduce(factor)
             
             img.thumbnail(IMAGE_CONFIG['avatar_size'], Image.Resampling.LANCZOS)
             canvas = Image.new('RGB', IMAGE_CONFIG['avatar_size'], (255, 255, 255))
@@ -53,20 +119,28 @@ def create_default_avatar(player_id, processed_folder):
     pass
 
 def initialize_player_avatars():
-    """初始化所有玩家头像 (新逻辑：如果源文件存在则强制覆盖)"""
+    """
+    增量初始化所有玩家头像：
+    只处理源文件或输出参数发生变化的图片，多张图片需要处理时使用进程池并行。
+    """
     images_folder, processed_folder = ensure_images_folder()
     logging.info("开始检查并初始化玩家头像...")
+    manifest = _load_manifest(processed_folder)
+    jobs = []
 
     for player_id in range(1, GAME_CONFIG['players_count'] + 1):
         # 1. 优先在 'images' 文件夹中查找源文件
         source_path = find_player_image(player_id, images_folder)
         
         if source_path:
-            # 2. 如果找到了源文件，则强制处理并覆盖旧头像
-            logging.info(f"找到玩家 {player_id} 的源文件，将进行处理或覆盖...")
-            if not process_player_image(player_id, source_path, processed_folder):
-                # 如果处理失败，创建一个默认头像作为备用
-                create_default_avatar(player_id, processed_folder)
+            # 2. 如果找到了源文件，仅在其内容或输出参数变化时重新处理
+            stat = os.stat(source_path)
+            output_path = os.path.join(processed_folder, f"{player_id}.jpg")
+            entry = manifest.get(str(player_id))
+            if _is_up_to_date(entry, source_path, stat, output_path):
+                continue
+            logging.info(f"玩家 {player_id} 的源文件有变化，将重新处理...")
+            jobs.append((player_id, source_path, stat))
         else:
             # 3. 如果没有找到源文件，才检查是否已存在处理过的头像
             processed_path = os.path.join(processed_folder, f"{player_id}.jpg")
@@ -75,4 +149,150 @@ def initialize_player_avatars():
                 logging.info(f"未找到玩家 {player_id} 的源文件且无已处理头像，将创建默认头像。")
                 create_default_avatar(player_id, processed_folder)
 
-    logging.info("玩家头像初始化检查完成")
\ No newline at end of file
+    if jobs:
+        workers = min(len(jobs), IMAGE_CONFIG.get('process_workers') or os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(process_player_image,
+                                        [job[0] for job in jobs], [job[1] for job in jobs],
+                                        [processed_folder] * len(jobs)))
+        else:
+            results = [process_player_image(player_id, source_path, processed_folder) for player_id, source_path, _ in jobs]
+
+        for (player_id, source_path, stat), output_path in zip(jobs, results):
+            if output_path:
+                manifest[str(player_id)] = {
+                    "source": source_path,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha256": _file_sha256(source_path),
+                    "settings": _output_settings()
+                }
+            else:
+                # 如果处理失败，创建一个默认头像作为备用
+                manifest.pop(str(player_id), None)
+                create_default_avatar(player_id, processed_folder)
+
+    _save_manifest(processed_folder, manifest)
+    logging.info(f"玩家头像初始化检查完成 (重新处理 {len(jobs)} 张)")
+
+# --- 内存中的头像与图片服务 ---
+def _strong_etag(data):
+    return hashlib.sha1(data).hexdigest()
+
+def _encode_image(img, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'WEBP':
+        img.save(buffer, format='WEBP', quality=IMAGE_CONFIG['quality'], method=6)
+    else:
+        img.save(buffer, format='JPEG', quality=IMAGE_CONFIG['quality'], optimize=True)
+    return buffer.getvalue()
+
+class AvatarStore:
+    """
+    处理后头像的内存缓存：每张头像的JPEG与WebP变体，以及把所有头像横向拼接的精灵图。
+    所有数据都带强ETag，页面请求时不再访问磁盘。
+    只由启动任务调用 refresh() 加载；加载完成前请求线程拿到None（对应404），不在请求中处理图片。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._avatars = {}
+        self._sprite = {}
+        self._sprite_ids = []
+        self._sprite_version = None
+
+    def refresh(self):
+        """从 processed_images 重新加载头像并生成WebP变体与精灵图（在头像处理完成后调用）。"""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        from PIL import Image
+        _, processed_folder = ensure_images_folder()
+        avatars = {}
+        tiles = []
+        for player_id in range(1, GAME_CONFIG['players_count'] + 1):
+            path = os.path.join(processed_folder, f"{player_id}.jpg")
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                jpeg_bytes = f.read()
+            with Image.open(io.BytesIO(jpeg_bytes)) as img:
+                img = img.convert('RGB')
+                webp_bytes = _encode_image(img, 'WEBP')
+                tiles.append((player_id, img.copy()))
+            avatars[player_id] = {
+                'image/jpeg': (jpeg_bytes, _strong_etag(jpeg_bytes)),
+                'image/webp': (webp_bytes, _strong_etag(webp_bytes))
+            }
+
+        sprite = {}
+        if tiles:
+            tile_w, tile_h = IMAGE_CONFIG['avatar_size']
+            sheet = Image.new('RGB', (tile_w * len(tiles), tile_h), (255, 255, 255))
+            for index, (_, tile) in enumerate(tiles):
+                sheet.paste(tile.resize((tile_w, tile_h)), (index * tile_w, 0))
+            for mimetype, image_format in (('image/jpeg', 'JPEG'), ('image/webp', 'WEBP')):
+                data = _encode_image(sheet, image_format)
+                sprite[mimetype] = (data, _strong_etag(data))
+
+        with self._lock:
+            self._avatars = avatars
+            self._sprite = sprite
+            self._sprite_ids = [player_id for player_id, _ in tiles]
+            self._sprite_version = sprite['image/jpeg'][1][:12] if sprite else None
+        logging.info(f"头像内存缓存已更新: {len(avatars)} 张头像，精灵图 {'已生成' if sprite else '未生成'}")
+
+    def get_avatar(self, player_id, accept_webp=False):
+        """返回 (数据, mimetype, etag)，找不到或尚未加载时返回None。"""
+        with self._lock:
+            variants = self._avatars.get(player_id)
+        if not variants:
+            return None
+        mimetype = 'image/webp' if accept_webp else 'image/jpeg'
+        data, etag = variants[mimetype]
+        return data, mimetype, etag
+
+    def get_sprite(self, accept_webp=False):
+        """返回精灵图 (数据, mimetype, etag)，没有头像或尚未加载时返回None。"""
+        with self._lock:
+            sprite = self._sprite
+        if not sprite:
+            return None
+        mimetype = 'image/webp' if accept_webp else 'image/jpeg'
+        data, etag = sprite[mimetype]
+        return data, mimetype, etag
+
+    def sprite_info(self):
+        """供前端定位的精灵图信息：带版本号的URL与各头像在图中的顺序。"""
+        with self._lock:
+            if not self._sprite_version:
+                return None
+            return {'url': f"/avatars/sprite?v={self._sprite_version}", 'ids': list(self._sprite_ids)}
+
+avatar_store = AvatarStore()
+
+# 静态图片（如彩蛋图片）的LRU缓存，条目数有上限，images 目录下任意文件被请求也不会无限增长
+_static_image_cache = OrderedDict()
+_static_image_cache_lock = threading.Lock()
+
+def load_static_image(path):
+    """读取并缓存静态图片（如彩蛋图片），返回 (数据, mimetype, etag)，文件不存在时返回None。"""
+    with _static_image_cache_lock:
+        cached = _static_image_cache.get(path)
+        if cached:
+            _static_image_cache.move_to_end(path)
+            return cached
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    cached = (data, mimetype, _strong_etag(data))
+    with _static_image_cache_lock:
+        _static_image_cache[path] = cached
+        while len(_static_image_cache) > IMAGE_CONFIG.get('static_cache_entries', 16):
+            _static_image_cache.popitem(last=False)
+    return cached
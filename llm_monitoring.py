@@ -2,20 +2,36 @@
 
 import json
 import logging
+import threading
 from datetime import datetime
 
 LOG_FILE = 'llm_calls.jsonl'
 
-def log_llm_call(call_type: str, player_id: int, prompt: str, response_data: dict, duration_ms: float):
+_USAGE_KEYS = ("prompt_eval_count", "eval_count", "prompt_tokens", "completion_tokens")
+
+# 进程内按调用类型累计的决策统计，用于观察重试率
+_decision_stats = {}
+# 进程内按调用类型累计的 本地估算 vs 供应商报告 的prompt token数，用于校准估算系数
+_estimate_stats = {}
+_stats_lock = threading.Lock()
+
+def log_llm_call(call_type: str, player_id: int, prompt: str, response_data: dict, duration_ms: float, estimated_prompt_tokens: int = None):
     """
     将一次完整的LLM调用信息记录到日志文件中。
 
-    :param call_type: 调用类型 ('speech' 或 'vote')
+    :param call_type: 调用类型 ('speech'、'vote'、'kill'、'summary')
     :param player_id: 发起调用的玩家ID
     :param prompt: 发送给LLM的完整Prompt
-    :param response_data: 从Ollama收到的完整JSON响应
+    :param response_data: 整理后的响应（Ollama 或 OpenAI 兼容字段名均可）
     :param duration_ms: 调用耗时（毫秒）
+    :param estimated_prompt_tokens: 发请求前本地估算的prompt token数
     """
+    # Ollama 使用 prompt_eval_count/eval_count，OpenAI 兼容接口使用 prompt_tokens/completion_tokens
+    prompt_tokens = response_data.get("prompt_eval_count") or response_data.get("prompt_tokens") or 0
+    completion_tokens = response_data.get("eval_count") or response_data.get("completion_tokens") or 0
+    if estimated_prompt_tokens is not None and prompt_tokens:
+        _record_estimate(call_type, estimated_prompt_tokens, prompt_tokens)
+
     try:
         log_entry = {
             "timestamp": datetime.utcnow().isoformat(),
@@ -23,16 +39,62 @@ def log_llm_call(call_type: str, player_id: int, prompt: str, response_data: dic
             "player_id": player_id,
             "duration_ms": round(duration_ms, 2),
             "usage": {
-                "prompt_tokens": response_data.get("prompt_eval_count", 0),
-                "completion_tokens": response_data.get("eval_count", 0),
-                "total_tokens": response_data.get("prompt_eval_count", 0) + response_data.get("eval_count", 0)
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "estimated_prompt_tokens": estimated_prompt_tokens
             },
             "prompt": prompt,
-            "response": response_data.get('response', '').strip()
+            "response": response_data.get('response', '').strip() if 'response' in response_data
+                        else json.dumps({k: v for k, v in response_data.items() if k not in _USAGE_KEYS}, ensure_ascii=False)
         }
         
         with open(LOG_FILE, 'a', encoding='utf-8') as f:
             f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
 
     except Exception as e:
-        logging.error(f"写入LLM监控日志失败: {e}")
\ No newline at end of file
+        logging.error(f"写入LLM监控日志失败: {e}")
+
+
+def record_decision_outcome(call_type: str, attempts: int, outcome: str):
+    """
+    记录一次决策调用（投票、夜杀等）的结果。
+
+    :param call_type: 调用类型 ('vote' 或 'kill')
+    :param attempts: 本次决策实际发起的LLM请求次数
+    :param outcome: 'valid'（格式正确）、'recovered'（容错解析恢复）或 'fallback'（随机兜底）
+    """
+    with _stats_lock:
+        stats = _decision_stats.setdefault(call_type, {"decisions": 0, "attempts": 0, "valid": 0, "recovered": 0, "fallback": 0})
+        stats["decisions"] += 1
+        stats["attempts"] += attempts
+        stats[outcome] += 1
+
+def get_decision_stats() -> dict:
+    """返回按调用类型汇总的决策统计，retry_rate 为平均每次决策的额外请求数。"""
+    with _stats_lock:
+        summary = {}
+        for call_type, stats in _decision_stats.items():
+            summary[call_type] = {
+                **stats,
+                "retry_rate": round((stats["attempts"] - stats["decisions"]) / stats["decisions"], 3) if stats["decisions"] else None
+            }
+        return summary
+
+def _record_estimate(call_type: str, estimated: int, reported: int):
+    with _stats_lock:
+        stats = _estimate_stats.setdefault(call_type, {"calls": 0, "estimated": 0, "reported": 0})
+        stats["calls"] += 1
+        stats["estimated"] += estimated
+        stats["reported"] += reported
+
+def get_token_estimate_stats() -> dict:
+    """返回按调用类型汇总的prompt token估算与实际值，ratio 为 实际/估算。"""
+    with _stats_lock:
+        return {
+            call_type: {
+                **stats,
+                "ratio": round(stats["reported"] / stats["estimated"], 3) if stats["estimated"] else None
+            }
+            for call_type, stats in _estimate_stats.items()
+        }
@@ -1,12 +1,26 @@
 # llm_utils.py
 
+# requests 在发起调用时才导入，避免拖慢服务器启动
 import logging
-import requests
 import json
 import random
 import time
-from config import LLM_PROVIDERS, PERSONAS, LLM_GENERATION_PARAMS, LLM_DEBUG_CONFIG
-from llm_monitoring import log_llm_call
+import threading
+import re
+import socket
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import GAME_CONFIG, LLM_PROVIDERS, LLM_GENERATION_PARAMS, LLM_DEBUG_CONFIG, LLM_ROUTER_CONFIG, LLM_CIRCUIT_BREAKER_CONFIG, LLM_RATE_LIMIT_CONFIG, LLM_CONTEXT_CONFIG, PLAYER_MEMORY_CONFIG, WARMUP_CONFIG
+from llm_monitoring import log_llm_call, record_decision_outcome
+from player_memory import render_memory
+from token_budget import estimate_tokens, assemble_prompt
+from circuit_breaker import CircuitOpenError, get_breaker
+from rate_limiter import RateLimitTimeout, get_limiter, call_priority, parse_retry_after
+from cancellation import CancellationToken, CancelledError
+import tracing
+from seating import seat_persona, is_large_table, format_id_ranges
+from game_snapshot import memoized, get_player, alive_players, vote_targets, kill_targets, seer_targets
 from game_models import Role
 
 # --- 参数合并与配置函数 ---
@@ -49,9 +63,107 @@ def _log_debug_info(call_type: str, player_id: int, prompt: str = None, response
         if prompt_tokens > 0 or completion_tokens > 0:
             logging.info(f"Token usage for player {player_id} ({call_type}): {prompt_tokens} prompt + {completion_tokens} completion = {prompt_tokens + completion_tokens} total")
 
+# --- 可取消的HTTP请求 ---
+_requests_module = None
+
+def _requests():
+    """首次使用时导入 requests 并缓存，模块导入时不加载。"""
+    global _requests_module
+    if _requests_module is None:
+        import requests
+        _requests_module = requests
+    return _requests_module
+
+# 所有LLM请求共用一个Session；连接池在取出连接时把连接报告给当前线程登记的回调，
+# 令牌被取消时直接关闭这些连接的socket，阻塞中的读写立即返回。
+_http_session = None
+_http_session_lock = threading.Lock()
+_http_local = threading.local()
+
+def _get_http_session():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            return _http_session
+        requests = _requests()
+        from requests.adapters import HTTPAdapter
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        def tracking(pool_class):
+            class TrackingPool(pool_class):
+                def _get_conn(self, timeout=None):
+                    conn = super()._get_conn(timeout=timeout)
+                    on_conn = getattr(_http_local, 'on_conn', None)
+                    if on_conn:
+                        on_conn(conn)
+                    return conn
+            return TrackingPool
+
+        class CancellableAdapter(HTTPAdapter):
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = {
+                    "http": tracking(HTTPConnectionPool),
+                    "https": tracking(HTTPSConnectionPool),
+                }
+
+        # 大桌投票时同时进行的请求数可达 max_decision_workers，连接池需容纳这么多连接才能全部复用
+        pool_size = max(10, GAME_CONFIG.get('large_table', {}).get('max_decision_workers', 32))
+        session = requests.Session()
+        session.mount("http://", CancellableAdapter(pool_maxsize=pool_size))
+        session.mount("https://", CancellableAdapter(pool_maxsize=pool_size))
+        _http_session = session
+        return session
+
+def _abort_connections(connections: list):
+    for conn in connections:
+        sock = getattr(conn, 'sock', None)
+        if sock is None:
+            continue
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def _post(url: str, cancel_token=None, timeout: float = 30, **kwargs):
+    """
+    发送POST请求；提供 cancel_token 时超时不超过其剩余时间，取消时中断正在进行的连接。
+    取消导致的失败抛出 CancelledError，其余网络错误照常抛出 requests 异常。
+    """
+    session = _get_http_session()
+    if cancel_token is None:
+        return session.post(url, timeout=timeout, **kwargs)
+    cancel_token.raise_if_cancelled()
+    connections = []
+    _http_local.on_conn = connections.append
+    unregister = cancel_token.on_cancel(lambda: _abort_connections(connections))
+    try:
+        return session.post(url, timeout=cancel_token.timeout(timeout), **kwargs)
+    except _requests().exceptions.RequestException as e:
+        if cancel_token.cancelled:
+            raise CancelledError(cancel_token.reason) from e
+        raise
+    finally:
+        unregister()
+        _http_local.on_conn = None
+
 # --- 增强的LLM API调用核心函数 ---
-def _call_ollama(config: dict, prompt: str, params: dict = None) -> dict:
-    """调用Ollama API，支持可配置参数"""
+def _parse_json_reply(raw_content: str) -> dict:
+    """解析决策回复中的JSON；整体解析失败时截取第一个花括号对象，仍失败则保留原文交给容错解析。"""
+    try:
+        return json.loads(raw_content)
+    except (TypeError, ValueError):
+        pass
+    match = re.search(r'\{.*\}', raw_content or '', re.S)
+    if match:
+        try:
+            return json.loads(match.group(0))
+        except ValueError:
+            pass
+    return {"raw_text": raw_content or ''}
+
+def _call_ollama(config: dict, prompt: str, params: dict = None, response_schema: dict = None, cancel_token=None) -> dict:
+    """调用Ollama API，支持可配置参数；提供 response_schema 时按JSON Schema约束输出"""
     if params is None:
         params = {}
     
@@ -69,16 +181,26 @@ def _call_ollama(config: dict, prompt: str, params: dict = None) -> dict:
         "prompt": prompt,
         "stream": False,
         "options": options,
-        "format": "json"
+        "format": response_schema or "json"
     }
+    if config.get("keep_alive"):
+        payload["keep_alive"] = config["keep_alive"]
     
     timeout = params.get("timeout", 30)
-    response = requests.post(config['api_url'], json=payload, timeout=timeout)
+    response = _post(config['api_url'], cancel_token, timeout=timeout, json=payload)
     response.raise_for_status()
-    return json.loads(response.json().get('response', '{}'))
+    raw_response = response.json()
+    result = _parse_json_reply(raw_response.get('response', '{}'))
+    # 附带用量字段，供监控记录真实token数
+    result["prompt_eval_count"] = raw_response.get("prompt_eval_count", 0)
+    result["eval_count"] = raw_response.get("eval_count", 0)
+    return result
 
-def _call_openai_compatible(config: dict, prompt: str, params: dict = None) -> dict:
-    """调用OpenAI兼容API，支持可配置参数"""
+def _call_openai_compatible(config: dict, prompt: str, params: dict = None, response_schema: dict = None, cancel_token=None) -> dict:
+    """
+    调用OpenAI兼容API，支持可配置参数。
+    提供 response_schema 时按供应商配置的 structured_output 使用 json_schema 或工具调用约束输出。
+    """
     if params is None:
         params = {}
     
@@ -93,6 +215,19 @@ def _call_openai_compatible(config: dict, prompt: str, params: dict = None) -> d
         "messages": [{"role": "user", "content": prompt}],
         "response_format": {"type": "json_object"}
     }
+    structured_output = config.get("structured_output", "json_schema") if response_schema else "json_object"
+    if structured_output == "json_schema":
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "decision", "schema": response_schema, "strict": True}
+        }
+    elif structured_output == "tools":
+        # 工具调用模式：把唯一的工具参数约束为 schema 中 arguments 的结构，并强制调用该工具
+        tool_schema = response_schema["properties"]
+        tool_name = tool_schema["tool_name"]["enum"][0]
+        del payload["response_format"]
+        payload["tools"] = [{"type": "function", "function": {"name": tool_name, "parameters": tool_schema["arguments"]}}]
+        payload["tool_choice"] = {"type": "function", "function": {"name": tool_name}}
     
     # 添加生成参数
     if "temperature" in params:
@@ -107,12 +242,22 @@ def _call_openai_compatible(config: dict, prompt: str, params: dict = None) -> d
         payload["frequency_penalty"] = params["frequency_penalty"]
     
     timeout = params.get("timeout", 30)
-    response = requests.post(config['api_url'], headers=headers, json=payload, timeout=timeout)
+    response = _post(config['api_url'], cancel_token, timeout=timeout, headers=headers, json=payload)
     response.raise_for_status()
-    raw_content = response.json().get('choices', [{}])[0].get('message', {}).get('content', '{}')
-    return json.loads(raw_content)
+    raw_response = response.json()
+    message = raw_response.get('choices', [{}])[0].get('message', {})
+    tool_calls = message.get('tool_calls') or []
+    if tool_calls:
+        function = tool_calls[0].get('function', {})
+        result = {"tool_name": function.get('name'), "arguments": _parse_json_reply(function.get('arguments', '{}'))}
+    else:
+        result = _parse_json_reply(message.get('content') or '{}')
+    # 附带用量字段，供监控记录真实token数
+    result["prompt_tokens"] = raw_response.get('usage', {}).get('prompt_tokens', 0)
+    result["completion_tokens"] = raw_response.get('usage', {}).get('completion_tokens', 0)
+    return result
 
-def _call_ollama_speech(config: dict, prompt: str, params: dict = None) -> dict:
+def _call_ollama_speech(config: dict, prompt: str, params: dict = None, cancel_token=None) -> dict:
     """调用Ollama API生成发言（不需要JSON格式）"""
     if params is None:
         params = {}
@@ -124,6 +269,8 @@ def _call_ollama_speech(config: dict, prompt: str, params: dict = None) -> dict:
         options["top_p"] = params["top_p"]
     if "presence_penalty" in params:
         options["repeat_penalty"] = 1.0 + params["presence_penalty"]
+    if params.get("max_tokens"):
+        options["num_predict"] = params["max_tokens"]
     
     payload = {
         "model": config['model'], 
@@ -131,13 +278,15 @@ def _call_ollama_speech(config: dict, prompt: str, params: dict = None) -> dict:
         "stream": False, 
         "options": options
     }
+    if config.get("keep_alive"):
+        payload["keep_alive"] = config["keep_alive"]
     
     timeout = params.get("timeout", 30)
-    response = requests.post(config['api_url'], json=payload, timeout=timeout)
+    response = _post(config['api_url'], cancel_token, timeout=timeout, json=payload)
     response.raise_for_status()
     return response.json()
 
-def _call_openai_compatible_speech(config: dict, prompt: str, params: dict = None) -> dict:
+def _call_openai_compatible_speech(config: dict, prompt: str, params: dict = None, cancel_token=None) -> dict:
     """调用OpenAI兼容API生成发言"""
     if params is None:
         params = {}
@@ -165,24 +314,376 @@ def _call_openai_compatible_speech(config: dict, prompt: str, params: dict = Non
         payload["frequency_penalty"] = params["frequency_penalty"]
     
     timeout = params.get("timeout", 30)
-    response = requests.post(config['api_url'], headers=headers, json=payload, timeout=timeout)
+    response = _post(config['api_url'], cancel_token, timeout=timeout, headers=headers, json=payload)
     response.raise_for_status()
     return response.json()
 
-def generate_llm_response(prompt: str, call_type: str, player_id: int, player_role: str = None) -> dict:
+# 返回自由文本（而非JSON决策）的调用类型
+_TEXT_CALL_TYPES = ('speech', 'summary')
+
+def _call_provider(provider_name: str, config: dict, prompt: str, call_type: str, generation_params: dict, response_schema: dict = None, cancel_token=None) -> dict:
+    """按供应商类型调用一次LLM并整理响应；失败时抛出异常，被取消时抛出 CancelledError。response_schema 仅用于决策调用。"""
+    if call_type in _TEXT_CALL_TYPES:
+        if provider_name == "ollama":
+            raw_response = _call_ollama_speech(config, prompt, generation_params, cancel_token)
+            return {
+                "response": raw_response.get('response', ''),
+                "prompt_eval_count": raw_response.get("prompt_eval_count", 0),
+                "eval_count": raw_response.get("eval_count", 0),
+            }
+        if provider_name == "openai_compatible":
+            raw_response = _call_openai_compatible_speech(config, prompt, generation_params, cancel_token)
+            return {
+                "response": raw_response.get('choices', [{}])[0].get('message', {}).get('content', ''),
+                "prompt_tokens": raw_response.get('usage', {}).get('prompt_tokens', 0),
+                "completion_tokens": raw_response.get('usage', {}).get('completion_tokens', 0),
+            }
+    else:
+        if provider_name == "ollama":
+            return _call_ollama(config, prompt, generation_params, response_schema, cancel_token)
+        if provider_name == "openai_compatible":
+            return _call_openai_compatible(config, prompt, generation_params, response_schema, cancel_token)
+    raise NotImplementedError(f"不支持的LLM供应商: {provider_name}")
+
+def _breaker_for(name: str, provider_name: str, config: dict):
+    """获取供应商的熔断器，探测时发送一个极短的发言请求。"""
+    probe_params = {"max_tokens": 1, "timeout": LLM_CIRCUIT_BREAKER_CONFIG.get("probe_timeout", 5)}
+    return get_breaker(name, probe=lambda: _call_provider(provider_name, config, "ping", 'speech', probe_params))
+
+def _is_rate_limited(error) -> bool:
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code == 429
+
+def _is_outage(error) -> bool:
+    """供应商不可用：连接失败、超时或5xx。4xx（如不支持的结构化输出参数、鉴权失败）说明供应商可达，不计入熔断。"""
+    exceptions = _requests().exceptions
+    if isinstance(error, (exceptions.ConnectionError, exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code >= 500
+
+def _retry_after(error) -> float:
+    """429响应要求的暂停秒数：优先使用 Retry-After 头，缺失时使用默认值，并限制在上限以内。"""
+    seconds = parse_retry_after(error.response.headers.get('Retry-After'))
+    if seconds is None:
+        seconds = LLM_RATE_LIMIT_CONFIG.get('default_retry_after', 5.0)
+    return min(seconds, LLM_RATE_LIMIT_CONFIG.get('max_retry_after', 60.0))
+
+def _usage_tokens(result: dict) -> int:
+    return (result.get('prompt_tokens', 0) + result.get('completion_tokens', 0)
+            or result.get('prompt_eval_count', 0) + result.get('eval_count', 0))
+
+def _call_with_breaker(breaker, provider_name: str, config: dict, prompt: str, call_type: str, generation_params: dict, response_schema: dict = None, cancel_token=None, priority: str = None) -> dict:
     """
-    增强的LLM响应生成函数，支持可配置参数
+    经熔断器和限流器调用供应商：熔断器打开时立即抛出 CircuitOpenError，连接失败、超时和5xx计入熔断统计；主动取消和其他4xx不计入。
+    配置了限额的后端（按熔断器的后端名区分）先按优先级排队取得额度；返回429时按 Retry-After 暂停该后端并重新排队，429不计入熔断。
     """
+    if not breaker.allow_request():
+        raise CircuitOpenError(f"LLM供应商 {breaker.name} 熔断中")
+    limiter = get_limiter(breaker.name)
+    priority = call_priority(call_type, priority)
+    estimated_tokens = 0
+    if limiter:
+        reserve = generation_params.get('max_tokens') or LLM_RATE_LIMIT_CONFIG.get('completion_token_reserve', 200)
+        estimated_tokens = estimate_tokens(prompt, config.get('model')) + reserve
+    max_429_retries = LLM_RATE_LIMIT_CONFIG.get('max_429_retries', 2)
+    for attempt in range(max_429_retries + 1):
+        if limiter:
+            with tracing.span("llm.rate_limit_wait", cat="llm", backend=breaker.name, priority=priority):
+                limiter.acquire(estimated_tokens, priority, cancel_token)
+        try:
+            result = _call_provider(provider_name, config, prompt, call_type, generation_params, response_schema, cancel_token)
+        except _requests().exceptions.RequestException as e:
+            if _is_rate_limited(e):
+                # 限流说明供应商可达，不计入熔断；在限流器内暂停后重试，而不是交给调用方的失败重试
+                if limiter and attempt < max_429_retries:
+                    limiter.pause(_retry_after(e))
+                    continue
+                raise
+            if _is_outage(e):
+                breaker.record_failure()
+            raise
+        # 响应解析失败说明供应商可达，不计入熔断
+        breaker.record_success()
+        if limiter:
+            limiter.record_usage(estimated_tokens, _usage_tokens(result))
+        return result
+
+# --- 多后端路由与对冲请求 ---
+# 等待后端结果时检查调用方令牌的间隔（秒）
+_CANCEL_POLL_INTERVAL = 0.2
+
+class _BackendStats:
+    """单个后端的延迟样本与胜出统计。"""
+
+    def __init__(self, sample_size: int):
+        self.latencies = deque(maxlen=sample_size)
+        self.calls = 0
+        self.wins = 0
+        self.errors = 0
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class LLMRouter:
+    """
+    在多个带权重的LLM后端之间路由请求。
+    主请求超过该后端观测到的p90延迟仍未返回时，向另一个后端发送对冲请求，取先成功返回的结果。
+    """
+
+    def __init__(self, router_config: dict):
+        self.config = router_config
+        self.backends = []
+        for backend in router_config.get('backends', []):
+            provider_name = backend['provider']
+            base_config = LLM_PROVIDERS.get(provider_name)
+            if not base_config:
+                logging.error(f"LLM路由配置错误: 未找到名为 '{provider_name}' 的供应商配置，已忽略。")
+                continue
+            overrides = {k: v for k, v in backend.items() if k not in ('provider', 'weight', 'name')}
+            config = {**base_config, **overrides}
+            name = backend.get('name') or f"{provider_name}:{config.get('model')}"
+            self.backends.append({"name": name, "provider": provider_name, "config": config, "weight": backend.get('weight', 1.0)})
+        sample_size = router_config.get('latency_sample_size', 200)
+        self.stats = {backend['name']: _BackendStats(sample_size) for backend in self.backends}
+        for backend in self.backends:
+            backend['breaker'] = _breaker_for(backend['name'], backend['provider'], backend['config'])
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=router_config.get('max_workers', 16), thread_name_prefix="llm-router")
+
+    def _pick(self, exclude: str = None) -> dict | None:
+        candidates = [b for b in self.backends if b['name'] != exclude and b['weight'] > 0 and b['breaker'].allow_request()]
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[b['weight'] for b in candidates])[0]
+
+    def _hedge_delay(self, backend_name: str) -> float:
+        """对冲等待时间：样本足够时取该后端的延迟分位数，否则使用配置的默认值。"""
+        stats = self.stats[backend_name]
+        with self._lock:
+            enough = len(stats.latencies) >= self.config.get('hedge_min_samples', 10)
+            observed = stats.percentile(self.config.get('hedge_percentile', 0.9)) if enough else None
+        return observed if observed is not None else self.config.get('hedge_default_delay', 8.0)
+
+    def _run(self, backend: dict, prompt: str, call_type: str, params: dict, response_schema: dict = None, cancel_token=None, priority: str = None) -> dict:
+        start_time = time.monotonic()
+        with self._lock:
+            self.stats[backend['name']].calls += 1
+        try:
+            with tracing.span("llm.backend", cat="llm", backend=backend['name']):
+                result = _call_with_breaker(backend['breaker'], backend['provider'], backend['config'], prompt, call_type, params, response_schema, cancel_token, priority)
+        except CancelledError:
+            raise
+        except Exception:
+            with self._lock:
+                self.stats[backend['name']].errors += 1
+            raise
+        with self._lock:
+            self.stats[backend['name']].latencies.append(time.monotonic() - start_time)
+        return result
+
+    def call(self, prompt: str, call_type: str, params: dict, response_schema: dict = None, cancel_token=None, priority: str = None) -> dict:
+        """
+        路由一次调用，返回先成功的后端结果；全部失败时抛出最后一个异常。
+        每个后端请求持有 cancel_token 的子令牌：有结果后取消其余请求的令牌，真正中断败者的连接。
+        """
+        primary = self._pick()
+        if primary is None:
+            raise CircuitOpenError("LLM路由的所有后端均在熔断中")
+        parent = cancel_token or CancellationToken()
+        futures = {}
+        tokens = {}
+
+        def submit(backend):
+            token = parent.child()
+            # 带上调用方的追踪上下文，后端请求的span与发起它的调用关联
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, self._run, backend, prompt, call_type, params, response_schema, token, priority)
+            futures[future] = backend
+            tokens[future] = token
+
+        submit(primary)
+        if self.config.get('hedge', True):
+            hedge_at = time.monotonic() + self._hedge_delay(primary['name'])
+            done = set()
+            while not done and not parent.cancelled and time.monotonic() < hedge_at:
+                done, _ = wait(futures, timeout=min(_CANCEL_POLL_INTERVAL, max(0.0, hedge_at - time.monotonic())))
+            if not done and not parent.cancelled:
+                secondary = self._pick(exclude=primary['name'])
+                if secondary is not None:
+                    logging.info(f"LLM请求超过 {primary['name']} 的对冲阈值，向 {secondary['name']} 发送对冲请求")
+                    submit(secondary)
+
+        last_error = None
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=_CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if not done:
+                    parent.raise_if_cancelled()
+                    continue
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    winner = futures[future]
+                    with self._lock:
+                        self.stats[winner['name']].wins += 1
+                    return result
+            raise last_error
+        finally:
+            # 胜出、失败或被取消后，尚未开始的请求直接取消，进行中的请求中断连接
+            for future in futures:
+                future.cancel()
+                tokens[future].cancel("对冲请求已有结果")
+
+    def get_stats(self) -> dict:
+        """各后端的调用数、胜出数、错误数与延迟分位数。"""
+        with self._lock:
+            return {
+                name: {
+                    "calls": stats.calls,
+                    "wins": stats.wins,
+                    "errors": stats.errors,
+                    "p50_ms": round(stats.percentile(0.5) * 1000, 1) if stats.latencies else None,
+                    "p90_ms": round(stats.percentile(0.9) * 1000, 1) if stats.latencies else None,
+                }
+                for name, stats in self.stats.items()
+            }
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_llm_router() -> LLMRouter | None:
+    """启用路由时返回进程内共享的路由器，否则返回None。"""
+    global _router
+    if not LLM_ROUTER_CONFIG.get('enabled'):
+        return None
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter(LLM_ROUTER_CONFIG)
+        return _router
+
+# --- 开局预热与健康探测 ---
+# 按后端记录最近一次预热探测的结果，通过 /status 查看；
+# 预热在进程内共享，最近预热成功或正在预热的后端在新对局开始时跳过
+_backend_health = {}
+_backend_warmed_at = {}
+_backend_warming = set()
+_health_lock = threading.Lock()
+
+def _warmup_backends() -> list:
+    """当前生效的后端：启用路由时为全部路由后端，否则为默认供应商。"""
+    router = get_llm_router()
+    if router:
+        return [(b['name'], b['provider'], b['config'], b['breaker']) for b in router.backends]
     provider_name = LLM_PROVIDERS.get("default", "ollama")
     config = LLM_PROVIDERS.get(provider_name)
-
     if not config:
+        return []
+    return [(provider_name, provider_name, config, _breaker_for(provider_name, provider_name, config))]
+
+def _preload_ollama(config: dict, timeout: float, cancel_token=None):
+    """只带模型名的生成请求会让Ollama加载模型并按 keep_alive 常驻，不生成内容。"""
+    payload = {"model": config['model'], "keep_alive": config.get('keep_alive', '30m')}
+    response = _post(config['api_url'], cancel_token, timeout=timeout, json=payload)
+    response.raise_for_status()
+
+def _warm_up_backend(name: str, provider_name: str, config: dict, breaker, cancel_token=None) -> dict:
+    """
+    预热单个后端：Ollama先预加载模型（不生成内容），再发送一次极短的探测请求，建立连接并测量延迟。
+    探测经过熔断器，后端不可用时在首个真实调用之前就开始计数。
+    """
+    timeout = WARMUP_CONFIG.get('probe_timeout', 30)
+    probe_params = {"max_tokens": 1, "timeout": timeout}
+    health = {"ok": False, "warmup_ms": None, "latency_ms": None, "error": None}
+    try:
+        start_time = time.monotonic()
+        if provider_name == "ollama":
+            _preload_ollama(config, timeout, cancel_token)
+        probe_start = time.monotonic()
+        _call_with_breaker(breaker, provider_name, config, "ping", 'speech', probe_params, cancel_token=cancel_token, priority='background')
+        health["latency_ms"] = round((time.monotonic() - probe_start) * 1000, 1)
+        health["warmup_ms"] = round((time.monotonic() - start_time) * 1000, 1)
+        health["ok"] = True
+        logging.info(f"LLM后端 {name} 预热完成: 预热 {health['warmup_ms']}ms，探测延迟 {health['latency_ms']}ms")
+    except CancelledError:
+        health["error"] = "已取消"
+    except Exception as e:
+        health["error"] = str(e)
+        logging.warning(f"LLM后端 {name} 预热失败: {e}")
+    health["checked_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    with _health_lock:
+        _backend_health[name] = health
+        _backend_warming.discard(name)
+        if health["ok"]:
+            _backend_warmed_at[name] = time.monotonic()
+    return health
+
+def _claim_warm_up(name: str) -> bool:
+    """后端在 llm_rewarm_after 秒内预热成功过或正在预热时返回False，否则登记为正在预热。"""
+    with _health_lock:
+        if name in _backend_warming:
+            return False
+        warmed_at = _backend_warmed_at.get(name)
+        if warmed_at is not None and time.monotonic() - warmed_at < WARMUP_CONFIG.get('llm_rewarm_after', 600):
+            return False
+        _backend_warming.add(name)
+        return True
+
+def warm_up_llm(cancel_token=None) -> dict:
+    """并行预热当前生效且尚未预热的LLM后端，返回这些后端的健康探测结果。"""
+    backends = [backend for backend in _warmup_backends() if _claim_warm_up(backend[0])]
+    if not backends:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(backends), thread_name_prefix="llm-warmup") as executor:
+        futures = {executor.submit(_warm_up_backend, *backend, cancel_token=cancel_token): backend[0] for backend in backends}
+        return {futures[future]: future.result() for future in futures}
+
+def get_backend_health() -> dict:
+    """各LLM后端最近一次预热探测的结果。"""
+    with _health_lock:
+        return {name: dict(health) for name, health in _backend_health.items()}
+
+def generate_llm_response(prompt: str, call_type: str, player_id: int, player_role: str = None, response_schema: dict = None, cancel_token=None, priority: str = None) -> dict:
+    """
+    增强的LLM响应生成函数，支持可配置参数。
+    启用 LLM_ROUTER_CONFIG 时经由多后端路由器（含对冲请求）调用，否则使用默认供应商。
+    决策调用可传入 response_schema，由供应商侧的结构化输出约束回复格式。
+    传入 cancel_token 时，令牌被取消会中断进行中的请求，并返回带 "cancelled" 标记的错误。
+    priority 为限流的优先级类别（见 LLM_RATE_LIMIT_CONFIG），不传时按 call_type 归类；
+    排队等待额度超时返回带 "rate_limited" 标记的错误。
+    """
+    with tracing.span(f"llm.{call_type}", cat="llm", player_id=player_id) as span_args:
+        response_data = _generate_llm_response(prompt, call_type, player_id, player_role, response_schema, cancel_token, priority)
+        for key in ("error", "cancelled", "circuit_open", "rate_limited", "prompt_tokens", "completion_tokens", "prompt_eval_count", "eval_count"):
+            if key in response_data:
+                span_args[key] = response_data[key]
+    return response_data
+
+def _generate_llm_response(prompt: str, call_type: str, player_id: int, player_role: str = None, response_schema: dict = None, cancel_token=None, priority: str = None) -> dict:
+    if cancel_token is not None and cancel_token.cancelled:
+        return {"error": cancel_token.reason, "cancelled": True}
+
+    router = get_llm_router()
+    provider_name = "router" if router else LLM_PROVIDERS.get("default", "ollama")
+    config = LLM_PROVIDERS.get(provider_name)
+
+    if not router and not config:
         logging.error(f"LLM配置错误: 未找到名为 '{provider_name}' 的供应商配置。")
         return {"error": "LLM configuration error"}
 
     # 获取合并后的生成参数
     generation_params = _get_generation_params(call_type, player_role)
-    
+
+    # 发请求前在本地估算prompt大小，与供应商返回的用量一起记录
+    estimated_prompt_tokens = estimate_tokens(prompt, None if router else config.get('model'))
+
     start_time = time.monotonic()
     response_data = {}
     
@@ -191,30 +692,26 @@ def generate_llm_response(prompt: str, call_type: str, player_id: int, player_ro
         _log_debug_info(call_type, player_id, prompt=prompt)
     
     try:
-        if call_type == 'speech':
-            if provider_name == "ollama":
-                raw_response = _call_ollama_speech(config, prompt, generation_params)
-                response_data = {
-                    "response": raw_response.get('response', ''),
-                    "prompt_eval_count": raw_response.get("prompt_eval_count", 0),
-                    "eval_count": raw_response.get("eval_count", 0),
-                }
-            elif provider_name == "openai_compatible":
-                raw_response = _call_openai_compatible_speech(config, prompt, generation_params)
-                response_data = {
-                    "response": raw_response.get('choices', [{}])[0].get('message', {}).get('content', ''),
-                    "prompt_tokens": raw_response.get('usage', {}).get('prompt_tokens', 0),
-                    "completion_tokens": raw_response.get('usage', {}).get('completion_tokens', 0),
-                }
+        if router:
+            response_data = router.call(prompt, call_type, generation_params, response_schema, cancel_token, priority)
         else:
-            if provider_name == "ollama":
-                response_data = _call_ollama(config, prompt, generation_params)
-            elif provider_name == "openai_compatible":
-                response_data = _call_openai_compatible(config, prompt, generation_params)
-            else:
-                raise NotImplementedError(f"不支持的LLM供应商: {provider_name}")
-
-    except requests.exceptions.RequestException as e:
+            breaker = _breaker_for(provider_name, provider_name, config)
+            response_data = _call_with_breaker(breaker, provider_name, config, prompt, call_type, generation_params, response_schema, cancel_token, priority)
+
+    except CancelledError as e:
+        # 阶段已结束，结果不再需要，也不记入监控
+        logging.debug(f"玩家{player_id}的LLM调用已取消 ({call_type}): {e}")
+        return {"error": str(e) or "已取消", "cancelled": True}
+
+    except CircuitOpenError as e:
+        # 熔断中不发起请求，调用方直接使用兜底逻辑
+        logging.debug(f"玩家{player_id}的LLM调用被熔断器拒绝 ({call_type}): {e}")
+        return {"error": str(e), "circuit_open": True}
+    except RateLimitTimeout as e:
+        # 没有发出请求，不记入监控
+        logging.warning(f"玩家{player_id}的LLM调用未能取得限流额度 ({call_type}): {e}")
+        return {"error": str(e), "rate_limited": True}
+    except _requests().exceptions.RequestException as e:
         logging.error(f"调用LLM API失败 ({provider_name}): {e}")
         response_data = {"error": str(e)}
     except Exception as e:
@@ -227,56 +724,150 @@ def generate_llm_response(prompt: str, call_type: str, player_id: int, player_ro
     _log_debug_info(call_type, player_id, response=response_data, duration=duration_ms)
     
     # 记录到监控系统
-    log_llm_call(call_type, player_id, prompt, response_data, duration_ms)
+    log_llm_call(call_type, player_id, prompt, response_data, duration_ms, estimated_prompt_tokens)
     
     return response_data
 
 # --- Prompt构建与工具调用函数 ---
 def _get_player_nickname(game_state: dict, player_id: int) -> str:
-    player = next((p for p in game_state['players'] if p['id'] == player_id), None)
+    player = get_player(game_state, player_id)
     return player.get('nickname', f"玩家{player_id}") if player else f"玩家{player_id}"
 
-def _build_game_history_text(game_state: dict) -> str:
-    history_lines = []
+def _compact_roster(game_state: dict) -> bool:
+    """大桌模式下名单和发言记录只写编号，避免每个prompt重复几十个昵称。"""
+    return is_large_table(len(game_state['players'])) and GAME_CONFIG.get('large_table', {}).get('compact_roster', True)
+
+def _roster_text(game_state: dict, player_ids: list) -> str:
+    """prompt中的玩家名单：普通桌列出昵称与编号，大桌压缩为编号区间。"""
+    if _compact_roster(game_state):
+        return f"{format_id_ranges(player_ids)}（共{len(player_ids)}人）"
+    return str([f"{_get_player_nickname(game_state, pid)}({pid}号)" for pid in player_ids])
+
+def _alive_ids_text(game_state: dict) -> str:
+    alive_ids = [p['id'] for p in alive_players(game_state)]
+    return f"{format_id_ranges(alive_ids)}（共{len(alive_ids)}人）" if _compact_roster(game_state) else str(alive_ids)
+
+def _night_result_lines(game_state: dict, day: int) -> list:
+    """第day天天亮时公布的昨夜结果。"""
+    prev_day_log = next((log for log in game_state['game_log'] if log.get('day') == day - 1), None)
+    if prev_day_log and prev_day_log.get('eliminated_night'):
+        eliminated_id = prev_day_log['eliminated_night']
+        nickname = _get_player_nickname(game_state, eliminated_id)
+        player = get_player(game_state, eliminated_id)
+        role = player.get('revealed_role', '未知') if player else '未知'
+        return [f"--- 第 {day} 天 (天亮) ---", f"[昨夜结果] {nickname}({eliminated_id}号)被淘汰，身份是: {role}。"]
+    return [f"--- 第 {day} 天 (天亮) ---", "[昨夜结果] 平安夜。"]
+
+def _speech_lines(game_state: dict, day_log: dict) -> list:
+    lines = []
+    if day_log.get('speeches'):
+        lines.append("[白天发言]")
+        compact = _compact_roster(game_state)
+        for speech in day_log['speeches']:
+            if compact:
+                lines.append(f"  - {speech['player_id']}号: \"{speech['text']}\"")
+                continue
+            nickname = _get_player_nickname(game_state, speech['player_id'])
+            lines.append(f"  - {nickname}({speech['player_id']}号): \"{speech['text']}\"")
+    return lines
+
+def _build_history_blocks(game_state: dict) -> list:
+    """
+    按天生成历史记录块 [(day, lines)]。
+    已结束且已有摘要的天数用摘要代替逐条发言，当天保持原文。
+    """
+    summaries = game_state.get('day_summaries', {})
+    current_day = game_state['day']
+    blocks = []
     for day_log in game_state.get('game_log', []):
         day = day_log['day']
-        if day > 1:
-            prev_day_log = next((log for log in game_state['game_log'] if log['day'] == day - 1), None)
-            if prev_day_log and prev_day_log.get('eliminated_night'):
-                eliminated_id = prev_day_log['eliminated_night']
-                nickname = _get_player_nickname(game_state, eliminated_id)
-                player = next((p for p in game_state['players'] if p['id'] == eliminated_id), None)
-                role = player.get('revealed_role', '未知') if player else '未知'
-                history_lines.append(f"--- 第 {day} 天 (天亮) ---")
-                history_lines.append(f"[昨夜结果] {nickname}({eliminated_id}号)被淘汰，身份是: {role}。")
-            else:
-                history_lines.append(f"--- 第 {day} 天 (天亮) ---")
-                history_lines.append("[昨夜结果] 平安夜。")
+        lines = _night_result_lines(game_state, day) if day > 1 else [f"--- 第 {day} 天 ---"]
+        summary = summaries.get(str(day)) if day < current_day else None
+        if summary and day_log.get('speeches'):
+            lines.append(f"[白天发言摘要] {summary}")
         else:
-             history_lines.append(f"--- 第 {day} 天 ---")
-        if day_log.get('speeches'):
-            history_lines.append("[白天发言]")
-            for speech in day_log['speeches']:
-                nickname = _get_player_nickname(game_state, speech['player_id'])
-                history_lines.append(f"  - {nickname}({speech['player_id']}号): \"{speech['text']}\"")
+            lines.extend(_speech_lines(game_state, day_log))
         if day_log.get('eliminated_vote'):
             eliminated_id = day_log['eliminated_vote']
             nickname = _get_player_nickname(game_state, eliminated_id)
-            player = next((p for p in game_state['players'] if p['id'] == eliminated_id), None)
+            player = get_player(game_state, eliminated_id)
             role = player.get('revealed_role', '未知') if player else '未知'
-            history_lines.append(f"[投票结果] {nickname}({eliminated_id}号)被投票淘汰，身份是: {role}。")
-    current_day = game_state['day']
-    is_today_logged = any(f"--- 第 {current_day} 天" in line for line in history_lines)
-    if not is_today_logged and current_day > 1:
+            lines.append(f"[投票结果] {nickname}({eliminated_id}号)被投票淘汰，身份是: {role}。")
+        blocks.append((day, lines))
+    if current_day > 1 and not any(day == current_day for day, _ in blocks):
         prev_day_log = next((log for log in game_state['game_log'] if log.get('day') == current_day - 1), None)
         if prev_day_log and prev_day_log.get('eliminated_night'):
-            eliminated_id = prev_day_log['eliminated_night']
-            nickname = _get_player_nickname(game_state, eliminated_id)
-            player = next((p for p in game_state['players'] if p['id'] == eliminated_id), None)
-            role = player.get('revealed_role', '未知') if player else '未知'
-            history_lines.append(f"--- 第 {current_day} 天 (天亮) ---")
-            history_lines.append(f"[昨夜结果] {nickname}({eliminated_id}号)被淘汰，身份是: {role}。")
-    return "\n".join(history_lines) if history_lines else "游戏刚刚开始，还没有任何历史记录。"
+            blocks.append((current_day, _night_result_lines(game_state, current_day)))
+    return blocks
+
+def _build_game_history_text(game_state: dict, max_tokens: int = None) -> str:
+    """
+    生成游戏历史文本。超过 max_tokens 时先从最早的一天开始省略，
+    只剩当天仍然超出时再省略当天最早的发言。在决策快照上同一预算的结果只渲染一次，由该阶段所有worker共享。
+    """
+    return memoized(game_state, ('history_text', max_tokens), lambda: _render_game_history(game_state, max_tokens))
+
+def _render_game_history(game_state: dict, max_tokens: int = None) -> str:
+    blocks = list(memoized(game_state, 'history_blocks', lambda: _build_history_blocks(game_state)))
+    if not blocks:
+        return "游戏刚刚开始，还没有任何历史记录。"
+    if max_tokens is not None:
+        omitted_note = "（更早的记录已省略）"
+        budget = max_tokens - estimate_tokens(omitted_note)
+        sizes = [sum(estimate_tokens(line) + 1 for line in lines) for _, lines in blocks]
+        omitted = False
+        while len(blocks) > 1 and sum(sizes) > budget:
+            blocks.pop(0)
+            sizes.pop(0)
+            omitted = True
+        day, lines = blocks[0]
+        if sizes[0] > budget:
+            lines = list(lines)
+            speech_start = next((i + 1 for i, line in enumerate(lines) if line == "[白天发言]"), len(lines))
+            while sizes[0] > budget and speech_start < len(lines) and lines[speech_start].startswith("  - "):
+                sizes[0] -= estimate_tokens(lines.pop(speech_start)) + 1
+                omitted = True
+            blocks[0] = (day, lines)
+        if omitted:
+            blocks.insert(0, (None, [omitted_note]))
+    return "\n".join(line for _, lines in blocks for line in lines)
+
+# --- 已结束天数的发言摘要 ---
+def _extractive_day_summary(game_state: dict, day_log: dict, max_chars: int) -> str:
+    """不依赖LLM的兜底摘要：每位玩家保留首句的前若干字。"""
+    speeches = day_log.get('speeches', [])
+    if not speeches:
+        return ""
+    per_speech = max(8, max_chars // len(speeches))
+    parts = []
+    for speech in speeches:
+        first_clause = re.split(r'[。！？!?]', speech['text'].strip(), maxsplit=1)[0]
+        parts.append(f"{speech['player_id']}号: {first_clause[:per_speech]}")
+    return "；".join(parts)[:max_chars]
+
+def summarize_day(game_state: dict, day: int, cancel_token=None) -> str:
+    """
+    把第day天的白天发言压缩为摘要，供之后的prompt代替逐条发言使用。
+    LLM摘要失败时退回到抽取式摘要。
+    """
+    day_log = next((log for log in game_state.get('game_log', []) if log['day'] == day), None)
+    if not day_log or not day_log.get('speeches'):
+        return ""
+    max_chars = LLM_CONTEXT_CONFIG.get("summary_max_chars", 300)
+    if LLM_CONTEXT_CONFIG.get("use_llm_summary", True):
+        transcript = "\n".join(_speech_lines(game_state, day_log)[1:])
+        prompt = f"""以下是一局狼人杀第 {day} 天白天的公开发言记录：
+{transcript}
+
+请把这些发言压缩成不超过{max_chars}字的摘要。按玩家编号列出每人的关键立场：自称的身份、给出的查验信息、怀疑或支持的对象。只保留发言中明确出现的信息，不要推测，不要评价。直接输出摘要："""
+        response_data = generate_llm_response(prompt, call_type='summary', player_id=0, cancel_token=cancel_token)
+        if response_data.get("cancelled"):
+            return ""
+        summary = response_data.get('response', '').strip()
+        if summary:
+            return summary[:max_chars * 2]
+        logging.warning(f"第{day}天的LLM摘要生成失败，使用抽取式摘要。")
+    return _extractive_day_summary(game_state, day_log, max_chars)
 
 def _get_seer_secret_knowledge_text(player: dict) -> str:
     if player.get('role') != Role.SEER.value or not player.get('seer_knowledge'): return ""
@@ -287,18 +878,34 @@ def _get_seer_secret_knowledge_text(player: dict) -> str:
     knowledge_lines.append("---")
     return "\n".join(knowledge_lines)
 
+def _context_sections(game_state: dict, player: dict, decision: bool) -> list:
+    """
+    返回私有情报（memory）与历史记录（history）两个prompt片段。
+    启用玩家记忆时用记忆代替预言家情报；决策调用可配置为只使用记忆而不附带完整历史。
+    历史记录片段可在超出预算时按token数压缩。
+    """
+    memory_text = render_memory(game_state, player['id']) if PLAYER_MEMORY_CONFIG.get('enabled', True) else ""
+    memory_section = {"name": "memory", "text": memory_text or _get_seer_secret_knowledge_text(player)}
+    if decision and memory_text and PLAYER_MEMORY_CONFIG.get('decisions_use_memory_only', True):
+        return [memory_section, {"name": "history", "text": ""}]
+    heading = "# 完整的游戏历史记录"
+
+    def shrink(max_tokens):
+        return f"{heading}\n{_build_game_history_text(game_state, max_tokens=max(0, max_tokens - estimate_tokens(heading) - 1))}"
+
+    history_section = {"name": "history", "text": f"{heading}\n{_build_game_history_text(game_state)}", "shrink": shrink}
+    return [memory_section, history_section]
+
 def construct_llm_prompt(game_state: dict, player_id: int) -> str:
     """
     为AI玩家构建一个高度情景化和策略化的LLM Prompt。
     """
-    player = next(p for p in game_state['players'] if p['id'] == player_id)
+    player = get_player(game_state, player_id)
     role = player['role']
     
     # 1. 基础信息模块
-    persona_prompt = PERSONAS.get(player_id, "")
+    persona_prompt = seat_persona(player_id)
     role_play_section = f"# 你的角色扮演指导\n{persona_prompt}\n---" if persona_prompt else ""
-    game_history = _build_game_history_text(game_state)
-    seer_knowledge = _get_seer_secret_knowledge_text(player)
     
     # 2. 动态生成任务和策略模块 (核心修改)
     mission = ""
@@ -350,38 +957,37 @@ def construct_llm_prompt(game_state: dict, player_id: int) -> str:
             "4.  **保持清醒**：不要轻易被别人的发言煽动。作为村民，你的每一票都至关重要。"     
         )
 
-    # 3. 组装最终的Prompt
-    prompt = f"""你正在玩一场狼人杀游戏。
+    # 3. 组装最终的Prompt（按片段组装，超出预算时裁剪低优先级片段）
+    rules = """你正在玩一场狼人杀游戏。
 # 游戏规则
 1.  **身份配置**：有**村民**、**狼人**和一名**预言家**。
 2.  **胜利条件**：村民阵营（村民、预言家）淘汰所有狼人；或狼人数量不少于好人。
 3.  **特殊时期**: 第一天之前除了预言家验人，并没有其他游戏记录，且大家发言都是严格编号按照顺序进行的，除了自由发言时期。
-4.  **游戏流程**：游戏流程为白天顺序发言、自由发言，投票（第一天不投票），夜晚（预言家验人、狼人淘汰人），然后又是白天，以此循环。
-{role_play_section}
-# 你的身份与任务
-你是 {player['nickname']}({player_id}号)。{mission}
-{seer_knowledge}
-# 完整的游戏历史记录
-{game_history}
-# 当前局势
+4.  **游戏流程**：游戏流程为白天顺序发言、自由发言，投票（第一天不投票），夜晚（预言家验人、狼人淘汰人），然后又是白天，以此循环。"""
+    situation = f"""# 当前局势
 - **当前阶段**: 第 {game_state['day']} 天，轮到你发言。
-- **存活玩家**: {[p['id'] for p in game_state['players'] if p['is_alive']]}。
-{guidelines}
-# 发言要求
+- **存活玩家**: {_alive_ids_text(game_state)}。"""
+    requirements = """# 发言要求
 - **直接输出**：直接给出你的发言内容，不要包含任何前缀，如"我的发言是:"。
 - **发言简短**：尽量控制在40字以内。
 
 现在，请发言："""
-    return prompt
+    sections = [
+        {"name": "rules", "text": rules},
+        {"name": "persona", "text": role_play_section},
+        {"name": "identity", "text": f"# 你的身份与任务\n你是 {player['nickname']}({player_id}号)。{mission}"},
+        *_context_sections(game_state, player, decision=False),
+        {"name": "situation", "text": situation},
+        {"name": "guidelines", "text": guidelines},
+        {"name": "requirements", "text": requirements},
+    ]
+    return assemble_prompt(sections, 'speech')
 
 def construct_voting_prompt(game_state: dict, player_id: int) -> str:
-    player = next(p for p in game_state['players'] if p['id'] == player_id)
-    persona_prompt = PERSONAS.get(player_id, "")
+    player = get_player(game_state, player_id)
+    persona_prompt = seat_persona(player_id)
     role_play_section = f"# 你的角色扮演指导\n{persona_prompt}\n---" if persona_prompt else ""
     role = player['role']
-    alive_players = [p for p in game_state['players'] if p.get('is_alive')]
-    game_history = _build_game_history_text(game_state)
-    seer_knowledge = _get_seer_secret_knowledge_text(player)
     
     tool_definition = """
 # 工具定义
@@ -395,74 +1001,158 @@ def construct_voting_prompt(game_state: dict, player_id: int) -> str:
   - `reason` (字符串, 必需): 你投票给这个玩家的简要理由。
 """
     
-    prompt = f"""你正在玩一场狼人杀游戏，现在是第 {game_state['day']} 天的投票阶段。
-{role_play_section}
-你的身份是 **{role}**。
-{seer_knowledge}
-# 完整的游戏历史记录
-{game_history}
-# 投票目标
+    targets = f"""# 投票目标
 从以下存活玩家中选择一人进行投票（不能投给自己）：
-{[_get_player_nickname(game_state, p['id']) + '(' + str(p['id']) + '号)' for p in alive_players if p['id'] != player_id]}
+{_roster_text(game_state, vote_targets(game_state, player_id))}
 {tool_definition}
 请根据你的分析，调用 `vote_for_player` 工具来投票。
 """
-    return prompt
+    sections = [
+        {"name": "rules", "text": f"你正在玩一场狼人杀游戏，现在是第 {game_state['day']} 天的投票阶段。"},
+        {"name": "persona", "text": role_play_section},
+        {"name": "identity", "text": f"你的身份是 **{role}**。"},
+        *_context_sections(game_state, player, decision=True),
+        {"name": "targets", "text": targets},
+    ]
+    return assemble_prompt(sections, 'vote')
+
+# --- 决策调用的结构化输出与容错解析 ---
+_TARGET_KEYS = ("player_id", "target_id", "target", "player", "id")
+
+def _decision_schema(tool_name: str, valid_targets: list) -> dict:
+    """决策回复的JSON Schema：工具名固定，目标编号限定为有效玩家ID的枚举。"""
+    return {
+        "type": "object",
+        "properties": {
+            "tool_name": {"type": "string", "enum": [tool_name]},
+            "arguments": {
+                "type": "object",
+                "properties": {
+                    "player_id": {"type": "integer", "enum": list(valid_targets)},
+                    "reason": {"type": "string"}
+                },
+                "required": ["player_id", "reason"],
+                "additionalProperties": False
+            }
+        },
+        "required": ["tool_name", "arguments"],
+        "additionalProperties": False
+    }
+
+def _target_from_text(text: str, valid_targets: list) -> int | None:
+    """从自由文本中找出唯一被提及的有效玩家编号；提及多个时无法判断，返回None。"""
+    for pattern in (r'"?player_id"?\s*[:=]\s*"?(\d+)', r'(\d+)\s*号', r'(\d+)'):
+        mentioned = {int(m) for m in re.findall(pattern, text)} & set(valid_targets)
+        if len(mentioned) == 1:
+            return mentioned.pop()
+        if mentioned:
+            return None
+    return None
 
-def get_llm_vote(game_state: dict, player_id: int, max_retries: int = None) -> int:
+def _coerce_target(value, valid_targets: list) -> int | None:
+    """把 4、4.0、"4"、"4号" 等形式的目标转换为有效玩家ID。"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        return value if value in valid_targets else None
+    if isinstance(value, str):
+        return _target_from_text(value, valid_targets)
+    return None
+
+def _extract_decision_target(data: dict, valid_targets: list) -> int | None:
+    """
+    容错解析决策回复，在发起重试前尽量恢复目标编号。
+    依次尝试 arguments 中、顶层的常见目标字段，最后从无法解析为JSON的原文中查找。
+    """
+    arguments = data.get("arguments")
+    if isinstance(arguments, str):
+        arguments = _parse_json_reply(arguments)
+    for container in (arguments, data):
+        if not isinstance(container, dict):
+            continue
+        for key in _TARGET_KEYS:
+            if key in container:
+                target = _coerce_target(container[key], valid_targets)
+                if target is not None:
+                    return target
+    if data.get("raw_text"):
+        return _target_from_text(data["raw_text"], valid_targets)
+    return None
+
+def _is_clean_decision(data: dict, tool_name: str, valid_targets: list) -> bool:
+    """回复是否完全符合约定格式（无需容错解析）。"""
+    arguments = data.get("arguments")
+    return (data.get("tool_name") == tool_name and isinstance(arguments, dict)
+            and type(arguments.get("player_id")) is int and arguments["player_id"] in valid_targets)
+
+def _backoff(delay: float, cancel_token=None) -> bool:
+    """重试前的退避等待，可被取消打断；返回是否已被取消。"""
+    with tracing.span("llm.retry_backoff", cat="llm", delay=delay):
+        if cancel_token is None:
+            time.sleep(delay)
+            return False
+        return cancel_token.sleep(delay)
+
+def get_llm_vote(game_state: dict, player_id: int, max_retries: int = None, cancel_token=None) -> int:
+    """阶段结束导致 cancel_token 被取消时返回None，不再重试也不做随机兜底。"""
     if max_retries is None:
         max_retries = LLM_DEBUG_CONFIG.get("max_retries", 3)
         
-    alive_players = [p for p in game_state['players'] if p.get('is_alive')]
-    valid_targets = [p['id'] for p in alive_players if p['id'] != player_id]
+    valid_targets = vote_targets(game_state, player_id)
     if not valid_targets: 
         return None
     
     # 获取玩家角色信息
-    player = next((p for p in game_state['players'] if p['id'] == player_id), None)
+    player = get_player(game_state, player_id)
     player_role = player.get('role') if player else None
     
     prompt = construct_voting_prompt(game_state, player_id)
+    response_schema = _decision_schema("vote_for_player", valid_targets)
     
     base_delay = LLM_DEBUG_CONFIG.get("base_retry_delay", 1.0)
     enable_backoff = LLM_DEBUG_CONFIG.get("enable_retry_backoff", True)
     
     for attempt in range(max_retries):
-        data = generate_llm_response(prompt, call_type='vote', player_id=player_id, player_role=player_role)
+        data = generate_llm_response(prompt, call_type='vote', player_id=player_id, player_role=player_role, response_schema=response_schema, cancel_token=cancel_token)
         
+        if data.get("cancelled"):
+            logging.info(f"玩家{player_id}的投票决策已取消: {data['error']}")
+            return None
+        if data.get("circuit_open"):
+            fallback_vote = random.choice(valid_targets)
+            record_decision_outcome('vote', attempt + 1, 'fallback')
+            logging.warning(f"LLM供应商熔断中，玩家{player_id}直接随机投票给: {fallback_vote}")
+            return fallback_vote
         if "error" in data:
             logging.warning(f"玩家{player_id}投票尝试 {attempt+1}: API调用失败 - {data['error']}")
             if attempt < max_retries - 1 and enable_backoff:
                 delay = base_delay * (2 ** attempt)  # 指数退避
-                time.sleep(delay)
+                if _backoff(delay, cancel_token):
+                    logging.info(f"玩家{player_id}的投票决策在重试等待中被取消")
+                    return None
             continue
 
-        try:
-            if data.get("tool_name") == "vote_for_player":
-                vote_target = data.get("arguments", {}).get("player_id")
-                if vote_target in valid_targets:
-                    logging.info(f"玩家{player_id}通过LLM投票给: {vote_target}")
-                    return vote_target
-                else:
-                    logging.warning(f"玩家{player_id}投票尝试 {attempt+1}: 目标 {vote_target} 无效。")
-            else:
-                logging.warning(f"玩家{player_id}投票尝试 {attempt+1}: 返回的JSON未使用正确的工具。")
-        except Exception as e:
-            logging.warning(f"玩家{player_id}投票尝试 {attempt+1}: 解析或验证响应失败 - {e}。响应: {data}")
+        vote_target = _extract_decision_target(data, valid_targets)
+        if vote_target is not None:
+            clean = _is_clean_decision(data, "vote_for_player", valid_targets)
+            record_decision_outcome('vote', attempt + 1, 'valid' if clean else 'recovered')
+            if not clean:
+                logging.info(f"玩家{player_id}投票尝试 {attempt+1}: 回复格式不规范，已容错解析出目标。响应: {data}")
+            logging.info(f"玩家{player_id}通过LLM投票给: {vote_target}")
+            return vote_target
+        logging.warning(f"玩家{player_id}投票尝试 {attempt+1}: 无法从响应中解析出有效目标。响应: {data}")
 
     fallback_vote = random.choice(valid_targets)
+    record_decision_outcome('vote', max_retries, 'fallback')
     logging.error(f"玩家{player_id}的LLM投票在 {max_retries} 次尝试后全失败，随机投票给: {fallback_vote}")
     return fallback_vote
 
 def construct_werewolf_kill_prompt(game_state: dict, player_id: int) -> str:
-    player = next(p for p in game_state['players'] if p['id'] == player_id)
+    player = get_player(game_state, player_id)
     other_werewolves = [p for p in game_state['players'] if p['role'] == Role.WEREWOLF.value and p['id'] != player_id]
     
-    alive_players = [p for p in game_state['players'] if p.get('is_alive')]
-    valid_targets = [p for p in alive_players if p['role'] != Role.WEREWOLF.value]
-
-    game_history = _build_game_history_text(game_state)
-    
     tool_definition = """
 # 工具定义
 你必须使用以下JSON格式来做出你的决定。
@@ -474,77 +1164,86 @@ def construct_werewolf_kill_prompt(game_state: dict, player_id: int) -> str:
   - `reason` (字符串, 必需): 你选择淘汰这个玩家的简要理由。
 """
     
-    prompt = f"""你正在玩一场狼人杀游戏，现在是第 {game_state['day']} 天的夜晚，轮到狼人行动。
+    identity = f"""你正在玩一场狼人杀游戏，现在是第 {game_state['day']} 天的夜晚，轮到狼人行动。
 # 你的身份与同伴
 你是 {player['nickname']}({player_id}号)，你的身份是 **狼人**。
-你的同伴是: {[_get_player_nickname(game_state, p['id']) + '(' + str(p['id']) + '号)' for p in other_werewolves] or ['无']}
-
-# 完整的游戏历史记录
-{game_history}
-
+你的同伴是: {_roster_text(game_state, [p['id'] for p in other_werewolves]) if other_werewolves else ['无']}
+"""
+    targets = f"""
 # 淘汰目标
 你的任务是淘汰一名好人（村民或预言家）。从以下目标中选择一人进行淘汰：
-{[_get_player_nickname(game_state, p['id']) + '(' + str(p['id']) + '号)' for p in valid_targets]}
+{_roster_text(game_state, kill_targets(game_state))}
 
 {tool_definition}
 请根据你的分析，调用 `kill_player` 工具来淘汰一名玩家。优先淘汰暴露身份的预言家或看起来最聪明的玩家。
 """
-    return prompt
+    sections = [
+        {"name": "identity", "text": identity},
+        *_context_sections(game_state, player, decision=True),
+        {"name": "targets", "text": targets},
+    ]
+    return assemble_prompt(sections, 'kill')
 
-def get_llm_werewolf_kill(game_state: dict, player_id: int, max_retries: int = None) -> int:
+def get_llm_werewolf_kill(game_state: dict, player_id: int, max_retries: int = None, cancel_token=None) -> int:
+    """阶段结束导致 cancel_token 被取消时返回None，不再重试也不做随机兜底。"""
     if max_retries is None:
         max_retries = LLM_DEBUG_CONFIG.get("max_retries", 3)
         
-    alive_players = [p for p in game_state['players'] if p.get('is_alive')]
-    valid_targets = [p['id'] for p in alive_players if p['role'] != Role.WEREWOLF.value]
+    valid_targets = kill_targets(game_state)
     if not valid_targets:
         logging.warning(f"狼人 {player_id} 找不到任何可淘汰的目标。")
         return None
 
     # 获取玩家角色信息
-    player = next((p for p in game_state['players'] if p['id'] == player_id), None)
+    player = get_player(game_state, player_id)
     player_role = player.get('role') if player else None
 
     prompt = construct_werewolf_kill_prompt(game_state, player_id)
+    response_schema = _decision_schema("kill_player", valid_targets)
     
     base_delay = LLM_DEBUG_CONFIG.get("base_retry_delay", 1.0)
     enable_backoff = LLM_DEBUG_CONFIG.get("enable_retry_backoff", True)
     
     for attempt in range(max_retries):
-        data = generate_llm_response(prompt, call_type='kill', player_id=player_id, player_role=player_role)
+        data = generate_llm_response(prompt, call_type='kill', player_id=player_id, player_role=player_role, response_schema=response_schema, cancel_token=cancel_token)
         
+        if data.get("cancelled"):
+            logging.info(f"狼人{player_id}的淘汰决策已取消: {data['error']}")
+            return None
+        if data.get("circuit_open"):
+            fallback_kill = random.choice(valid_targets)
+            record_decision_outcome('kill', attempt + 1, 'fallback')
+            logging.warning(f"LLM供应商熔断中，狼人{player_id}直接随机选择: {fallback_kill}")
+            return fallback_kill
         if "error" in data:
             logging.warning(f"狼人{player_id}淘汰尝试 {attempt+1}: API调用失败 - {data['error']}")
             if attempt < max_retries - 1 and enable_backoff:
                 delay = base_delay * (2 ** attempt)
-                time.sleep(delay)
+                if _backoff(delay, cancel_token):
+                    logging.info(f"狼人{player_id}的淘汰决策在重试等待中被取消")
+                    return None
             continue
 
-        try:
-            if data.get("tool_name") == "kill_player":
-                target_id = data.get("arguments", {}).get("player_id")
-                if target_id in valid_targets:
-                    logging.info(f"狼人{player_id}通过LLM选择淘汰: {target_id}")
-                    return target_id
-                else:
-                    logging.warning(f"狼人{player_id}淘汰尝试 {attempt+1}: 目标 {target_id} 无效。有效目标: {valid_targets}")
-            else:
-                logging.warning(f"狼人{player_id}淘汰尝试 {attempt+1}: 返回的JSON未使用正确的工具。")
-        except Exception as e:
-            logging.warning(f"狼人{player_id}淘汰尝试 {attempt+1}: 解析或验证响应失败 - {e}。响应: {data}")
+        target_id = _extract_decision_target(data, valid_targets)
+        if target_id is not None:
+            clean = _is_clean_decision(data, "kill_player", valid_targets)
+            record_decision_outcome('kill', attempt + 1, 'valid' if clean else 'recovered')
+            if not clean:
+                logging.info(f"狼人{player_id}淘汰尝试 {attempt+1}: 回复格式不规范，已容错解析出目标。响应: {data}")
+            logging.info(f"狼人{player_id}通过LLM选择淘汰: {target_id}")
+            return target_id
+        logging.warning(f"狼人{player_id}淘汰尝试 {attempt+1}: 无法从响应中解析出有效目标。有效目标: {valid_targets}。响应: {data}")
 
     fallback_kill = random.choice(valid_targets)
+    record_decision_outcome('kill', max_retries, 'fallback')
     logging.error(f"狼人{player_id}的LLM淘汰在 {max_retries} 次尝试后全失败，随机选择: {fallback_kill}")
     return fallback_kill
 
-def get_llm_seer_check(game_state: dict, player_id: int, max_retries: int = None) -> int:
+def get_llm_seer_check(game_state: dict, player_id: int, max_retries: int = None, cancel_token=None) -> int:
     if max_retries is None:
         max_retries = LLM_DEBUG_CONFIG.get("max_retries", 3)
         
-    alive_players = [p for p in game_state['players'] if p.get('is_alive')]
-    seer = next((p for p in game_state['players'] if p['id'] == player_id), None)
-    checked_ids = {check['checked_id'] for check in seer.get('seer_knowledge', [])}
-    valid_targets = [p['id'] for p in alive_players if p['id'] != player_id and p['id'] not in checked_ids]
+    valid_targets = seer_targets(game_state, player_id)
     if not valid_targets:
         return None
     return random.choice(valid_targets)
\ No newline at end of file
@@ -0,0 +1,511 @@
+# load_test.py
+"""
+端到端压测：在本地启动LLM与TTS桩服务和一个真实的 app.py 服务器进程，
+用脚本化的Socket.IO客户端同时驱动N桌游戏（每个连接一桌，客户端扮演人类玩家），
+统计各阶段耗时分位数、服务器调度延迟、线程数、内存与每桌CPU开销。
+
+用法:
+    python load_test.py --tables 4 --duration 300
+    python load_test.py --tables 8 --llm-latency 1.5 --llm-jitter 1.0 --tts --output load.json
+
+服务器进程的工作目录是临时目录，游戏存档与调用日志不会写入仓库。
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import deque, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HUMAN_SPEECHES = [
+    "我是村民，目前没有太多信息，先听听后面的发言。",
+    "我觉得{target}号的发言有点问题，今天可以重点关注一下。",
+    "我相信{target}号，他的逻辑比较清楚。",
+]
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    return {"count": len(ordered), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(ordered[-1], 3)}
+
+# --- LLM / TTS 桩服务 ---
+class StubBackend:
+    """
+    在一个本地HTTP服务中同时模拟OpenAI兼容的聊天接口、Ollama生成接口和本地GSV的TTS接口。
+    决策请求从结构化输出的 schema 中随机选一个合法目标，延迟按配置的均值与抖动随机。
+    """
+
+    def __init__(self, llm_latency: float, llm_jitter: float, tts_latency: float):
+        self.llm_latency = llm_latency
+        self.llm_jitter = llm_jitter
+        self.tts_latency = tts_latency
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._wav = self._silent_wav(0.5)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="load-test-stubs", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    @staticmethod
+    def _silent_wav(seconds: float) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(b'\0\0' * int(16000 * seconds))
+        return buffer.getvalue()
+
+    def _sleep_llm(self):
+        time.sleep(max(0.0, self.llm_latency + random.uniform(-self.llm_jitter, self.llm_jitter)))
+
+    @staticmethod
+    def _decision(schema) -> dict | None:
+        """从决策 schema 的枚举中选出工具名和目标；不是决策请求时返回None。"""
+        if not isinstance(schema, dict) or 'properties' not in schema:
+            return None
+        properties = schema['properties']
+        targets = properties['arguments']['properties']['player_id']['enum']
+        return {"tool_name": properties['tool_name']['enum'][0],
+                "arguments": {"player_id": random.choice(targets), "reason": "压测桩的随机决策"}}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path.endswith('/api/generate'):
+                    if 'prompt' not in payload:
+                        stub._count('ollama_preload')
+                        return self._reply(b'{}', 'application/json')
+                    stub._sleep_llm()
+                    decision = stub._decision(payload.get('format'))
+                    stub._count('llm_decision' if decision else 'llm_text')
+                    text = json.dumps(decision, ensure_ascii=False) if decision else "我先听听大家的发言，暂时没有明确的怀疑对象。"
+                    body = {"response": text, "prompt_eval_count": len(payload['prompt']) // 2, "eval_count": len(text)}
+                    return self._reply(json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+                stub._sleep_llm()
+                schema = (payload.get('response_format') or {}).get('json_schema', {}).get('schema')
+                tools = payload.get('tools')
+                if tools:
+                    parameters = tools[0]['function']['parameters']
+                    choice = random.choice(parameters['properties']['player_id']['enum'])
+                    arguments = json.dumps({"player_id": choice, "reason": "压测桩的随机决策"}, ensure_ascii=False)
+                    message = {"role": "assistant", "content": None, "tool_calls": [
+                        {"type": "function", "function": {"name": tools[0]['function']['name'], "arguments": arguments}}]}
+                    stub._count('llm_decision')
+                else:
+                    decision = stub._decision(schema)
+                    content = json.dumps(decision, ensure_ascii=False) if decision else "我先听听大家的发言，暂时没有明确的怀疑对象。"
+                    message = {"role": "assistant", "content": content}
+                    stub._count('llm_decision' if decision else 'llm_text')
+                prompt_chars = sum(len(m.get('content') or '') for m in payload.get('messages', []))
+                body = {"choices": [{"message": message}],
+                        "usage": {"prompt_tokens": prompt_chars // 2, "completion_tokens": 40}}
+                self._reply(json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+            def do_GET(self):
+                if not self.path.startswith('/tts'):
+                    self.send_error(404)
+                    return
+                time.sleep(stub.tts_latency)
+                stub._count('tts')
+                self._reply(stub._wav, 'audio/wav')
+
+        return Handler
+
+# --- 服务器进程 ---
+def _memory_probe():
+    """
+    返回 (来源, 读取当前内存MB的函数)。依次尝试 psutil（跨平台，含Windows）、/proc（Linux）、
+    resource 的峰值常驻内存（其他类Unix），都不可用时用 tracemalloc 统计Python对象占用的内存。
+    """
+    try:
+        import psutil
+        process = psutil.Process()
+        return "psutil", lambda: process.memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    if os.path.exists('/proc/self/statm'):
+        page_size = os.sysconf('SC_PAGE_SIZE')
+
+        def statm():
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * page_size / 2 ** 20
+        return "proc", statm
+    try:
+        import resource
+        # ru_maxrss 在 macOS 上以字节为单位，其他系统以KB为单位
+        unit = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+        return "resource_peak", lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+    except ImportError:
+        pass
+    import tracemalloc
+    tracemalloc.start()
+    return "tracemalloc", lambda: tracemalloc.get_traced_memory()[0] / 2 ** 20
+
+def serve(args):
+    """在子进程中运行真实的 app.py：把LLM与TTS指向桩服务，并挂载压测指标接口。"""
+    import config
+    config.LLM_ROUTER_CONFIG['enabled'] = False
+    config.LLM_PROVIDERS['default'] = 'openai_compatible'
+    config.LLM_PROVIDERS['openai_compatible'].update(api_url=f"{args.stub_url}/v1/chat/completions", api_key="load-test")
+    config.TTS_CONFIG['default_provider'] = 'local_gsv'
+    config.TTS_CONFIG['providers']['local_gsv']['api_url'] = f"{args.stub_url}/tts"
+    config.GAME_CONFIG['computer_speech_delay'] = tuple(args.speech_delay)
+    config.GAME_CONFIG['discussion_time'] = args.discussion_time
+    # 桩服务没有配额；默认关闭限流，指定 --llm-rpm 时按该额度限流，观察多桌争用下的优先级排队
+    config.LLM_RATE_LIMIT_CONFIG['enabled'] = args.llm_rpm > 0
+    if args.llm_rpm > 0:
+        config.LLM_RATE_LIMIT_CONFIG['backends']['openai_compatible'] = {"requests_per_minute": args.llm_rpm}
+
+    import app as server
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    # 线程模式下没有单一的事件循环，用固定间隔睡眠的超时量衡量GIL与线程调度造成的延迟
+    lag_samples = deque(maxlen=10000)
+    interval = 0.05
+
+    def lag_probe():
+        while True:
+            start = time.perf_counter()
+            time.sleep(interval)
+            lag_samples.append((time.perf_counter() - start - interval) * 1000)
+
+    threading.Thread(target=lag_probe, name="lag-probe", daemon=True).start()
+    memory_source, read_memory_mb = _memory_probe()
+
+    @server.app.route('/loadtest/metrics')
+    def loadtest_metrics():
+        samples = [lag_samples.popleft() for _ in range(len(lag_samples))]
+        times = os.times()
+        return server.jsonify({
+            "games": len(server.games),
+            "threads": threading.active_count(),
+            "rss_mb": round(read_memory_mb(), 1),
+            "memory_source": memory_source,
+            "cpu_seconds": round(times.user + times.system, 3),
+            "lag_ms": samples,
+        })
+
+    server.socketio.run(server.app, host='127.0.0.1', port=args.port, allow_unsafe_werkzeug=True, use_reloader=False)
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _start_server(args, stub_url: str, workdir: str):
+    port = _free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port), "--stub-url", stub_url,
+               "--speech-delay", *map(str, args.speech_delay), "--discussion-time", str(args.discussion_time),
+               "--llm-rpm", str(args.llm_rpm)]
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "server.log"), 'w'))
+    base_url = f"http://127.0.0.1:{port}"
+    import requests
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务器进程启动失败，详见 {workdir}/server.log")
+        try:
+            requests.get(f"{base_url}/loadtest/metrics", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("等待服务器启动超时")
+
+# --- 脚本化客户端 ---
+class TableClient:
+    """一个Socket.IO连接驱动一桌游戏：对服务器的每个请求事件自动作答，一局结束后接着开下一局。"""
+
+    def __init__(self, index: int, base_url: str, args, stop_event: threading.Event):
+        import socketio
+        self.index = index
+        self.base_url = base_url
+        self.args = args
+        self.stop_event = stop_event
+        self.sio = socketio.Client(reconnection=False)
+        self.rng = random.Random(index)
+        self.human_id = 7
+        self.alive = []
+        self.phase = None
+        self.phase_started = None
+        self.last_event = time.monotonic()
+        self.last_speech = None
+        self.phase_durations = defaultdict(list)
+        self.speech_gaps = []
+        self.games_finished = 0
+        self.games_stalled = 0
+        self.errors = []
+        self._register()
+
+    def _register(self):
+        on = self.sio.on
+        on('game_state', self._on_game_state)
+        on('phase_update', self._on_phase_update)
+        on('new_speech', self._on_new_speech)
+        on('request_speech', lambda *_: self._later(self._speak))
+        on('start_voting', lambda *_: self._later(self._vote))
+        on('start_night_werewolf', lambda *_: self._later(self._night_kill))
+        on('request_seer_action', lambda data: self._later(self._seer_check, data))
+        on('start_discussion', lambda *_: self._later(self._discuss))
+        on('game_end', self._on_game_end)
+        on('error_message', lambda data: self.errors.append(data.get('message')))
+
+    def _later(self, fn, *args):
+        """模拟人类玩家的思考时间后再作答。"""
+        self.last_event = time.monotonic()
+        delay = self.rng.uniform(*self.args.think_time)
+        threading.Timer(delay, self._safe, [fn, *args]).start()
+
+    def _safe(self, fn, *args):
+        try:
+            if self.sio.connected:
+                fn(*args)
+        except Exception as e:
+            self.errors.append(str(e))
+
+    def _target(self) -> int | None:
+        candidates = [pid for pid in self.alive if pid != self.human_id]
+        return self.rng.choice(candidates) if candidates else None
+
+    def _on_game_state(self, state):
+        self.last_event = time.monotonic()
+        self.human_id = state.get('humanId', self.human_id)
+        self.alive = [p['id'] for p in state.get('players', []) if p.get('isAlive')]
+
+    def _on_phase_update(self, text):
+        now = time.monotonic()
+        self.last_event = now
+        # "第2天 白天 - 自由讨论 (60秒)" -> "白天 - 自由讨论"
+        phase = re.sub(r'\s*\(.*?\)$', '', re.sub(r'^第\d+天\s*', '', text))
+        if self.phase is not None and phase != self.phase:
+            self.phase_durations[self.phase].append(now - self.phase_started)
+        if phase != self.phase:
+            self.phase, self.phase_started = phase, now
+            self.last_speech = None
+
+    def _on_new_speech(self, data):
+        now = time.monotonic()
+        self.last_event = now
+        if data.get('playerId') != self.human_id and self.last_speech is not None and self.phase and '按序发言' in self.phase:
+            self.speech_gaps.append(now - self.last_speech)
+        self.last_speech = now
+
+    def _speak(self):
+        target = self._target() or 1
+        self.sio.emit('send_speech', {'text': self.rng.choice(HUMAN_SPEECHES).format(target=target)})
+
+    def _vote(self):
+        target = self._target()
+        if target:
+            self.sio.emit('send_vote', {'target': target})
+
+    def _night_kill(self):
+        target = self._target()
+        if target:
+            self.sio.emit('send_night_action', {'target': target})
+
+    def _seer_check(self, data):
+        targets = data.get('targets') or []
+        if targets:
+            self.sio.emit('send_seer_action', {'target': self.rng.choice(targets)})
+
+    def _discuss(self):
+        if self.args.skip_discussion:
+            self.sio.emit('skip_discussion')
+        else:
+            self.sio.emit('send_discussion_speech', {'text': "我补充一点，大家注意一下投票的一致性。"})
+
+    def _start_game(self):
+        self.phase = None
+        self.last_event = time.monotonic()
+        self.sio.emit('start_game', {'voice_enabled': self.args.tts, 'audio_formats': ['wav']})
+
+    def _on_game_end(self, data):
+        self.last_event = time.monotonic()
+        if self.phase is not None:
+            self.phase_durations[self.phase].append(self.last_event - self.phase_started)
+            self.phase = None
+        self.games_finished += 1
+        if not self.stop_event.is_set() and (not self.args.games_per_table or self.games_finished < self.args.games_per_table):
+            threading.Timer(1.0, self._safe, [self._start_game]).start()
+
+    def run(self):
+        self.sio.connect(self.base_url, transports=['polling'])
+        self._start_game()
+        while not self.stop_event.is_set():
+            if self.args.games_per_table and self.games_finished >= self.args.games_per_table:
+                break
+            if time.monotonic() - self.last_event > self.args.stall_timeout:
+                self.games_stalled += 1
+                self.errors.append(f"超过 {self.args.stall_timeout} 秒没有收到事件，重新开局")
+                self._start_game()
+            self.stop_event.wait(1.0)
+        self.sio.disconnect()
+
+def run_load_test(args) -> dict:
+    stub = StubBackend(args.llm_latency, args.llm_jitter, args.tts_latency)
+    stub.start()
+    workdir = tempfile.mkdtemp(prefix="werewolf-load-")
+    process, base_url = _start_server(args, stub.url, workdir)
+    import requests
+    samples = []
+
+    def poll_metrics():
+        sample = requests.get(f"{base_url}/loadtest/metrics", timeout=5).json()
+        sample['t'] = time.monotonic()
+        samples.append(sample)
+        return sample
+
+    stop_event = threading.Event()
+    clients, threads = [], []
+    try:
+        baseline = poll_metrics()
+        print(f"服务器已启动 ({base_url})，空载 {baseline['threads']} 线程 / {baseline['rss_mb']}MB；开始驱动 {args.tables} 桌...")
+        for index in range(args.tables):
+            client = TableClient(index, base_url, args, stop_event)
+            thread = threading.Thread(target=client.run, name=f"table-{index}", daemon=True)
+            clients.append(client)
+            threads.append(thread)
+            thread.start()
+            time.sleep(args.ramp / max(1, args.tables))
+
+        started = time.monotonic()
+        while time.monotonic() - started < args.duration:
+            if args.games_per_table and all(c.games_finished >= args.games_per_table for c in clients):
+                break
+            sample = poll_metrics()
+            print(f"\r[{time.monotonic() - started:6.0f}s] 对局 {sample['games']}  线程 {sample['threads']}  "
+                  f"内存 {sample['rss_mb']}MB  完成 {sum(c.games_finished for c in clients)} 局", end="", flush=True)
+            time.sleep(args.poll_interval)
+        print()
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=10)
+        final = poll_metrics()
+    finally:
+        stop_event.set()
+        process.terminate()
+        process.wait(timeout=10)
+        stub.stop()
+
+    wall = final['t'] - baseline['t']
+    cpu = final['cpu_seconds'] - baseline['cpu_seconds']
+    phase_durations = defaultdict(list)
+    for client in clients:
+        for phase, durations in client.phase_durations.items():
+            phase_durations[phase].extend(durations)
+    return {
+        "settings": {k: v for k, v in vars(args).items() if k not in ('serve', 'port', 'stub_url', 'output')},
+        "games_finished": sum(c.games_finished for c in clients),
+        "games_stalled": sum(c.games_stalled for c in clients),
+        "phase_seconds": {phase: _percentiles(values) for phase, values in sorted(phase_durations.items())},
+        "ai_speech_gap_seconds": _percentiles([gap for c in clients for gap in c.speech_gaps]),
+        "scheduler_lag_ms": _percentiles([lag for s in samples for lag in s['lag_ms']]),
+        "threads": {"idle": baseline['threads'], "peak": max(s['threads'] for s in samples),
+                    "peak_per_table": round((max(s['threads'] for s in samples) - baseline['threads']) / args.tables, 1)},
+        "memory_mb": {"idle": baseline['rss_mb'], "peak": max(s['rss_mb'] for s in samples),
+                      "peak_per_table": round((max(s['rss_mb'] for s in samples) - baseline['rss_mb']) / args.tables, 2),
+                      "source": baseline['memory_source']},
+        "cpu": {"seconds": round(cpu, 2), "percent": round(cpu / wall * 100, 1) if wall else None,
+                "seconds_per_table_minute": round(cpu / args.tables / (wall / 60), 3) if wall else None},
+        "stub_requests": dict(stub.counts),
+        "client_errors": [e for c in clients for e in c.errors][:20],
+        "server_log": os.path.join(workdir, "server.log"),
+    }
+
+def _print_report(report: dict):
+    print("\n=== 压测结果 ===")
+    print(f"完成 {report['games_finished']} 局，卡住 {report['games_stalled']} 次")
+    print("各阶段耗时(秒):")
+    for phase, stats in report['phase_seconds'].items():
+        print(f"  {phase:<24} n={stats['count']:<4} p50={stats.get('p50')}  p90={stats.get('p90')}  p99={stats.get('p99')}  max={stats.get('max')}")
+    print(f"AI按序发言间隔(秒): {report['ai_speech_gap_seconds']}")
+    print(f"调度延迟(毫秒): {report['scheduler_lag_ms']}")
+    print(f"线程: {report['threads']}")
+    print(f"内存(MB): {report['memory_mb']}")
+    print(f"CPU: {report['cpu']}")
+    print(f"桩服务请求数: {report['stub_requests']}")
+    if report['client_errors']:
+        print(f"客户端错误(前20条): {report['client_errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="狼人杀服务器的多桌端到端压测")
+    parser.add_argument("--tables", type=int, default=4, help="同时进行的桌数")
+    parser.add_argument("--duration", type=float, default=300, help="压测时长（秒）")
+    parser.add_argument("--games-per-table", type=int, default=0, help="每桌打满多少局后停止，0表示不限")
+    parser.add_argument("--ramp", type=float, default=5.0, help="在多少秒内逐个接入所有桌")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="LLM桩的平均延迟（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="LLM桩延迟的随机抖动（秒）")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="对LLM桩启用每分钟请求数限流，0表示不限流")
+    parser.add_argument("--tts", action="store_true", help="启用语音模式，TTS请求由本地GSV桩应答")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="TTS桩每块音频的延迟（秒）")
+    parser.add_argument("--speech-delay", type=float, nargs=2, default=(0.5, 1.0), help="覆盖 computer_speech_delay")
+    parser.add_argument("--discussion-time", type=int, default=15, help="覆盖自由讨论时长（秒）")
+    parser.add_argument("--skip-discussion", action="store_true", help="客户端收到自由讨论后立即跳过")
+    parser.add_argument("--think-time", type=float, nargs=2, default=(0.5, 2.0), help="模拟人类玩家的思考时间区间（秒）")
+    parser.add_argument("--stall-timeout", type=float, default=120, help="多久没有收到事件视为卡住")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="采集服务器指标的间隔（秒）")
+    parser.add_argument("--output", help="把结果另存为JSON")
+    # 以下参数仅供内部启动服务器子进程使用
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--stub-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    report = run_load_test(args)
+    _print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# player_memory.py
+
+import re
+import threading
+from config import PLAYER_MEMORY_CONFIG
+from game_models import Role
+
+# 每位AI玩家的结构化记忆以普通字典保存在 game_state['memories'] 中，随游戏状态一起存盘。
+# 每个事件发生时增量更新，生成prompt时直接渲染，不需要重新阅读整局记录。
+_lock = threading.Lock()
+
+_ROLE_CLAIM_RE = re.compile(r'我(?:才|就)?是(?:真的?)?(预言家|村民|狼人)')
+_CHECK_CLAIM_RE = re.compile(r'(\d+)\s*号[^。！？!?，,]{0,6}?(金水|好人|查杀|狼人|是狼)')
+_ACCUSE_RE = re.compile(r'(?:怀疑|可疑|投|踩|出|票)[^\d。！？!?]{0,4}(\d+)\s*号|(\d+)\s*号[^。！？!?，,]{0,8}?(?:可疑|像狼|是狼|有问题|在说谎)')
+_SUPPORT_RE = re.compile(r'(?:相信|信任|支持|保|站边)[^\d。！？!?]{0,4}(\d+)\s*号')
+_TEAMMATE = "狼人(同伴)"
+
+def _new_memory(game_state: dict, player: dict) -> dict:
+    known_roles = {}
+    if player['role'] == Role.WEREWOLF.value:
+        for other in game_state['players']:
+            if other['role'] == Role.WEREWOLF.value and other['id'] != player['id']:
+                known_roles[str(other['id'])] = _TEAMMATE
+    return {
+        "player_id": player['id'],
+        "role": player['role'],
+        "known_roles": known_roles,   # 私有情报：查验结果、狼同伴
+        "suspicion": {},              # 玩家ID -> 怀疑度（狼人视角下为威胁度）
+        "claims": [],                 # 听到的身份声明与查验声明
+        "votes": {},                  # 天数 -> {投票者: 目标}
+        "eliminations": []            # 公开的出局信息
+    }
+
+def init_memories(game_state: dict):
+    """身份分配后为每位AI玩家建立记忆。"""
+    with _lock:
+        game_state['memories'] = {
+            str(p['id']): _new_memory(game_state, p)
+            for p in game_state['players'] if not p.get('is_human')
+        }
+
+def _memories(game_state: dict):
+    return game_state.get('memories', {}).values()
+
+def _bump(memory: dict, player_id: int, delta: float):
+    if player_id == memory['player_id']:
+        return
+    key = str(player_id)
+    memory['suspicion'][key] = round(memory['suspicion'].get(key, 0.0) + delta, 2)
+
+def _known_side(memory: dict, player_id: int) -> str | None:
+    """根据私有情报或公开身份判断玩家阵营：'狼人'、'好人' 或未知(None)。"""
+    known = memory['known_roles'].get(str(player_id))
+    if not known:
+        return None
+    return "狼人" if known.startswith(Role.WEREWOLF.value) else "好人"
+
+def _is_teammate(memory: dict, player_id: int) -> bool:
+    return memory['role'] == Role.WEREWOLF.value and (player_id == memory['player_id'] or memory['known_roles'].get(str(player_id)) == _TEAMMATE)
+
+def _add_claim(memory: dict, claim: dict):
+    memory['claims'].append(claim)
+    del memory['claims'][:-PLAYER_MEMORY_CONFIG.get('max_claims', 12)]
+
+def record_speech(game_state: dict, day: int, speaker_id: int, text: str):
+    """从一条发言中提取身份声明、查验声明和指认，更新每位AI玩家的记忆。"""
+    valid_ids = {p['id'] for p in game_state['players']}
+    role_claims = _ROLE_CLAIM_RE.findall(text)
+    check_claims = []
+    if (role_claims and role_claims[0] == Role.SEER.value) or '验' in text or '查' in text:
+        for target, verdict in _CHECK_CLAIM_RE.findall(text):
+            target = int(target)
+            if target in valid_ids and target != speaker_id:
+                check_claims.append((target, "好人" if verdict in ("金水", "好人") else "狼人"))
+    accused = {int(a or b) for a, b in _ACCUSE_RE.findall(text)} & valid_ids - {speaker_id}
+    supported = {int(s) for s in _SUPPORT_RE.findall(text)} & valid_ids - {speaker_id} - accused
+    for target, verdict in check_claims:
+        (accused if verdict == "狼人" else supported).add(target)
+
+    with _lock:
+        for memory in _memories(game_state):
+            if memory['player_id'] == speaker_id:
+                continue
+            if role_claims:
+                _add_claim(memory, {"day": day, "player_id": speaker_id, "claim": f"自称{role_claims[0]}"})
+                if role_claims[0] == Role.SEER.value and memory['role'] == Role.SEER.value:
+                    _bump(memory, speaker_id, 5.0)  # 真预言家眼中的悍跳者
+            for target, verdict in check_claims:
+                _add_claim(memory, {"day": day, "player_id": speaker_id, "claim": f"称查验{target}号为{verdict}"})
+                known_side = _known_side(memory, target)
+                if known_side and known_side != verdict:
+                    _bump(memory, speaker_id, 3.0)  # 与已知情报矛盾的查验声明
+            for target in accused:
+                if target == memory['player_id'] or _is_teammate(memory, target):
+                    _bump(memory, speaker_id, 1.0)
+                elif _known_side(memory, target) == "好人":
+                    _bump(memory, speaker_id, 0.5)
+                else:
+                    _bump(memory, target, 0.3)
+            for target in supported:
+                if _known_side(memory, target) == "狼人" and not _is_teammate(memory, target):
+                    _bump(memory, speaker_id, 1.0)  # 为已知狼人站边
+
+def record_votes(game_state: dict, day: int, ballots: dict):
+    """记录一轮投票的投票者与目标。"""
+    with _lock:
+        for memory in _memories(game_state):
+            memory['votes'][str(day)] = {str(voter): target for voter, target in ballots.items()}
+
+def record_elimination(game_state: dict, day: int, player_id: int, reason: str, role: str):
+    """记录公开的出局信息；被投出的玩家身份公布后，据此修正投过他的人的怀疑度。"""
+    with _lock:
+        for memory in _memories(game_state):
+            memory['eliminations'].append({"day": day, "player_id": player_id, "reason": reason, "role": role})
+            memory['known_roles'][str(player_id)] = memory['known_roles'].get(str(player_id), role)
+            memory['suspicion'].pop(str(player_id), None)
+            if reason != 'vote' or memory['role'] == Role.WEREWOLF.value:
+                continue
+            for voter, target in memory['votes'].get(str(day), {}).items():
+                if target == player_id:
+                    _bump(memory, int(voter), -0.5 if role == Role.WEREWOLF.value else 0.5)
+
+def record_seer_check(game_state: dict, seer_id: int, target_id: int, result: str):
+    """预言家的查验结果写入其私有情报。"""
+    with _lock:
+        memory = game_state.get('memories', {}).get(str(seer_id))
+        if not memory:
+            return
+        memory['known_roles'][str(target_id)] = result
+        _bump(memory, target_id, 10.0 if result == Role.WEREWOLF.value else -10.0)
+
+def render_memory(game_state: dict, player_id: int) -> str:
+    """把玩家的记忆渲染为紧凑的prompt片段；没有记忆时返回空字符串。"""
+    with _lock:
+        memory = game_state.get('memories', {}).get(str(player_id))
+        if not memory:
+            return ""
+        alive = {p['id'] for p in game_state['players'] if p.get('is_alive')}
+        lines = ["# 你的记忆（随游戏进程更新）"]
+
+        # 出局玩家的身份已在出局情况中列出，这里只保留存活玩家
+        suffix = "（你的查验）" if memory['role'] == Role.SEER.value else ""
+        private = [f"{pid}号: {role}{suffix}" for pid, role in memory['known_roles'].items() if int(pid) in alive]
+        if private:
+            lines.append(f"- 私有情报: {'；'.join(private)}")
+        if memory['eliminations']:
+            lines.append("- 出局情况: " + "；".join(
+                f"第{e['day']}天{e['player_id']}号{'被投票淘汰' if e['reason'] == 'vote' else '夜里被淘汰'}({e['role']})"
+                for e in memory['eliminations']))
+        if memory['claims']:
+            lines.append("- 听到的声明: " + "；".join(f"第{c['day']}天{c['player_id']}号{c['claim']}" for c in memory['claims']))
+        recent_days = sorted(memory['votes'], key=int)[-PLAYER_MEMORY_CONFIG.get('vote_days', 2):]
+        for day in recent_days:
+            ballots = ", ".join(f"{voter}→{target}" for voter, target in memory['votes'][day].items())
+            lines.append(f"- 第{day}天投票: {ballots}")
+        ranked = sorted(((float(score), int(pid)) for pid, score in memory['suspicion'].items()
+                         if int(pid) in alive and score > 0 and not _is_teammate(memory, int(pid))), reverse=True)
+        if ranked:
+            label = "对狼队威胁最大" if memory['role'] == Role.WEREWOLF.value else "你最怀疑"
+            top = ranked[:PLAYER_MEMORY_CONFIG.get('top_suspects', 5)]
+            lines.append(f"- {label}: " + ", ".join(f"{pid}号({score:g})" for score, pid in top))
+        return "\n".join(lines) if len(lines) > 1 else ""
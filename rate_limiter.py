@@ -0,0 +1,185 @@
+# rate_limiter.py
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from config import LLM_RATE_LIMIT_CONFIG
+from cancellation import CancelledError
+
+class RateLimitTimeout(Exception):
+    """排队等待额度超过该优先级允许的最长时间。"""
+
+class _Bucket:
+    """令牌桶：按 per_minute/60 每秒匀速补充，容量为 burst_seconds 秒的额度。"""
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还需等待多少秒才有 amount 的额度；超过容量的请求等到桶满即可。"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """用真实用量修正预估：多用的额度从桶里扣除（可以为负，之后的请求相应推迟），少用的退回。"""
+        self.level = min(self.capacity, self.level - delta)
+
+class RateLimiter:
+    """
+    单个LLM后端的限流器（请求数与token数两个令牌桶）。
+    等待额度的调用按优先级排队，只有队首能取得额度，因此关键路径的调用不会被低优先级的突发请求挤占；
+    后端返回429时暂停该后端直到 Retry-After 指定的时刻。
+    """
+
+    def __init__(self, name: str, requests_per_minute: float = None, tokens_per_minute: float = None, config: dict = None):
+        config = config if config is not None else LLM_RATE_LIMIT_CONFIG
+        burst_seconds = config.get('burst_seconds', 10)
+        self.name = name
+        self.priorities = config.get('priorities', {})
+        self._requests = _Bucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self.stats = {"granted": {}, "timeouts": {}, "wait_s": {}, "rate_limited": 0}
+
+    def _rank(self, priority: str) -> int:
+        return self.priorities.get(priority, {}).get('rank', len(self.priorities))
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        wait = self._blocked_until - now
+        if self._requests:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens:
+            wait = max(wait, self._tokens.wait_time(tokens, now))
+        return max(0.0, wait)
+
+    def acquire(self, tokens: float, priority: str, cancel_token=None):
+        """
+        按优先级排队取得一次请求和 tokens 个token的额度。
+        超过该优先级的 max_wait 抛出 RateLimitTimeout，令牌被取消时抛出 CancelledError。
+        """
+        max_wait = self.priorities.get(priority, {}).get('max_wait', 30)
+        start = time.monotonic()
+        deadline = start + max_wait
+        if cancel_token is not None and cancel_token.deadline is not None:
+            deadline = min(deadline, cancel_token.deadline)
+        ticket = (self._rank(priority), next(self._seq))
+        unregister = cancel_token.on_cancel(self._wake) if cancel_token is not None else (lambda: None)
+        try:
+            with self._cond:
+                heapq.heappush(self._queue, ticket)
+                try:
+                    while True:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            raise CancelledError(cancel_token.reason)
+                        now = time.monotonic()
+                        wait = self._wait_time(tokens, now) if self._queue[0] == ticket else None
+                        if wait == 0.0:
+                            if self._requests:
+                                self._requests.take(1)
+                            if self._tokens:
+                                self._tokens.take(tokens)
+                            self._count("granted", priority)
+                            self.stats["wait_s"][priority] = round(self.stats["wait_s"].get(priority, 0.0) + now - start, 3)
+                            return
+                        if now >= deadline or (wait is not None and now + wait > deadline):
+                            self._count("timeouts", priority)
+                            raise RateLimitTimeout(f"LLM后端 {self.name} 限流排队超过 {max_wait} 秒（{priority}）")
+                        self._cond.wait(deadline - now if wait is None else wait)
+                finally:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+        finally:
+            unregister()
+
+    def _count(self, key: str, priority: str):
+        self.stats[key][priority] = self.stats[key].get(priority, 0) + 1
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def record_usage(self, estimated_tokens: float, actual_tokens: float):
+        """请求完成后用供应商返回的真实用量修正token桶。"""
+        if self._tokens and actual_tokens:
+            with self._cond:
+                self._tokens.adjust(actual_tokens - estimated_tokens)
+
+    def pause(self, seconds: float):
+        """后端返回429：在 seconds 秒内暂停发放额度，排队中的调用在暂停结束后按优先级继续。"""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.stats["rate_limited"] += 1
+            self._cond.notify_all()
+        logging.warning(f"LLM后端 {self.name} 返回429，暂停 {seconds:.1f} 秒")
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "queued": len(self._queue),
+                "paused_for_s": round(max(0.0, self._blocked_until - now), 1),
+                "requests_available": round(self._requests.level, 1) if self._requests else None,
+                "tokens_available": round(self._tokens.level) if self._tokens else None,
+                **{key: dict(value) if isinstance(value, dict) else value for key, value in self.stats.items()},
+            }
+
+def parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After 头（秒数或HTTP日期），无法解析时返回None。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def call_priority(call_type: str, priority: str = None) -> str:
+    """调用的优先级：显式指定时直接使用，否则按调用类型归类。"""
+    if priority:
+        return priority
+    return LLM_RATE_LIMIT_CONFIG.get('call_type_priority', {}).get(call_type, 'background')
+
+# 进程内按后端名共享，同一后端上的多桌游戏共用额度
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name: str) -> RateLimiter | None:
+    """获取（必要时创建）指定后端的限流器；未启用或该后端未配置限额时返回None。"""
+    if not LLM_RATE_LIMIT_CONFIG.get('enabled', False):
+        return None
+    limits = LLM_RATE_LIMIT_CONFIG.get('backends', {}).get(name)
+    if not limits:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, limits.get('requests_per_minute'), limits.get('tokens_per_minute'))
+            _limiters[name] = limiter
+        return limiter
+
+def get_limiter_states() -> dict:
+    """所有限流器的当前状态。"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.snapshot() for limiter in limiters}
@@ -0,0 +1,104 @@
+# seating.py
+
+import colorsys
+from config import GAME_CONFIG, NICKNAMES, PERSONAS, EXTRA_PERSONAS
+
+# 按座位号生成对局配置。config.py 只为默认的8个座位写了昵称、人设和参考音色，
+# 人数更多时其余座位由这里按座位号确定性地补齐，同一座位每局得到相同的配置。
+
+# 前12个座位沿用原有配色，之后按黄金角在色环上取色，相邻座位颜色区分明显
+_BASE_COLORS = [
+    '#ffb3ba', '#bae1ff', '#baffc9', '#ffffba', '#ffdfba',
+    '#e0bbff', '#ffc9de', '#c9c9ff', '#f5c6a5', '#a5f5e0',
+    '#e6a5f5', '#f5e6a5',
+]
+_GOLDEN_ANGLE = 0.381966
+
+def is_large_table(players_count: int = None) -> bool:
+    """人数达到 large_table.threshold 时进入大桌模式。"""
+    if players_count is None:
+        players_count = GAME_CONFIG['players_count']
+    return players_count >= GAME_CONFIG.get('large_table', {}).get('threshold', 12)
+
+def human_seat(players_count: int = None) -> int:
+    """人类玩家的座位号，超出人数时坐最后一个座位。"""
+    if players_count is None:
+        players_count = GAME_CONFIG['players_count']
+    return min(GAME_CONFIG.get('human_player_id', 7), players_count)
+
+def role_counts(players_count: int = None) -> dict:
+    """
+    各身份数量。配置中的数量之和等于人数时直接使用，
+    否则按约四分之一狼人、一名预言家、其余村民生成。
+    """
+    if players_count is None:
+        players_count = GAME_CONFIG['players_count']
+    configured = {
+        'werewolves': GAME_CONFIG['werewolves_count'],
+        'seer': GAME_CONFIG['seer_count'],
+        'villagers': GAME_CONFIG['villagers_count'],
+    }
+    if sum(configured.values()) == players_count:
+        return configured
+    werewolves = max(1, round(players_count / 4))
+    seer = 1 if players_count - werewolves > 1 else 0
+    return {'werewolves': werewolves, 'seer': seer, 'villagers': players_count - werewolves - seer}
+
+def seat_color(player_id: int) -> str:
+    if player_id <= len(_BASE_COLORS):
+        return _BASE_COLORS[player_id - 1]
+    hue = (player_id * _GOLDEN_ANGLE) % 1.0
+    r, g, b = colorsys.hls_to_rgb(hue, 0.82, 0.7)
+    return f"#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}"
+
+def seat_nickname(player_id: int, is_human: bool = False) -> str:
+    if is_human:
+        return GAME_CONFIG.get('human_nickname', f"玩家{player_id}")
+    return NICKNAMES.get(player_id, f"玩家{player_id}")
+
+def seat_persona(player_id: int) -> str:
+    """未单独配置人设的座位（包括编号之间的空缺）按座位号依次使用 EXTRA_PERSONAS 中的人设。"""
+    if player_id in PERSONAS:
+        return PERSONAS[player_id]
+    if not EXTRA_PERSONAS:
+        return ""
+    unconfigured_before = player_id - 1 - sum(1 for pid in PERSONAS if pid < player_id)
+    return EXTRA_PERSONAS[unconfigured_before % len(EXTRA_PERSONAS)]
+
+def voice_seat(player_id: int, voiced_ids) -> int | None:
+    """
+    该座位使用哪个座位的参考音色：有自己的音色时用自己的，
+    否则按座位号轮流借用已配置音色的座位。
+    """
+    voiced = sorted(voiced_ids)
+    if not voiced:
+        return None
+    if player_id in voiced:
+        return player_id
+    return voiced[(player_id - 1) % len(voiced)]
+
+def decision_workers(task_count: int, players_count: int = None) -> int:
+    """投票、夜间行动等并行决策的线程数：普通桌最多 max_decision_workers 路，大桌随人数增长到 large_table.max_decision_workers。"""
+    if task_count <= 0:
+        return 1
+    if is_large_table(players_count):
+        limit = GAME_CONFIG.get('large_table', {}).get('max_decision_workers', 32)
+    else:
+        limit = GAME_CONFIG.get('max_decision_workers', 8)
+    return max(1, min(task_count, limit))
+
+def format_id_ranges(ids) -> str:
+    """把玩家编号压缩为区间表示，如 [1,2,3,5,7,8] -> '1-3、5、7-8号'。"""
+    ids = sorted(ids)
+    if not ids:
+        return "无"
+    parts = []
+    start = prev = ids[0]
+    for pid in ids[1:] + [None]:
+        if pid is not None and pid == prev + 1:
+            prev = pid
+            continue
+        parts.append(str(start) if start == prev else f"{start}-{prev}")
+        if pid is not None:
+            start = prev = pid
+    return "、".join(parts) + "号"
@@ -0,0 +1,33 @@
+# tests/conftest.py
+
+import os
+import sys
+
+import pytest
+
+# 测试直接导入仓库根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cwd(tmp_path, monkeypatch):
+    """在临时目录中运行，调用日志、存档等相对路径的输出不会写入仓库。"""
+    monkeypatch.chdir(tmp_path)
+
+
+class RecordingSocketIO:
+    """记录所有发送事件的Socket.IO替身。"""
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data=None, **kwargs):
+        self.events.append((event, data))
+
+    def named(self, event):
+        return [data for name, data in self.events if name == event]
+
+
+@pytest.fixture
+def socketio():
+    return RecordingSocketIO()
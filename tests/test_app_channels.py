@@ -0,0 +1,59 @@
+# tests/test_app_channels.py
+
+import pytest
+
+app_module = pytest.importorskip("app")
+
+
+class _FakeGame:
+    """代替 WerewolfWebGame：开局时通过分配到的发送通道发出一条带游戏编号的事件。"""
+    created = []
+
+    def __init__(self, socketio, voice_enabled=False, audio_formats=None):
+        self.socketio = socketio
+        self.number = len(self.created) + 1
+        self.created.append(self)
+
+    def start_game(self):
+        self.socketio.emit('phase_update', f"game-{self.number}")
+
+    def get_human_player(self):
+        return None
+
+    def shutdown(self):
+        pass
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    _FakeGame.created = []
+    monkeypatch.setattr(app_module, 'WerewolfWebGame', _FakeGame)
+    first = app_module.socketio.test_client(app_module.app)
+    second = app_module.socketio.test_client(app_module.app)
+    yield first, second
+    for client in (first, second):
+        if client.is_connected():
+            client.disconnect()
+
+
+def _phase_updates(client):
+    return [event['args'][0] for event in client.get_received() if event['name'] == 'phase_update']
+
+
+def test_each_client_only_receives_its_own_game_events(clients):
+    first, second = clients
+    first.emit('start_game', {'voice_enabled': False})
+    second.emit('start_game', {'voice_enabled': False})
+
+    assert _phase_updates(first) == ["game-1"]
+    assert _phase_updates(second) == ["game-2"]
+    assert len(app_module.games) == 2
+
+
+def test_disconnect_disposes_only_that_clients_game(clients):
+    first, second = clients
+    first.emit('start_game', {'voice_enabled': False})
+    second.emit('start_game', {'voice_enabled': False})
+    first.disconnect()
+
+    assert list(app_module.games.values()) == [_FakeGame.created[1]]
@@ -0,0 +1,76 @@
+# tests/test_cancellation.py
+
+import threading
+import time
+
+import pytest
+
+from cancellation import CancellationToken, CancelledError
+
+
+def test_cancel_runs_callbacks_once_and_keeps_first_reason():
+    token = CancellationToken()
+    calls = []
+    token.on_cancel(lambda: calls.append(1))
+    token.cancel("阶段结束")
+    token.cancel("再次取消")
+    assert calls == [1]
+    assert token.reason == "阶段结束"
+    with pytest.raises(CancelledError, match="阶段结束"):
+        token.raise_if_cancelled()
+
+
+def test_callback_registered_after_cancel_runs_immediately():
+    token = CancellationToken()
+    token.cancel()
+    calls = []
+    token.on_cancel(lambda: calls.append(1))
+    assert calls == [1]
+
+
+def test_unregistered_callback_is_not_run():
+    token = CancellationToken()
+    calls = []
+    unregister = token.on_cancel(lambda: calls.append(1))
+    unregister()
+    token.cancel()
+    assert calls == []
+
+
+def test_failing_callback_does_not_stop_the_others():
+    token = CancellationToken()
+    calls = []
+    token.on_cancel(lambda: 1 / 0)
+    token.on_cancel(lambda: calls.append(1))
+    token.cancel()
+    assert calls == [1]
+
+
+def test_child_follows_parent_and_detaches_when_cancelled_first():
+    parent = CancellationToken()
+    first, second = parent.child(), parent.child()
+    first.cancel("子令牌结束")
+    assert not parent.cancelled
+    assert len(parent._callbacks) == 1
+
+    parent.cancel("游戏结束")
+    assert second.cancelled and second.reason == "游戏结束"
+    assert first.reason == "子令牌结束"
+
+
+def test_deadline_expires_and_is_inherited():
+    parent = CancellationToken(deadline=time.monotonic() + 0.05)
+    child = parent.child(deadline=time.monotonic() + 60)
+    assert child.deadline == parent.deadline
+    assert child.timeout(10) <= 0.05
+    time.sleep(0.06)
+    assert child.cancelled
+    assert child.remaining() == 0.0
+
+
+def test_sleep_is_interrupted_by_cancel():
+    token = CancellationToken()
+    threading.Timer(0.05, token.cancel).start()
+    start = time.monotonic()
+    assert token.sleep(5)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,69 @@
+# tests/test_circuit_breaker.py
+
+import time
+
+from circuit_breaker import CircuitBreaker
+
+CONFIG = {"enabled": True, "failure_threshold": 2, "recovery_timeout": 0.01}
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.005)
+
+
+def test_opens_after_consecutive_failures_and_rejects():
+    breaker = CircuitBreaker("test", config={**CONFIG, "recovery_timeout": 60})
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()["rejected"] == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker("test", config=CONFIG)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_successful_probe_closes_and_later_failures_restart_probing():
+    probes = []
+    breaker = CircuitBreaker("test", probe=lambda: probes.append(1), config=CONFIG)
+    for _ in range(2):
+        breaker.record_failure()
+    _wait_for(lambda: breaker.state == CircuitBreaker.CLOSED and breaker._probe_thread is None)
+    assert breaker.consecutive_failures == 0
+
+    for _ in range(2):
+        breaker.record_failure()
+    _wait_for(lambda: breaker.state == CircuitBreaker.CLOSED and breaker._probe_thread is None)
+    assert len(probes) == 2
+
+
+def test_failed_probe_keeps_breaker_open():
+    attempts = []
+
+    def probe():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("down")
+
+    breaker = CircuitBreaker("test", probe=probe, config=CONFIG)
+    for _ in range(2):
+        breaker.record_failure()
+    _wait_for(lambda: breaker.state == CircuitBreaker.CLOSED)
+    assert len(attempts) == 3
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker("test", config={**CONFIG, "enabled": False})
+    for _ in range(5):
+        breaker.record_failure()
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,40 @@
+# tests/test_decision_parsing.py
+
+import pytest
+
+from llm_utils import _extract_decision_target, _is_clean_decision
+
+VALID = [2, 3, 5, 8]
+
+
+@pytest.mark.parametrize("data, expected", [
+    ({"tool_name": "vote_for_player", "arguments": {"player_id": 3, "reason": "可疑"}}, 3),
+    ({"arguments": {"player_id": "5号"}}, 5),
+    ({"arguments": {"target_id": 8.0}}, 8),
+    ({"arguments": '{"player_id": "2", "reason": "x"}'}, 2),
+    ({"player_id": 3}, 3),
+    ({"arguments": {"player_id": 4}, "target": 5}, 5),
+    ({"raw_text": "我决定投给 5 号，他昨天发言很奇怪"}, 5),
+    ({"raw_text": '{"player_id": 8, "reason": "截断'}, 8),
+])
+def test_recovers_target_from_near_misses(data, expected):
+    assert _extract_decision_target(data, VALID) == expected
+
+
+@pytest.mark.parametrize("data", [
+    {"arguments": {"player_id": 4}},
+    {"arguments": {"player_id": True}},
+    {"arguments": {"player_id": 2.5}},
+    {"raw_text": "3号和5号都很可疑"},
+    {"raw_text": "我弃票"},
+    {},
+])
+def test_returns_none_when_target_is_invalid_or_ambiguous(data):
+    assert _extract_decision_target(data, VALID) is None
+
+
+def test_clean_decision_requires_exact_format():
+    clean = {"tool_name": "vote_for_player", "arguments": {"player_id": 3, "reason": "可疑"}}
+    assert _is_clean_decision(clean, "vote_for_player", VALID)
+    assert not _is_clean_decision({**clean, "tool_name": "kill"}, "vote_for_player", VALID)
+    assert not _is_clean_decision({**clean, "arguments": {"player_id": "3"}}, "vote_for_player", VALID)
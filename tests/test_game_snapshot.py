@@ -0,0 +1,47 @@
+# tests/test_game_snapshot.py
+
+from game_models import Role
+from game_snapshot import GameSnapshot, kill_targets, seer_targets
+from player_memory import init_memories
+
+
+def _state(days=3):
+    players = [{"id": pid, "nickname": f"玩家{pid}", "is_alive": True, "is_human": pid == 3,
+                "role": Role.WEREWOLF.value if pid == 1 else Role.VILLAGER.value} for pid in range(1, 5)]
+    state = {"game_id": "test", "total_players": 4, "day": days, "phase": "night", "players": players,
+             "game_log": [{"day": day, "speeches": [{"player_id": 2, "text": f"第{day}天"}],
+                           "eliminated_vote": None, "eliminated_night": None} for day in range(1, days + 1)],
+             "day_summaries": {"1": "摘要"}, "extra": {"big": list(range(100))}}
+    init_memories(state)
+    return state
+
+
+def test_snapshot_keeps_only_decision_fields():
+    snapshot = GameSnapshot(_state(), memory_ids=[2])
+    assert 'extra' not in snapshot
+    assert set(snapshot['memories']) == {'2'}
+    assert snapshot['day_summaries']['1'] == "摘要"
+    assert kill_targets(snapshot) == [2, 3, 4]
+
+
+def test_past_days_are_shared_between_snapshots():
+    state, frozen_days = _state(), {}
+    first = GameSnapshot(state, memory_ids=[], frozen_days=frozen_days)
+    state['game_log'][-1]['speeches'].append({"player_id": 4, "text": "补充"})
+    second = GameSnapshot(state, memory_ids=[], frozen_days=frozen_days)
+
+    assert set(frozen_days) == {1, 2}
+    assert all(a is b for a, b in zip(first['game_log'][:2], second['game_log'][:2]))
+    assert len(first['game_log'][2]['speeches']) == 1
+    assert len(second['game_log'][2]['speeches']) == 2
+
+
+def test_snapshot_is_not_affected_by_later_mutation():
+    state = _state()
+    state['players'][1]['seer_knowledge'] = []
+    snapshot = GameSnapshot(state)
+    state['players'][3]['is_alive'] = False
+    state['memories']['2']['suspicion']['4'] = 1.0
+
+    assert 4 in seer_targets(snapshot, 2)
+    assert '4' not in snapshot['memories']['2']['suspicion']
@@ -0,0 +1,121 @@
+# tests/test_night_actions.py
+
+import pytest
+
+from game_manager import WerewolfWebGame
+from game_models import Role
+from player_memory import init_memories
+
+HUMAN_ID = 7
+WEREWOLVES = (1, 4)
+
+
+def _make_game(socketio, seer_id=HUMAN_ID):
+    """8人对局：1、4号狼人，seer_id 号预言家，人类坐7号。"""
+    game = WerewolfWebGame(socketio)
+    players = []
+    for player_id in range(1, 9):
+        if player_id in WEREWOLVES:
+            role = Role.WEREWOLF.value
+        elif player_id == seer_id:
+            role = Role.SEER.value
+        else:
+            role = Role.VILLAGER.value
+        player = {"id": player_id, "nickname": f"玩家{player_id}", "role": role,
+                  "is_alive": True, "is_human": player_id == HUMAN_ID}
+        if role == Role.SEER.value:
+            player['seer_knowledge'] = []
+        players.append(player)
+    game.game_state = {"game_id": "test", "total_players": 8, "day": 1, "phase": "waiting",
+                       "players": players, "game_log": []}
+    init_memories(game.game_state)
+    game.game_started = True
+    return game
+
+
+@pytest.fixture
+def day_starts(monkeypatch):
+    calls = []
+    monkeypatch.setattr(WerewolfWebGame, 'start_day_phase', lambda self: calls.append(self.game_state['day']))
+    return calls
+
+
+def test_human_pre_game_check_starts_the_day(socketio, day_starts):
+    game = _make_game(socketio)
+    game._pre_game_seer_turn()
+    assert socketio.named('request_seer_action')
+
+    game.handle_human_seer_action(4)
+
+    assert game.get_seer()['seer_knowledge'] == [{"day": 0, "checked_id": 4, "role": Role.WEREWOLF.value}]
+    assert socketio.named('seer_result') == [{"target_id": 4, "role": Role.WEREWOLF.value, "day": 0}]
+    assert day_starts == [1]
+
+
+def test_duplicate_pre_game_check_is_ignored(socketio, day_starts):
+    game = _make_game(socketio)
+    game._pre_game_seer_turn()
+    game.handle_human_seer_action(4)
+    game.handle_human_seer_action(2)
+
+    assert len(game.get_seer()['seer_knowledge']) == 1
+    assert day_starts == [1]
+
+
+def test_seer_action_outside_a_check_is_ignored(socketio, day_starts):
+    game = _make_game(socketio)
+    game.handle_human_seer_action(2)
+
+    assert game.get_seer()['seer_knowledge'] == []
+    assert day_starts == []
+
+
+def _open_night(game, pending, human_kinds):
+    game.night_active = True
+    game._night_actions = {}
+    game._night_pending = set(pending)
+    game._night_human_kinds = set(human_kinds)
+
+
+def test_human_seer_result_does_not_wait_for_the_kill(socketio, monkeypatch):
+    nights = []
+    monkeypatch.setattr(WerewolfWebGame, 'next_day', lambda self: nights.append(self.game_state['day']))
+    game = _make_game(socketio)
+    _open_night(game, {'seer', 'kill'}, {'seer'})
+
+    game.handle_human_seer_action(1)
+
+    assert socketio.named('seer_result') == [{"target_id": 1, "role": Role.WEREWOLF.value, "day": 1}]
+    assert game.get_player_by_id(1)['is_alive']
+    assert nights == []
+
+    game.submit_night_action('kill', 2)
+
+    assert not game.get_player_by_id(2)['is_alive']
+    assert len(game.get_seer()['seer_knowledge']) == 1
+    assert nights == [1]
+
+
+def test_seer_check_is_recorded_before_a_kill_that_arrives_first(socketio, monkeypatch):
+    monkeypatch.setattr(WerewolfWebGame, 'next_day', lambda self: None)
+    game = _make_game(socketio, seer_id=3)
+    _open_night(game, {'seer', 'kill'}, set())
+
+    game.submit_night_action('kill', 3)
+    assert game.get_player_by_id(3)['is_alive'], "查验未到齐前不应结算淘汰"
+
+    game.submit_night_action('seer', 4)
+
+    assert game.get_seer()['seer_knowledge'][0]['checked_id'] == 4
+    assert not game.get_player_by_id(3)['is_alive']
+
+
+def test_human_cannot_submit_an_ai_night_action(socketio, monkeypatch):
+    monkeypatch.setattr(WerewolfWebGame, 'next_day', lambda self: None)
+    game = _make_game(socketio, seer_id=3)
+    _open_night(game, {'seer', 'kill'}, set())
+
+    game.submit_night_action('kill', 2, from_human=True)
+
+    assert game._night_pending == {'seer', 'kill'}
+    assert game.get_player_by_id(2)['is_alive']
@@ -0,0 +1,85 @@
+# tests/test_rate_limiter.py
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from cancellation import CancellationToken, CancelledError
+from rate_limiter import RateLimiter, RateLimitTimeout, parse_retry_after
+
+PRIORITIES = {"high": {"rank": 0, "max_wait": 2}, "low": {"rank": 1, "max_wait": 2}, "short": {"rank": 2, "max_wait": 0.05}}
+
+
+def _limiter(requests_per_minute=600, tokens_per_minute=None, burst_seconds=0.1):
+    """默认每秒10次请求、桶容量1次：取走一次后下一次需要等待约0.1秒。"""
+    return RateLimiter("test", requests_per_minute, tokens_per_minute,
+                       config={"burst_seconds": burst_seconds, "priorities": PRIORITIES})
+
+
+def test_waits_for_refill_and_times_out_past_max_wait():
+    limiter = _limiter()
+    limiter.acquire(0, "high")
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(0, "short")
+    start = time.monotonic()
+    limiter.acquire(0, "high")
+    assert time.monotonic() - start >= 0.05
+    assert limiter.snapshot()["timeouts"] == {"short": 1}
+
+
+def test_higher_priority_is_granted_first():
+    limiter = _limiter()
+    limiter.acquire(0, "high")
+    order = []
+
+    def acquire(priority):
+        limiter.acquire(0, priority)
+        order.append(priority)
+
+    low = threading.Thread(target=acquire, args=("low",))
+    low.start()
+    time.sleep(0.02)
+    high = threading.Thread(target=acquire, args=("high",))
+    high.start()
+    low.join(3)
+    high.join(3)
+    assert order == ["high", "low"]
+
+
+def test_token_bucket_uses_estimate_and_actual_usage():
+    limiter = _limiter(requests_per_minute=None, tokens_per_minute=60000, burst_seconds=1)
+    limiter.acquire(600, "high")
+    limiter.record_usage(600, 900)
+    assert limiter.snapshot()["tokens_available"] == pytest.approx(100, abs=20)
+
+
+def test_pause_delays_grants():
+    limiter = _limiter(requests_per_minute=6000)
+    limiter.pause(0.1)
+    start = time.monotonic()
+    limiter.acquire(0, "high")
+    assert time.monotonic() - start >= 0.08
+    assert limiter.snapshot()["rate_limited"] == 1
+
+
+def test_cancel_interrupts_waiting_call():
+    limiter = _limiter(requests_per_minute=60)
+    limiter.acquire(0, "high")
+    token = CancellationToken()
+    threading.Timer(0.05, token.cancel, args=("阶段结束",)).start()
+    start = time.monotonic()
+    with pytest.raises(CancelledError):
+        limiter.acquire(0, "high", cancel_token=token)
+    assert time.monotonic() - start < 1
+    assert limiter.snapshot()["queued"] == 0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < parse_retry_after(later) <= 30
@@ -0,0 +1,45 @@
+# tests/test_tts_split.py
+
+import re
+
+import pytest
+
+from tts_manager import split_text_for_tts
+
+POLICY = {"min_length": 4, "first_chunk_max": 12, "target_length": 40, "max_length": 80}
+
+SAMPLES = [
+    "我是预言家，昨晚查验了3号，他是狼人。大家跟我一起投3号！不要犹豫……",
+    "……好的！！！我觉得5号很可疑，因为他一直在划水，而且投票也跟着狼走。",
+    "我同意前面几位的看法" * 30,
+    "好。",
+]
+
+
+def _speakable(text):
+    return re.sub(r'[\W_]', '', text)
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_chunks_respect_limits_and_keep_all_speakable_text(text):
+    chunks = split_text_for_tts(text, POLICY)
+    assert chunks
+    assert len(chunks[0]) <= POLICY['first_chunk_max']
+    assert all(len(chunk) <= POLICY['max_length'] for chunk in chunks)
+    assert all(_speakable(chunk) for chunk in chunks)
+    assert _speakable(''.join(chunks)) == _speakable(text)
+
+
+def test_first_chunk_is_short_and_rest_is_merged():
+    chunks = split_text_for_tts(SAMPLES[0], POLICY)
+    assert chunks == ["我是预言家，", "昨晚查验了3号，他是狼人。大家跟我一起投3号！不要犹豫……"]
+
+
+def test_blank_text_and_whitespace():
+    assert split_text_for_tts("   ", POLICY) == []
+    assert split_text_for_tts(None, POLICY) == []
+    assert split_text_for_tts("我\n觉得   可以", POLICY) == ["我 觉得 可以"]
+
+
+def test_default_policy_is_used_without_argument():
+    assert split_text_for_tts("好的，我们开始吧。") == ["好的，我们开始吧。"]
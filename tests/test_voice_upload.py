@@ -0,0 +1,58 @@
+# tests/test_voice_upload.py
+
+import json
+
+import pytest
+
+import tts_manager
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    """单个音色的上传配置；记录 _upload_voice 的调用，每次返回新的URI。"""
+    audio = tmp_path / "ref.wav"
+    audio.write_bytes(b"RIFF-test-audio")
+    providers = {
+        "siliconflow": {"api_key": "sk-test", "model": "tts-model", "voice_names": {1: "voice1"},
+                        "upload_api_url": "http://upload.invalid"},
+        "local_gsv": {"reference_audios": {1: str(audio)}, "reference_texts": {1: "参考文本"}},
+    }
+    monkeypatch.setitem(tts_manager.TTS_CONFIG, 'providers', providers)
+    calls = []
+
+    def fake_upload(config, headers, player_id, voice_name, ref_audio_path, ref_text):
+        calls.append(player_id)
+        return f"speech:voice1:upload:{len(calls)}"
+
+    monkeypatch.setattr(tts_manager, '_upload_voice', fake_upload)
+    monkeypatch.setattr(tts_manager, '_test_first_voice_tts', lambda voice_map, config: True)
+    return calls
+
+
+def _write_map(data):
+    with open(tts_manager.VOICE_MAP_FILE, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def _read_map():
+    with open(tts_manager.VOICE_MAP_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_legacy_entry_without_hash_is_uploaded_once(uploads):
+    _write_map({"1": "speech:voice1:legacy:0"})
+
+    tts_manager.upload_siliconflow_voices_if_needed()
+    assert uploads == [1]
+    entry = _read_map()["1"]
+    assert entry["uri"] == "speech:voice1:upload:1" and entry["hash"]
+
+    tts_manager.upload_siliconflow_voices_if_needed()
+    assert uploads == [1]
+
+
+def test_changed_reference_text_is_uploaded_again(uploads):
+    tts_manager.upload_siliconflow_voices_if_needed()
+    tts_manager.TTS_CONFIG['providers']['local_gsv']['reference_texts'][1] = "新的参考文本"
+    tts_manager.upload_siliconflow_voices_if_needed()
+    assert uploads == [1, 1]
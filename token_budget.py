@@ -0,0 +1,101 @@
+# token_budget.py
+
+import logging
+import re
+import threading
+from config import LLM_PROVIDERS, LLM_ROUTER_CONFIG, LLM_CONTEXT_CONFIG, TOKEN_ESTIMATOR_CONFIG
+
+# 本地token估算：发请求前就能知道prompt大小，并按调用类型的预算裁剪低优先级片段。
+# 中文按字、其余字符按平均每token字符数折算，系数按模型家族配置。
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+# 进程内按调用类型累计的prompt片段token统计
+_section_stats = {}
+_stats_lock = threading.Lock()
+
+def default_model() -> str | None:
+    """当前生效的模型名：启用路由时取第一个后端，否则取默认供应商。"""
+    if LLM_ROUTER_CONFIG.get('enabled') and LLM_ROUTER_CONFIG.get('backends'):
+        backend = LLM_ROUTER_CONFIG['backends'][0]
+        return backend.get('model') or LLM_PROVIDERS.get(backend['provider'], {}).get('model')
+    return LLM_PROVIDERS.get(LLM_PROVIDERS.get("default"), {}).get('model')
+
+def _family_ratios(model: str = None) -> dict:
+    families = TOKEN_ESTIMATOR_CONFIG.get('families', {})
+    name = (model or default_model() or "").lower()
+    for family, ratios in families.items():
+        if family != "default" and family in name:
+            return ratios
+    return families.get("default", {})
+
+def estimate_tokens(text: str, model: str = None) -> int:
+    """估算文本在指定模型（默认当前模型）下的token数。"""
+    if not text:
+        return 0
+    ratios = _family_ratios(model)
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return int(cjk * ratios.get('cjk_tokens_per_char', 1.0) + other / ratios.get('other_chars_per_token', 4.0) + 0.5)
+
+def prompt_budget(call_type: str) -> int | None:
+    """调用类型的prompt token上限，未配置时返回None。"""
+    ceilings = LLM_CONTEXT_CONFIG.get("prompt_token_ceiling", {})
+    return ceilings.get(call_type, ceilings.get("default"))
+
+def assemble_prompt(sections: list, call_type: str, model: str = None) -> str:
+    """
+    按顺序用换行拼接prompt片段，并执行该调用类型的token预算。
+
+    :param sections: [{"name", "text", "shrink"(可选)}]；name 出现在 LLM_CONTEXT_CONFIG['section_priority']
+                     中的片段可被裁剪，优先级数值越小越先裁剪，其余片段始终保留。
+                     带 shrink(max_tokens) 的片段先尝试压缩，压缩不够再整体去掉。
+    :param call_type: 调用类型，决定预算
+    :return: 拼接后的prompt
+    """
+    sizes = {s['name']: estimate_tokens(s['text'], model) for s in sections}
+    total = sum(sizes.values()) + len(sections) - 1
+    budget = prompt_budget(call_type)
+
+    if budget and total > budget:
+        priorities = LLM_CONTEXT_CONFIG.get("section_priority", {})
+        trimmable = sorted((s for s in sections if s['name'] in priorities and s['text']),
+                           key=lambda s: priorities[s['name']])
+        trimmed = []
+        for section in trimmable:
+            overflow = total - budget
+            if overflow <= 0:
+                break
+            before = sizes[section['name']]
+            if section.get('shrink') and before > overflow:
+                section['text'] = section['shrink'](before - overflow)
+            else:
+                section['text'] = ""
+            sizes[section['name']] = estimate_tokens(section['text'], model)
+            total -= before - sizes[section['name']]
+            trimmed.append(section['name'])
+        logging.info(f"{call_type} prompt 超过预算 {budget} tokens，已裁剪: {', '.join(trimmed)}，裁剪后约 {total} tokens")
+
+    _record_sections(call_type, sizes)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        breakdown = ", ".join(f"{name}={size}" for name, size in sizes.items())
+        logging.debug(f"{call_type} prompt token估算: {breakdown}，合计约 {total}")
+    return "\n".join(s['text'] for s in sections)
+
+def _record_sections(call_type: str, sizes: dict):
+    with _stats_lock:
+        stats = _section_stats.setdefault(call_type, {"prompts": 0, "sections": {}})
+        stats["prompts"] += 1
+        for name, size in sizes.items():
+            stats["sections"][name] = stats["sections"].get(name, 0) + size
+
+def get_section_stats() -> dict:
+    """各调用类型prompt中每个片段的平均token估算。"""
+    with _stats_lock:
+        return {
+            call_type: {
+                "prompts": stats["prompts"],
+                "avg_tokens": {name: round(total / stats["prompts"], 1) for name, total in stats["sections"].items()}
+            }
+            for call_type, stats in _section_stats.items()
+        }
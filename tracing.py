@@ -0,0 +1,187 @@
+# tracing.py
+
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import TRACING_CONFIG
+
+# 每局游戏一个 Tracer，记录的事件按 Chrome trace 格式导出，可在 chrome://tracing 或 Perfetto 中打开。
+# 同步代码记录为按线程嵌套的完整事件；协程中并发进行的工作和计划中的等待记录为异步事件。
+# llm_utils 等模块级函数通过 use() 绑定的上下文找到当前对局的 Tracer 和关联字段（如 speech_id）。
+
+_context = contextvars.ContextVar('trace_context', default=None)
+
+class Tracer:
+    """一局游戏的span记录器。"""
+
+    enabled = True
+
+    def __init__(self, game_id: str, max_events: int = None):
+        self.game_id = game_id
+        self.max_events = max_events or TRACING_CONFIG.get('max_events', 200000)
+        self.dropped = 0
+        self.exported_path = None
+        self._events = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._threads = {}
+        self._origin = time.perf_counter()
+        self._phase = None
+
+    def _now_us(self) -> float:
+        return round((time.perf_counter() - self._origin) * 1e6, 1)
+
+    def _append(self, event: dict):
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            self._events.append(event)
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            tid = self._threads.get(ident)
+            if tid is None:
+                tid = self._threads[ident] = len(self._threads) + 1
+                self._events.append({"ph": "M", "name": "thread_name", "pid": 1, "tid": tid,
+                                     "args": {"name": threading.current_thread().name}})
+            return tid
+
+    def _args(self, args: dict) -> dict:
+        context = _context.get()
+        if context and context[0] is self:
+            return {**context[1], **args}
+        return args
+
+    def new_id(self, prefix: str) -> str:
+        """生成本局内唯一的关联ID，如 speech-12。"""
+        return f"{prefix}-{next(self._ids)}"
+
+    @contextmanager
+    def span(self, name: str, cat: str = "game", **args):
+        """记录一段同步代码；yield 出的字典可在执行过程中补充参数。"""
+        args = self._args(args)
+        start = self._now_us()
+        try:
+            yield args
+        finally:
+            self._append({"ph": "X", "name": name, "cat": cat, "ts": start, "dur": round(self._now_us() - start, 1),
+                          "pid": 1, "tid": self._tid(), "args": args})
+
+    @contextmanager
+    def async_span(self, name: str, cat: str = "async", **args):
+        """记录一段可能与同线程其他工作交错的操作（协程、并发请求），在独立的异步轨道上显示。"""
+        args = self._args(args)
+        span_id = next(self._ids)
+        self._append({"ph": "b", "name": name, "cat": cat, "id": span_id, "ts": self._now_us(), "pid": 1, "tid": self._tid(), "args": args})
+        try:
+            yield args
+        finally:
+            self._append({"ph": "e", "name": name, "cat": cat, "id": span_id, "ts": self._now_us(), "pid": 1, "tid": self._tid()})
+
+    def planned(self, name: str, seconds: float, cat: str = "delay", **args):
+        """记录一段已经安排好的等待（如定时器延迟），从现在开始持续 seconds 秒。"""
+        span_id = next(self._ids)
+        start = self._now_us()
+        tid = self._tid()
+        self._append({"ph": "b", "name": name, "cat": cat, "id": span_id, "ts": start, "pid": 1, "tid": tid, "args": self._args(args)})
+        self._append({"ph": "e", "name": name, "cat": cat, "id": span_id, "ts": round(start + seconds * 1e6, 1), "pid": 1, "tid": tid})
+
+    def instant(self, name: str, cat: str = "game", **args):
+        self._append({"ph": "i", "s": "t", "name": name, "cat": cat, "ts": self._now_us(), "pid": 1, "tid": self._tid(), "args": self._args(args)})
+
+    def set_phase(self, name: str | None):
+        """结束上一个游戏阶段并开始新阶段；阶段显示在单独的一条轨道上。name 为None时只结束。"""
+        now = self._now_us()
+        with self._lock:
+            previous, self._phase = self._phase, (name, now) if name else None
+        if previous:
+            self._append({"ph": "b", "name": previous[0], "cat": "phase", "id": "phase", "ts": previous[1], "pid": 1, "tid": 0})
+            self._append({"ph": "e", "name": previous[0], "cat": "phase", "id": "phase", "ts": now, "pid": 1, "tid": 0})
+
+    def export(self, path: str = None) -> str | None:
+        """写出trace文件，返回路径；默认写入 TRACING_CONFIG['output_dir']/trace_<game_id>.json。"""
+        if path is None:
+            output_dir = TRACING_CONFIG.get('output_dir', 'traces')
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, f"trace_{self.game_id}.json")
+        with self._lock:
+            events = list(self._events)
+            if self._phase:
+                name, start = self._phase
+                events.append({"ph": "b", "name": name, "cat": "phase", "id": "phase", "ts": start, "pid": 1, "tid": 0})
+                events.append({"ph": "e", "name": name, "cat": "phase", "id": "phase", "ts": self._now_us(), "pid": 1, "tid": 0})
+        trace = {
+            "traceEvents": [{"ph": "M", "name": "process_name", "pid": 1, "args": {"name": f"game {self.game_id}"}}, *events],
+            "displayTimeUnit": "ms",
+            "otherData": {"game_id": self.game_id, "dropped_events": self.dropped},
+        }
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(trace, f, ensure_ascii=False)
+        except OSError as e:
+            logging.error(f"导出游戏trace失败: {e}")
+            return None
+        self.exported_path = path
+        logging.info(f"游戏trace已导出到 {path}（{len(events)} 个事件）")
+        return path
+
+class _NullTracer:
+    """未启用追踪时使用，所有记录操作都是空操作。"""
+
+    enabled = False
+    exported_path = None
+
+    def new_id(self, prefix: str) -> str | None:
+        return None
+
+    @contextmanager
+    def span(self, name: str, cat: str = "game", **args):
+        yield args
+
+    async_span = span
+
+    def planned(self, *args, **kwargs):
+        pass
+
+    def instant(self, *args, **kwargs):
+        pass
+
+    def set_phase(self, name):
+        pass
+
+    def export(self, path: str = None):
+        return None
+
+NULL_TRACER = _NullTracer()
+
+def new_tracer(game_id: str):
+    """按配置为一局游戏创建 Tracer，未启用时返回空实现。"""
+    return Tracer(game_id) if TRACING_CONFIG.get('enabled', False) else NULL_TRACER
+
+@contextmanager
+def use(tracer, **correlation):
+    """在当前线程（及由此创建的协程）中绑定对局的 Tracer 和关联字段，嵌套时合并外层字段。"""
+    outer = _context.get()
+    if outer and outer[0] is tracer:
+        correlation = {**outer[1], **correlation}
+    token = _context.set((tracer, correlation))
+    try:
+        yield tracer
+    finally:
+        _context.reset(token)
+
+def current():
+    """当前上下文绑定的 Tracer，没有时返回空实现。"""
+    context = _context.get()
+    return context[0] if context else NULL_TRACER
+
+def span(name: str, cat: str = "game", **args):
+    """在当前绑定的 Tracer 上记录同步span。"""
+    return current().span(name, cat, **args)
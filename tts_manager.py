@@ -1,42 +1,183 @@
 # tts_manager.py
 
+# 供应商SDK（aiohttp、requests、openai）在首次使用时才导入，避免拖慢服务器启动
 import asyncio
-import aiohttp
+import contextvars
 import os
 import re
 import json
 import logging
 import base64
-import requests
+import hashlib
 import time
 import threading
-from typing import List
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import List, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 from pathlib import Path
-from config import TTS_CONFIG
-from openai import OpenAI
+from config import TTS_CONFIG, WARMUP_CONFIG
+from audio_timeline import AudioTimeline, AudioSlot, get_audio_duration
+from tts_monitoring import log_tts_chunk
+import tracing
+from seating import voice_seat
 
-# 用于存储SiliconFlow返回的完整声音URI
+if TYPE_CHECKING:
+    import aiohttp
+
+_requests_module = None
+
+def _requests():
+    """首次使用时导入 requests 并缓存，模块导入时不加载。"""
+    global _requests_module
+    if _requests_module is None:
+        import requests
+        _requests_module = requests
+    return _requests_module
+
+# 用于存储SiliconFlow返回的完整声音URI，以及上传时参考音频与文本的内容哈希
 VOICE_MAP_FILE = 'siliconflow_voices.json'
 
-def _load_voice_map():
-    """加载已存储的声音URI映射文件。"""
+def _load_voice_entries() -> dict:
+    """
+    加载声音映射文件，返回 {玩家ID: {"uri": ..., "hash": ...}}。
+    兼容旧格式 {玩家ID: uri}，此时hash为None，上传检查时会重新上传一次以记录哈希。
+    """
     if not os.path.exists(VOICE_MAP_FILE):
         return {}
     try:
         with open(VOICE_MAP_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            raw = json.load(f)
     except (IOError, json.JSONDecodeError):
         return {}
+    entries = {}
+    for player_id, value in raw.items():
+        if isinstance(value, dict):
+            entries[player_id] = {"uri": value.get("uri"), "hash": value.get("hash")}
+        else:
+            entries[player_id] = {"uri": value, "hash": None}
+    return entries
+
+def _load_voice_map():
+    """加载已存储的声音URI映射 {玩家ID: uri}。"""
+    return {player_id: entry["uri"] for player_id, entry in _load_voice_entries().items() if entry.get("uri")}
 
 def _save_voice_map(data: dict):
-    """保存声音URI映射到文件。"""
+    """保存声音映射（含URI与内容哈希）到文件。"""
     try:
         with open(VOICE_MAP_FILE, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
     except IOError as e:
         logging.error(f"保存声音映射文件失败: {e}")
 
+def _voice_content_hash(model: str, voice_name: str, ref_audio_path: str, ref_text: str) -> str:
+    """参考音频、参考文本、模型与音色名共同决定的内容哈希，任一变化都需要重新上传。"""
+    digest = hashlib.sha256()
+    for part in (model, voice_name, ref_text or ""):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    with open(ref_audio_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _negotiate_audio_format(provider_config: dict, client_formats: List[str] | None) -> str:
+    """
+    在供应商支持的输出格式（按优先级）中选出客户端能解码的第一个。
+    客户端未上报能力或没有交集时，使用列表最后一项作为兜底格式。
+    """
+    provider_formats = provider_config.get('audio_formats') or ['wav']
+    if client_formats:
+        for audio_format in provider_formats:
+            if audio_format in client_formats:
+                return audio_format
+    return provider_formats[-1]
+
+# --- TTS文本切分 ---
+_DEFAULT_CHUNK_POLICY = {
+    "min_length": 4,         # 块内可朗读字符的最少数量，更短的子句会与相邻子句合并
+    "first_chunk_max": 12,   # 首块最大长度，越短首段音频越快返回
+    "target_length": 40,     # 后续块合并子句的目标长度
+    "max_length": 80,        # 单块硬上限，超长的无标点句子会在此长度内切开
+}
+# 子句结束符：中英文标点与换行；英文句点不切分数字中的小数点
+_CLAUSE_END_RE = re.compile(r'((?:[。！？!?；;：:，,、…\n]|(?<!\d)\.(?!\d))+)')
+_SPEAKABLE_RE = re.compile(r'\w')
+_INLINE_SPACE_RE = re.compile(r'[ \t\r\f\v]+')
+
+def _speakable_length(text: str) -> int:
+    return len(_SPEAKABLE_RE.findall(text))
+
+def _split_long_span(text: str, max_length: int) -> List[str]:
+    """将超长片段切到max_length以内，优先在空白处断开，否则按长度硬切。"""
+    pieces = []
+    while len(text) > max_length:
+        cut = text.rfind(' ', 0, max_length + 1)
+        if cut < max_length // 2:
+            cut = max_length
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+def split_text_for_tts(text: str, policy: dict = None) -> List[str]:
+    """
+    面向首段延迟的TTS文本切分：
+    1. 首块尽量短（达到 min_length 即截止，合并子句后也不超过 first_chunk_max），让第一段音频尽快返回；
+    2. 后续子句合并到 target_length 附近，减少请求数；
+    3. 没有标点的超长片段按 max_length 安全切开，不丢弃任何可朗读内容。
+    """
+    policy = {**_DEFAULT_CHUNK_POLICY, **(policy or {})}
+    text = _INLINE_SPACE_RE.sub(' ', text or '').strip()
+    if not text:
+        return []
+
+    parts = _CLAUSE_END_RE.split(text)
+    clauses = []
+    for k in range(0, len(parts), 2):
+        clause = parts[k] + (parts[k + 1] if k + 1 < len(parts) else '')
+        if clause:
+            clauses.extend(_split_long_span(clause, policy['max_length']))
+
+    # 首个可朗读子句额外限制在 first_chunk_max 以内
+    first = next((k for k, clause in enumerate(clauses) if _SPEAKABLE_RE.search(clause)), None)
+    if first is not None and len(clauses[first]) > policy['first_chunk_max']:
+        clauses[first:first + 1] = _split_long_span(clauses[first], policy['first_chunk_max'])
+
+    first_chunk_max = policy['first_chunk_max']
+    chunks = []
+    current = ""
+    for clause in clauses:
+        if (not chunks and current and _SPEAKABLE_RE.search(current)
+                and len(current) + len(clause) > first_chunk_max):
+            # 首块再合并就会超过 first_chunk_max，即使不足 min_length 也先发出
+            chunks.append(current)
+            current = ""
+        if not _SPEAKABLE_RE.search(clause):
+            # 纯标点/空白片段附着到前文，不单独成块；首块已满时留给下一块
+            if current:
+                current += clause
+            elif len(chunks) == 1 and len(chunks[0]) + len(clause) > first_chunk_max:
+                current = clause
+            elif chunks:
+                chunks[-1] += clause
+            continue
+        if current and _speakable_length(current) >= policy['min_length'] and (
+                not chunks or len(current) + len(clause) > policy['target_length']):
+            chunks.append(current)
+            current = ""
+        current += clause
+
+    if current:
+        limit = first_chunk_max if len(chunks) == 1 else policy['max_length']
+        if (chunks and _speakable_length(current) < policy['min_length']
+                and len(chunks[-1]) + len(current) <= limit):
+            chunks[-1] += current
+        else:
+            chunks.append(current)
+
+    return [chunk.replace('\n', ' ').strip() for chunk in chunks if chunk.strip()]
+
 def _is_valid_voice_uri(uri: str) -> bool:
     """检查Voice URI格式是否有效"""
     return (isinstance(uri, str) and 
@@ -44,12 +185,54 @@ def _is_valid_voice_uri(uri: str) -> bool:
             uri.count(':') >= 3 and
             'None' not in uri)
 
+def _upload_voice(config: dict, headers: dict, player_id: int, voice_name: str, ref_audio_path: str, ref_text: str) -> str | None:
+    """上传单个参考音频，返回有效的音色URI，失败时返回None。"""
+    requests = _requests()
+    try:
+        with open(ref_audio_path, "rb") as f:
+            files = {"file": f}
+            data = { 
+                "model": config['model'], 
+                "customName": voice_name, 
+                "text": ref_text 
+            }
+            response = requests.post(
+                config['upload_api_url'], 
+                headers=headers, 
+                files=files, 
+                data=data, 
+                timeout=60
+            )
+            response.raise_for_status()
+            response_data = response.json()
+    except requests.exceptions.HTTPError as e:
+        print(f"   ❌ 玩家 {player_id} HTTP错误 {e.response.status_code}: {e.response.text}")
+        return None
+    except Exception as e:
+        print(f"   ❌ 玩家 {player_id} 上传异常: {e}")
+        return None
+
+    voice_uri = response_data.get("uri")
+    if not voice_uri:
+        print(f"   ❌ 玩家 {player_id} 响应中缺少URI字段，响应内容: {response_data}")
+        return None
+    if _is_valid_voice_uri(voice_uri):
+        return voice_uri
+
+    # 尝试查找其他可能的完整URI字段
+    for key, value in response_data.items():
+        if _is_valid_voice_uri(str(value)):
+            print(f"   🔍 玩家 {player_id} 在字段 '{key}' 找到有效URI: {value}")
+            return str(value)
+    print(f"   ❌ 玩家 {player_id} 无法找到有效的URI格式: {voice_uri}")
+    return None
+
 def upload_siliconflow_voices_if_needed():
     """
     智能上传 SiliconFlow音色：
-    1. 检查现有URI格式是否正确
-    2. 重新上传格式不正确或缺失的音色
-    3. 验证上传结果
+    1. 为每个音色计算参考音频与文本的内容哈希，与映射文件中的记录比较
+    2. 仅并发上传缺失、URI格式不正确或内容有变化的音色
+    3. 汇总上传结果并验证
     """
     config = TTS_CONFIG['providers'].get('siliconflow')
     local_config = TTS_CONFIG['providers'].get('local_gsv')
@@ -67,113 +250,84 @@ def upload_siliconflow_voices_if_needed():
     print("="*60)
 
     headers = {"Authorization": f"Bearer {api_key}"}
-    voice_map = _load_voice_map()
-    
-    # 检查现有URI格式
-    invalid_uris = []
-    missing_players = []
+    entries = _load_voice_entries()
+    summary = {"unchanged": [], "uploaded": [], "failed": [], "missing_audio": []}
+    jobs = []
     
     for player_id, voice_name in config['voice_names'].items():
-        existing_uri = voice_map.get(str(player_id))
-        if not existing_uri:
-            missing_players.append((player_id, voice_name))
-            print(f"❌ 玩家 {player_id} ({voice_name}) 缺失音色URI")
-        elif not _is_valid_voice_uri(existing_uri):
-            invalid_uris.append((player_id, voice_name, existing_uri))
-            print(f"⚠️  玩家 {player_id} ({voice_name}) URI格式不正确: {existing_uri}")
-        else:
-            print(f"✅ 玩家 {player_id} ({voice_name}) URI格式正确")
-    
-    # 需要上传的玩家
-    players_to_upload = missing_players + [(pid, vname, _) for pid, vname, _ in invalid_uris]
-    
-    if not players_to_upload:
-        print("🎉 所有音色URI格式正确，无需重新上传")
-        return True
-    
-    print(f"\n🔄 需要上传 {len(players_to_upload)} 个音色...")
-    
-    success_count = 0
-    new_voice_map = voice_map.copy()
-    
-    for player_data in players_to_upload:
-        player_id = player_data[0]
-        voice_name = player_data[1]
-        
         ref_audio_path = local_config['reference_audios'].get(player_id)
         ref_text = local_config['reference_texts'].get(player_id)
-
+        entry = entries.get(str(player_id))
         if not ref_audio_path or not os.path.exists(ref_audio_path):
-            print(f"❌ 玩家 {player_id} 参考音频不存在: {ref_audio_path}")
+            if entry and _is_valid_voice_uri(entry.get("uri")):
+                # 无法比较内容，沿用已上传的音色
+                print(f"⚠️  玩家 {player_id} ({voice_name}) 参考音频不存在，沿用已有URI")
+                summary["unchanged"].append(player_id)
+            else:
+                print(f"❌ 玩家 {player_id} 参考音频不存在: {ref_audio_path}")
+                summary["missing_audio"].append(player_id)
             continue
 
-        print(f"\n🔤 上传玩家 {player_id} ({voice_name})...")
-        
-        try:
-            with open(ref_audio_path, "rb") as f:
-                files = {"file": f}
-                data = { 
-                    "model": config['model'], 
-                    "customName": voice_name, 
-                    "text": ref_text 
-                }
-                response = requests.post(
-                    config['upload_api_url'], 
-                    headers=headers, 
-                    files=files, 
-                    data=data, 
-                    timeout=60
-                )
-                response.raise_for_status()
-                response_data = response.json()
-                
-                voice_uri = response_data.get("uri")
-                if not voice_uri:
-                    print(f"   ❌ 响应中缺少URI字段")
-                    print(f"   响应内容: {response_data}")
-                    continue
-                
-                # 验证URI格式
-                if _is_valid_voice_uri(voice_uri):
-                    print(f"   ✅ 上传成功: {voice_uri}")
-                    new_voice_map[str(player_id)] = voice_uri
-                    success_count += 1
+        content_hash = _voice_content_hash(config['model'], voice_name, ref_audio_path, ref_text)
+        if entry and _is_valid_voice_uri(entry.get("uri")):
+            if entry.get("hash") == content_hash:
+                print(f"✅ 玩家 {player_id} ({voice_name}) 音色未变化")
+                summary["unchanged"].append(player_id)
+                continue
+            if entry.get("hash") is None:
+                # 旧格式映射没有哈希记录，无法确认已上传的音色与当前参考音频一致，重新上传一次
+                print(f"🔄 玩家 {player_id} ({voice_name}) 旧格式映射缺少内容哈希，重新上传")
+            else:
+                print(f"🔄 玩家 {player_id} ({voice_name}) 参考音频或文本已变化")
+        elif entry:
+            print(f"⚠️  玩家 {player_id} ({voice_name}) URI格式不正确: {entry.get('uri')}")
+        else:
+            print(f"❌ 玩家 {player_id} ({voice_name}) 缺失音色URI")
+        jobs.append((player_id, voice_name, ref_audio_path, ref_text, content_hash))
+    
+    if jobs:
+        concurrency = max(1, min(len(jobs), config.get('upload_concurrency', 4)))
+        print(f"\n🔄 需要上传 {len(jobs)} 个音色（并发 {concurrency}）...")
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {
+                pool.submit(_upload_voice, config, headers, player_id, voice_name, ref_audio_path, ref_text): (player_id, content_hash)
+                for player_id, voice_name, ref_audio_path, ref_text, content_hash in jobs
+            }
+            for future in as_completed(futures):
+                player_id, content_hash = futures[future]
+                voice_uri = future.result()
+                if voice_uri:
+                    print(f"   ✅ 玩家 {player_id} 上传成功: {voice_uri}")
+                    entries[str(player_id)] = {"uri": voice_uri, "hash": content_hash}
+                    summary["uploaded"].append(player_id)
                 else:
-                    print(f"   ❌ URI格式仍然不正确: {voice_uri}")
-                    # 尝试查找其他可能的完整URI字段
-                    for key, value in response_data.items():
-                        if _is_valid_voice_uri(str(value)):
-                            print(f"   🔍 在字段 '{key}' 找到有效URI: {value}")
-                            new_voice_map[str(player_id)] = str(value)
-                            success_count += 1
-                            break
-                    else:
-                        print(f"   ❌ 无法找到有效的URI格式")
-                
-        except requests.exceptions.HTTPError as e:
-            print(f"   ❌ HTTP错误 {e.response.status_code}: {e.response.text}")
-        except Exception as e:
-            print(f"   ❌ 上传异常: {e}")
+                    summary["failed"].append(player_id)
+
+    _save_voice_map(entries)
     
-    # 保存结果
-    if success_count > 0:
-        _save_voice_map(new_voice_map)
-        print(f"\n💾 已保存 {success_count} 个音色URI到映射文件")
-        
-        # 验证第一个成功上传的音色
-        if _test_first_voice_tts(new_voice_map, config):
+    print("\n" + "="*60)
+    print(f"📋 音色检查结果: 未变化 {len(summary['unchanged'])}，上传成功 {len(summary['uploaded'])}，"
+          f"上传失败 {len(summary['failed'])}，缺少参考音频 {len(summary['missing_audio'])}")
+    if summary["failed"]:
+        print(f"   上传失败的玩家: {sorted(summary['failed'])}")
+
+    if summary["uploaded"]:
+        # 验证一个新上传的音色
+        uploaded_id = str(summary["uploaded"][0])
+        if _test_first_voice_tts({uploaded_id: entries[uploaded_id]["uri"]}, config):
             print("✅ TTS功能验证成功")
         else:
             print("⚠️  TTS功能验证失败，但音色已上传")
-    
-    print("\n" + "="*60)
-    total_needed = len(players_to_upload)
-    if success_count == total_needed:
-        print(f"🎉 音色上传完成! ({success_count}/{total_needed})")
+
+    total_needed = len(jobs) + len(summary["missing_audio"])
+    if not total_needed:
+        print("🎉 所有音色均未变化，无需重新上传")
         return True
-    else:
-        print(f"⚠️  部分音色上传失败 ({success_count}/{total_needed})")
-        return success_count > 0
+    if len(summary["uploaded"]) == total_needed:
+        print(f"🎉 音色上传完成! ({len(summary['uploaded'])}/{total_needed})")
+        return True
+    print(f"⚠️  部分音色上传失败 ({len(summary['uploaded'])}/{total_needed})")
+    return len(summary["uploaded"]) > 0
 
 def _test_first_voice_tts(voice_map: dict, config: dict) -> bool:
     """测试第一个音色的TTS功能"""
@@ -181,6 +335,7 @@ def _test_first_voice_tts(voice_map: dict, config: dict) -> bool:
         return False
     
     try:
+        from openai import OpenAI
         print("\n🧪 测试TTS功能...")
         player_id = list(voice_map.keys())[0]
         voice_uri = voice_map[player_id]
@@ -208,7 +363,7 @@ def _test_first_voice_tts(voice_map: dict, config: dict) -> bool:
         return False
 
 class TTSManager:
-    def __init__(self, socketio):
+    def __init__(self, socketio, client_formats: List[str] | None = None):
         self.socketio = socketio
         self.provider_name = TTS_CONFIG.get("default_provider", "local_gsv")
         self.config = TTS_CONFIG['providers'].get(self.provider_name)
@@ -223,85 +378,216 @@ class TTSManager:
         # 初始化线程池执行器
         self.executor = ThreadPoolExecutor(max_workers=TTS_CONFIG.get('concurrency', 2))
 
-        logging.info(f"TTS管理器已初始化，使用供应商: {self.provider_name}")
+        # 按真实音频时长排队播放的时间线（每局游戏一个TTS管理器）
+        self.timeline = AudioTimeline() if TTS_CONFIG.get('audio_timeline', {}).get('enabled', False) else None
+
+        # 本地GSV的aiohttp会话由管理器持有，在专用事件循环上长期复用
+        self._gsv_session = None
+
+        # 专用的常驻事件循环线程，所有发言的TTS协程都提交到这里执行
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_loop, name="tts-event-loop", daemon=True)
+        self._loop_thread.start()
+        self._speech_futures = set()
+
+        # 所属对局的 Tracer，由游戏在开局时设置
+        self.tracer = tracing.NULL_TRACER
+
+        # 文本切分策略：供应商配置覆盖默认值
+        self.chunk_policy = {**_DEFAULT_CHUNK_POLICY, **self.config.get('chunk_policy', {})}
+
+        # 与客户端协商音频输出格式
+        self.audio_format = _negotiate_audio_format(self.config, client_formats)
+
+        logging.info(f"TTS管理器已初始化，使用供应商: {self.provider_name}，音频格式: {self.audio_format}")
 
     def _split_text(self, text: str) -> List[str]:
-        """将长文本按标点分割成适合TTS的短句列表。"""
-        text = text.strip()
-        if not text: 
-            return []
-        
-        # 定义标点符号分隔符（中英文）
-        separators = r'[。！？；：,.!?;:\n]'
-        
-        # 按标点符号切分，保留分隔符
-        parts = re.split(f'({separators})', text)
-        
-        chunks = []
-        current_chunk = ""
-        
-        for part in parts:
-            if part.strip():  # 跳过空字符串
-                current_chunk += part
-                # 如果是标点符号，结束当前块
-                if re.match(separators, part):
-                    if current_chunk.strip():
-                        chunks.append(current_chunk.strip())
-                    current_chunk = ""
-        
-        # 添加最后一块（如果有）
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-        
-        # 过滤掉太短的块
-        chunks = [chunk for chunk in chunks if len(chunk.strip()) > 1]
-        
-        return chunks
+        """按当前供应商的切分策略将文本切成适合TTS的块。"""
+        return split_text_for_tts(text, self.chunk_policy)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit_speech(self, player_id: int, text: str, slot: AudioSlot | None = None, speech_id: str = None) -> Future:
+        """将一次发言的TTS提交到常驻事件循环，返回可等待或取消的Future。"""
+        future = asyncio.run_coroutine_threadsafe(self.stream_tts_for_player(player_id, text, slot, speech_id), self._loop)
+        self._speech_futures.add(future)
+        future.add_done_callback(self._speech_futures.discard)
+        return future
+
+    def cancel_pending(self):
+        """取消所有尚未完成的发言TTS。"""
+        for future in list(self._speech_futures):
+            future.cancel()
+
+    def shutdown(self):
+        """取消未完成的发言，关闭会话并停止事件循环线程。"""
+        if self._loop.is_closed():
+            return
+        self.cancel_pending()
+        try:
+            asyncio.run_coroutine_threadsafe(self.close(), self._loop).result(timeout=5)
+        except Exception as e:
+            logging.warning(f"关闭TTS会话失败: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        if not self._loop.is_running():
+            self._loop.close()
+        self.executor.shutdown(wait=False)
+
+    def warm_up(self) -> Future:
+        """
+        在常驻事件循环上发送极短的合成请求（不播放），提前建立连接并让服务端处理参考音频，
+        首位发言者的语音不再承担冷启动开销。本地GSV逐个处理请求，只按座位顺序依次预热前
+        tts_local_voices 个音色，避免真实发言排在预热请求之后；云端服务并发预热全部音色。
+        """
+        return asyncio.run_coroutine_threadsafe(self._warm_up(), self._loop)
+
+    async def _warm_up(self) -> dict:
+        text = WARMUP_CONFIG.get('tts_text', "好的。")
+        loop = asyncio.get_running_loop()
 
-    async def _stream_local_gsv(self, player_id: int, chunks: List[str]):
-        """处理本地GSV TTS的逻辑。"""
-        # 添加TTS播放延迟，但1号玩家（首发）不延迟
+        async def timed(player_id, request):
+            start_time = time.monotonic()
+            audio_data = await request
+            return player_id, round((time.monotonic() - start_time) * 1000, 1) if audio_data else None
+
+        if self.provider_name == "local_gsv":
+            session = self._get_gsv_session()
+            voices = [(pid, params) for pid, params in ((pid, self._gsv_params(pid)) for pid in sorted(self.config['reference_audios']))
+                        if params is not None][:WARMUP_CONFIG.get('tts_local_voices', 1)]
+            results = {}
+            for player_id, params in voices:
+                _, results[player_id] = await timed(player_id, self._fetch_local_gsv_chunk(session, params, text, 0, player_id, record_stats=False))
+        elif self.provider_name == "siliconflow":
+            probes = [timed(player_id, loop.run_in_executor(self.executor, self._generate_siliconflow_chunk_sync, voice_uri, text, 0, player_id, False))
+                        for player_id, voice_uri in self.voice_map.items()]
+            results = dict(await asyncio.gather(*probes))
+        else:
+            return {}
+        ready = sum(1 for latency in results.values() if latency is not None)
+        logging.info(f"TTS预热完成: {ready}/{len(results)} 个音色可用，延迟(ms): {results}")
+        return results
+
+    def reserve_audio_slot(self, player_id: int) -> AudioSlot | None:
+        """在发言产生时按顺序预约音频时段，未启用时间线时返回None。"""
+        return self.timeline.reserve(player_id) if self.timeline else None
+
+    async def _legacy_play_delay(self, player_id: int):
+        """未启用时间线时的固定播放延迟，1号玩家（首发）不延迟。"""
         if player_id != 1:
             audio_delay = TTS_CONFIG.get('audio_play_delay', 3.0)
             logging.info(f"玩家 {player_id} TTS播放延迟 {audio_delay} 秒（防止拥堵）")
-            await asyncio.sleep(audio_delay)
+            with self.tracer.async_span("audio_play_delay", cat="delay"):
+                await asyncio.sleep(audio_delay)
         else:
             logging.info(f"玩家 {player_id} 为首发，无需延迟")
-        
-        ref_audio_path = self.config['reference_audios'].get(player_id)
-        prompt_text = self.config['reference_texts'].get(player_id)
+
+    async def _emit_audio_chunk(self, player_id: int, audio_data: bytes, chunk_text: str, slot: AudioSlot | None):
+        """下发一个音频块；启用时间线时先等待轮到本发言者，并按真实时长顺延时间线。"""
+        if slot is not None and not slot.started:
+            with self.tracer.async_span("audio_timeline.wait", cat="delay"):
+                await slot.wait_turn()
+        encoded_chunk = base64.b64encode(audio_data).decode('utf-8')
+        self.socketio.emit('play_audio_chunk', {
+            'playerId': player_id, 
+            'audioChunk': encoded_chunk,
+            'format': self.audio_format
+        })
+        if slot is not None:
+            slot.add_chunk(self.timeline.estimate_duration(audio_data, chunk_text))
+
+    def _record_chunk_stats(self, player_id: int, text_chunk: str, audio_bytes: bytes, start_time: float):
+        """记录一个音频块的体积与生成延迟。"""
+        latency_ms = (time.monotonic() - start_time) * 1000
+        log_tts_chunk(self.provider_name, self.audio_format, player_id, text_chunk,
+                      len(audio_bytes), get_audio_duration(audio_bytes) or 0.0, latency_ms)
+
+    def _get_gsv_session(self) -> 'aiohttp.ClientSession':
+        """获取GSV会话，不存在或已关闭时新建（只在管理器的事件循环上调用）。"""
+        import aiohttp
+        if self._gsv_session is None or self._gsv_session.closed:
+            lookahead = max(0, int(TTS_CONFIG.get('gsv_lookahead', 2)))
+            self._gsv_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=lookahead + 1),
+                timeout=aiohttp.ClientTimeout(total=60)
+            )
+        return self._gsv_session
+
+    async def close(self):
+        """关闭持有的GSV会话。"""
+        session, self._gsv_session = self._gsv_session, None
+        if session and not session.closed:
+            await session.close()
+
+    async def _fetch_local_gsv_chunk(self, session: 'aiohttp.ClientSession', params: dict, chunk_text: str, chunk_index: int, player_id: int = None, record_stats: bool = True) -> bytes | None:
+        """请求单个文本块的GSV音频，失败时返回None。预热请求不计入统计。"""
+        req_params = params.copy()
+        req_params['text'] = chunk_text
+        start_time = time.monotonic()
+        try:
+            with self.tracer.async_span("tts.chunk", cat="tts", chunk_index=chunk_index) as span_args:
+                async with session.get(self.config['api_url'], params=req_params) as response:
+                    span_args['status'] = response.status
+                    if response.status == 200:
+                        audio_data = await response.read()
+                        span_args['bytes'] = len(audio_data)
+                        if record_stats:
+                            self._record_chunk_stats(player_id, chunk_text, audio_data, start_time)
+                        return audio_data
+                logging.error(f"本地TTS请求失败 (块 {chunk_index + 1}): {response.status}, {await response.text()}")
+        except Exception as e:
+            logging.error(f"本地TTS请求异常 (块 {chunk_index + 1}): {e}")
+        return None
+
+    def _gsv_params(self, player_id: int) -> dict | None:
+        """玩家对应的GSV请求参数（不含文本），参考音频或文本缺失时返回None。没有专属音色的座位借用其他座位的音色。"""
+        seat = voice_seat(player_id, self.config['reference_audios'])
+        ref_audio_path = self.config['reference_audios'].get(seat)
+        prompt_text = self.config['reference_texts'].get(seat)
         if not ref_audio_path or not prompt_text:
-            logging.error(f"玩家 {player_id} 的本地TTS配置缺失。")
-            return
-        
-        params = {
+            return None
+        return {
             "text_lang": "zh", 
             "ref_audio_path": os.path.abspath(ref_audio_path), 
             "prompt_lang": "zh", 
             "prompt_text": prompt_text, 
-            "media_type": "wav", 
+            "media_type": self.audio_format, 
             "temperature": 0.8
         }
+
+    async def _stream_local_gsv(self, player_id: int, chunks: List[str], slot: AudioSlot | None = None):
+        """
+        处理本地GSV TTS的逻辑。
+        在发送当前块的同时预取后续 gsv_lookahead 个块，发送顺序与文本顺序保持一致。
+        """
+        params = self._gsv_params(player_id)
+        if params is None:
+            logging.error(f"玩家 {player_id} 的本地TTS配置缺失。")
+            return
         
-        async with aiohttp.ClientSession() as session:
-            for chunk_text in chunks:
-                req_params = params.copy()
-                req_params['text'] = chunk_text
-                try:
-                    async with session.get(self.config['api_url'], params=req_params, timeout=60) as response:
-                        if response.status == 200:
-                            audio_data = await response.read()
-                            encoded_chunk = base64.b64encode(audio_data).decode('utf-8')
-                            self.socketio.emit('play_audio_chunk', {
-                                'playerId': player_id, 
-                                'audioChunk': encoded_chunk
-                            })
-                        else:
-                            logging.error(f"本地TTS请求失败: {response.status}, {await response.text()}")
-                except Exception as e:
-                    logging.error(f"本地TTS请求异常: {e}")
+        session = self._get_gsv_session()
+        lookahead = max(0, int(TTS_CONFIG.get('gsv_lookahead', 2)))
+        pending = deque()
+        next_index = 0
+        try:
+            while next_index < len(chunks) or pending:
+                # 保持最多 lookahead+1 个请求在途
+                while next_index < len(chunks) and len(pending) <= lookahead:
+                    pending.append(asyncio.ensure_future(
+                        self._fetch_local_gsv_chunk(session, params, chunks[next_index], next_index, player_id)
+                    ))
+                    next_index += 1
+                chunk_index = next_index - len(pending)
+                audio_data = await pending.popleft()
+                if audio_data:
+                    await self._emit_audio_chunk(player_id, audio_data, chunks[chunk_index], slot)
+        finally:
+            for task in pending:
+                task.cancel()
 
-    def _generate_siliconflow_chunk_sync(self, voice_uri: str, text_chunk: str, chunk_index: int = 0) -> bytes | None:
+    def _generate_siliconflow_chunk_sync(self, voice_uri: str, text_chunk: str, chunk_index: int = 0, player_id: int = None, record_stats: bool = True) -> bytes | None:
         """
         根据成功案例优化的同步音频生成函数。
         每次调用都创建独立的OpenAI客户端实例，确保线程安全。
@@ -315,9 +601,10 @@ class TTSManager:
             logging.info(f"调试信息 - Model: {self.config['model']}")
             logging.info(f"调试信息 - Voice URI: {voice_uri}")
             logging.info(f"调试信息 - Text length: {len(text_chunk)}")
-            logging.info(f"调试信息 - Response format: mp3")
+            logging.info(f"调试信息 - Response format: {self.audio_format}")
             
             # 每次调用都创建新的客户端实例，避免线程间冲突
+            from openai import OpenAI
             client = OpenAI(
                 api_key=self.config['api_key'],
                 base_url="https://api.siliconflow.cn/v1"
@@ -330,18 +617,23 @@ class TTSManager:
             
             # 使用流式响应创建音频
             logging.info(f"开始调用OpenAI客户端生成音频块 {chunk_index + 1}")
-            with client.audio.speech.with_streaming_response.create(
-                model=self.config['model'],
-                voice=voice_uri,
-                input=text_chunk,
-                response_format="mp3"
-            ) as response:
+            start_time = time.monotonic()
+            with tracing.span("tts.chunk", cat="tts", chunk_index=chunk_index) as span_args, \
+                    client.audio.speech.with_streaming_response.create(
+                        model=self.config['model'],
+                        voice=voice_uri,
+                        input=text_chunk,
+                        response_format=self.audio_format
+                    ) as response:
                 # 记录响应状态
                 logging.info(f"收到响应，状态: {response.http_response.status_code}")
                 # 读取所有音频数据到内存
                 audio_bytes = response.read()
+                span_args['bytes'] = len(audio_bytes)
             
             logging.info(f"音频块 {chunk_index + 1} 生成完成，大小: {len(audio_bytes)} 字节")
+            if record_stats:
+                self._record_chunk_stats(player_id, text_chunk, audio_bytes, start_time)
             return audio_bytes
             
         except Exception as e:
@@ -352,23 +644,19 @@ class TTSManager:
             logging.error(f"使用的Voice URI: {voice_uri}")
             return None
 
-    async def _stream_siliconflow(self, player_id: int, chunks: List[str]):
+    async def _stream_siliconflow(self, player_id: int, chunks: List[str], slot: AudioSlot | None = None):
         """
         通过线程池并发执行同步的TTS请求，然后按顺序将结果发送到客户端。
         """
-        # 添加TTS播放延迟，但1号玩家（首发）不延迟
-        if player_id != 1:
-            audio_delay = TTS_CONFIG.get('audio_play_delay', 3.0)
-            logging.info(f"玩家 {player_id} TTS播放延迟 {audio_delay} 秒（防止拥堵）")
-            await asyncio.sleep(audio_delay)
-        else:
-            logging.info(f"玩家 {player_id} 为首发，无需延迟")
-        
         # 调试信息：打印voice映射情况
         logging.info(f"调试信息 - 当前voice映射内容: {self.voice_map}")
         logging.info(f"调试信息 - 查找玩家 {player_id} 的voice URI...")
         
         voice_uri = self.voice_map.get(str(player_id))
+        if not voice_uri and self.voice_map:
+            # 没有专属音色的座位（大桌模式的新增座位）借用其他座位的音色
+            seat = voice_seat(player_id, [int(pid) for pid in self.voice_map if pid.isdigit()])
+            voice_uri = self.voice_map.get(str(seat)) if seat else None
         if not voice_uri:
             logging.error(f"在 '{VOICE_MAP_FILE}' 中找不到玩家 {player_id} 的声音URI。")
             logging.error(f"可用的玩家ID: {list(self.voice_map.keys())}")
@@ -393,37 +681,33 @@ class TTSManager:
         
         loop = asyncio.get_running_loop()
         
-        # 为每个文本块创建一个在线程池中运行的任务
+        # 为每个文本块创建一个在线程池中运行的任务；run_in_executor 不传递上下文，需复制以保留trace关联字段
         tasks = [
             loop.run_in_executor(
                 self.executor, 
+                contextvars.copy_context().run,
                 self._generate_siliconflow_chunk_sync, 
                 voice_uri, 
                 chunk,
-                i  # 添加块索引用于日志
+                i,  # 添加块索引用于日志
+                player_id
             )
             for i, chunk in enumerate(chunks)
         ]
         
         try:
-            # 等待所有线程任务完成
-            generated_audio_chunks = await asyncio.gather(*tasks, return_exceptions=True)
-            logging.info(f"玩家 {player_id} 的所有音频块生成完毕")
-
-            # 按顺序发送结果
+            # 按顺序等待并发送结果，首块完成即可开始播放，无需等待全部块生成
             successful_count = 0
-            for i, audio_data in enumerate(generated_audio_chunks):
-                if isinstance(audio_data, Exception):
-                    logging.error(f"音频块 {i + 1} 生成异常: {audio_data}")
+            for i, task in enumerate(tasks):
+                try:
+                    audio_data = await task
+                except Exception as e:
+                    logging.error(f"音频块 {i + 1} 生成异常: {e}")
                     continue
                     
                 if audio_data:
                     try:
-                        encoded_chunk = base64.b64encode(audio_data).decode('utf-8')
-                        self.socketio.emit('play_audio_chunk', {
-                            'playerId': player_id, 
-                            'audioChunk': encoded_chunk
-                        })
+                        await self._emit_audio_chunk(player_id, audio_data, chunks[i], slot)
                         successful_count += 1
                         # 添加小延迟确保音频块有序播放
                         await asyncio.sleep(0.1)
@@ -432,16 +716,31 @@ class TTSManager:
                 else:
                     logging.warning(f"音频块 {i + 1} 为空，跳过")
             
+            logging.info(f"玩家 {player_id} 的所有音频块生成完毕")
             logging.info(f"玩家 {player_id} 成功发送了 {successful_count}/{len(chunks)} 个音频块")
             
         except Exception as e:
             logging.error(f"玩家 {player_id} 的音频生成过程中出现异常: {e}")
 
-    async def stream_tts_for_player(self, player_id: int, text: str):
+    async def stream_tts_for_player(self, player_id: int, text: str, slot: AudioSlot | None = None, speech_id: str = None):
         """
         总入口函数：分割文本并根据配置调用相应的TTS处理函数。
-        简单的延迟机制，确保1号玩家无延迟，其他玩家有配置的延迟。
+        启用音频时间线时按预约的时段排队播放，否则退回固定的 audio_play_delay 延迟。
         """
+        with tracing.use(self.tracer, speech_id=speech_id, player_id=player_id), \
+                self.tracer.async_span("tts.speech", cat="tts", chars=len(text or "")):
+            if slot is None:
+                slot = self.reserve_audio_slot(player_id)
+            if slot is None:
+                await self._legacy_play_delay(player_id)
+            try:
+                await self._stream_tts(player_id, text, slot)
+            finally:
+                if slot is not None:
+                    slot.finish()
+
+    async def _stream_tts(self, player_id: int, text: str, slot: AudioSlot | None):
+        """分割文本并分派到具体供应商的流式处理函数。"""
         if not text or not text.strip():
             logging.warning(f"玩家 {player_id} 的文本为空，跳过TTS")
             return
@@ -457,10 +756,10 @@ class TTSManager:
 
         try:
             if self.provider_name == "local_gsv":
-                await self._stream_local_gsv(player_id, chunks)
+                await self._stream_local_gsv(player_id, chunks, slot)
             elif self.provider_name == "siliconflow":
-                await self._stream_siliconflow(player_id, chunks)
+                await self._stream_siliconflow(player_id, chunks, slot)
             else:
                 logging.error(f"不支持的TTS供应商: {self.provider_name}")
         except Exception as e:
-            logging.error(f"玩家 {player_id} TTS处理失败: {e}", exc_info=True)
\ No newline at end of file
+            logging.error(f"玩家 {player_id} TTS处理失败: {e}", exc_info=True)
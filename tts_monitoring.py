@@ -0,0 +1,63 @@
+# tts_monitoring.py
+
+import json
+import logging
+import threading
+from datetime import datetime
+
+LOG_FILE = 'tts_calls.jsonl'
+
+# 进程内按音频格式累计的统计，便于比较不同格式的体积与延迟
+_format_stats = {}
+_stats_lock = threading.Lock()
+
+def log_tts_chunk(provider: str, audio_format: str, player_id: int, text: str, size_bytes: int, audio_seconds: float, latency_ms: float):
+    """
+    将一次TTS音频块生成的信息记录到日志文件，并累计到按格式分组的统计中。
+
+    :param provider: TTS供应商名称
+    :param audio_format: 音频格式 ('wav', 'ogg', 'aac', 'mp3', 'opus' 等)
+    :param player_id: 发言玩家ID
+    :param text: 本块对应的文本
+    :param size_bytes: 音频数据字节数（base64编码前）
+    :param audio_seconds: 音频时长（秒）
+    :param latency_ms: 从发起请求到拿到完整音频的耗时（毫秒）
+    """
+    with _stats_lock:
+        stats = _format_stats.setdefault(audio_format, {"chunks": 0, "bytes": 0, "audio_seconds": 0.0, "latency_ms": 0.0})
+        stats["chunks"] += 1
+        stats["bytes"] += size_bytes
+        stats["audio_seconds"] += audio_seconds
+        stats["latency_ms"] += latency_ms
+
+    try:
+        log_entry = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "provider": provider,
+            "format": audio_format,
+            "player_id": player_id,
+            "text_chars": len(text),
+            "size_bytes": size_bytes,
+            "audio_seconds": round(audio_seconds, 3),
+            "latency_ms": round(latency_ms, 2)
+        }
+
+        with open(LOG_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+
+    except Exception as e:
+        logging.error(f"写入TTS监控日志失败: {e}")
+
+def get_format_stats() -> dict:
+    """返回按音频格式汇总的统计：块数、总字节、每秒音频字节数与平均延迟。"""
+    with _stats_lock:
+        summary = {}
+        for audio_format, stats in _format_stats.items():
+            chunks = stats["chunks"]
+            summary[audio_format] = {
+                "chunks": chunks,
+                "bytes": stats["bytes"],
+                "bytes_per_audio_second": round(stats["bytes"] / stats["audio_seconds"], 1) if stats["audio_seconds"] else None,
+                "avg_latency_ms": round(stats["latency_ms"] / chunks, 2) if chunks else None
+            }
+        return summary